@@ -0,0 +1,67 @@
+"""
+Throughput benchmark for the alert rules engine (petoneerAlerts.py).
+
+Builds a fleet of fountains from synthetic device info (no API access needed), runs
+an initial full evaluation pass, then a number of incremental passes where a small
+share of the fleet has changed, and reports the rule-evaluation throughput.
+
+Usage:  python bench_alerts.py [number_of_fountains] [passes] [percent_changed]
+"""
+import random
+import sys
+import time as timer
+
+from petoneerFountain import *
+from petoneerAlerts import *
+from bench_memory import getDeviceInfo
+
+NUM_FOUNTAINS                   = 10000
+NUM_PASSES                      = 20
+PERCENT_CHANGED                 = 5
+
+def run(num_fountains:int, num_passes:int, percent_changed:float):
+    now = int(timer.time())
+    random.seed(1)
+
+    fleet = [PetoneerFountain(f"PWW{index:013d}", "", getDeviceInfo(index, now), {"en": 0, "time": [0, 0]})
+        for index in range(num_fountains)]
+    snapshots = [fountain.snapshot() for fountain in fleet]
+
+    engine = PetoneerAlertEngine()
+
+    started = timer.perf_counter()
+    events = engine.evaluate(snapshots)
+    full_secs = timer.perf_counter() - started
+    full_rules = engine.rules_evaluated
+
+    print(f"Fountains:                 {num_fountains} ({len(engine.rules)} rules)")
+    print(f"Full pass:                 {full_secs * 1000:.1f}ms, {full_rules} rule evaluations, {len(events)} events "
+        f"({num_fountains / full_secs:.0f} fountains/s)")
+
+    incremental_secs = 0.0
+    incremental_events = 0
+    num_changed = int(num_fountains * percent_changed / 100)
+
+    for pass_number in range(num_passes):
+        for index in random.sample(range(num_fountains), num_changed):
+            fleet[index].applyPushUpdate({"tds": random.randint(20, 140), "level": random.randint(0, 4)})
+            snapshots[index] = fleet[index].snapshot()
+
+        started = timer.perf_counter()
+        incremental_events += len(engine.evaluate(snapshots))
+        incremental_secs += timer.perf_counter() - started
+
+    incremental_rules = engine.rules_evaluated - full_rules
+
+    print(f"Incremental passes:        {num_passes} x {percent_changed}% changed, "
+        f"{incremental_secs / num_passes * 1000:.1f}ms/pass, {incremental_events} events")
+    print(f"Rule evaluations:          {incremental_rules} "
+        f"(vs {full_rules * num_passes} for full re-checks)")
+    print(f"Throughput:                {num_fountains * num_passes / incremental_secs:.0f} fountains/s, "
+        f"{incremental_rules / incremental_secs:.0f} rule evaluations/s")
+    print(f"Active alerts:             {len(engine.active_alerts)}")
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if (len(sys.argv) > 1) else NUM_FOUNTAINS,
+        int(sys.argv[2]) if (len(sys.argv) > 2) else NUM_PASSES,
+        float(sys.argv[3]) if (len(sys.argv) > 3) else PERCENT_CHANGED)
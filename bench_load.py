@@ -0,0 +1,144 @@
+"""
+End-to-end load test against a simulated Revogi cloud (see petoneerSimulator.py).
+
+Starts the simulator in a separate process (so its CPU use is not counted against the
+client), then measures a full fleet refresh with the sync client (one fountain at a
+time) and the concurrent client (Petoneer.refresh_fountains), reporting fountains/s,
+requests/s, p50/p99 request latency and client CPU time per request.
+
+Optionally (--shards N) also measures the multi-process PetoneerShardedPoller.
+
+Usage:  python bench_load.py --fountains 10000 --workers 32 --latency-ms 20 --error-rate 0.01 --shards 4
+"""
+import argparse
+import multiprocessing
+import threading
+import time as timer
+
+import petoneerConst
+petoneerConst.Debug = 0
+
+from petoneer import *
+from petoneerSimulator import *
+
+class PetoneerMeasuringTransport:
+    """
+    Wraps a transport, recording the latency of every request made through it
+    """
+
+    def __init__(self, transport):
+        self._transport = transport
+        self._lock = threading.Lock()
+        self.latencies = []
+
+    def request(self, methodPath:str, payload:dict, headers:dict, timeout_secs:float = None):
+        started = timer.perf_counter()
+        try:
+            return self._transport.request(methodPath, payload, headers, timeout_secs)
+        finally:
+            elapsed = timer.perf_counter() - started
+            with self._lock:
+                self.latencies.append(elapsed)
+
+    def reset(self):
+        with self._lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+def serveSimulator(simulator_options:dict, url_queue):
+    simulator = PetoneerCloudSimulator(**simulator_options)
+    url_queue.put(simulator.api_url)
+    simulator.serve_forever()
+
+def getPercentile(sorted_values:list, percentile:float):
+    if (len(sorted_values) == 0):
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+def report(label:str, num_fountains:int, wall_secs:float, cpu_secs:float, latencies:list, failures:int):
+    latencies = sorted(latencies)
+    num_requests = max(1, len(latencies))
+
+    print(f"{label}")
+    print(f"  Fountains refreshed:     {num_fountains} ({failures} failed) in {wall_secs:.2f}s")
+    print(f"  Throughput:              {num_fountains / wall_secs:.1f} fountains/s, {len(latencies) / wall_secs:.1f} requests/s")
+    print(f"  Request latency:         p50 {getPercentile(latencies, 50) * 1000:.1f}ms, p99 {getPercentile(latencies, 99) * 1000:.1f}ms")
+    print(f"  Client CPU:              {cpu_secs / num_requests * 1000:.3f}ms per request")
+
+def run(options):
+    simulator_options = {
+        "num_fountains": options.fountains,
+        "latency": PetoneerSimulatedLatency.lognormal(options.latency_ms / 1000) if (options.latency_ms > 0) else None,
+        "error_rate": options.error_rate,
+        "max_requests_per_sec": options.max_rps,
+        "time_scale": options.time_scale,
+        "seed": 1
+    }
+
+    url_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serveSimulator, args=(simulator_options, url_queue), daemon=True)
+    server.start()
+
+    try:
+        api_url = url_queue.get(timeout=120)
+        transport = PetoneerMeasuringTransport(PetoneerHttpTransport(api_url))
+        PetoneerHelpers.setTransport(transport)
+
+        pet = Petoneer()
+        pet.authenticate("loadtest", "loadtest")
+        device_codes = [device['sn'] for device in pet.getRegisteredDevices()]
+        transport.reset()
+
+        print(f"Simulated fountains:       {len(device_codes)} (latency ~{options.latency_ms}ms, "
+            f"error rate {options.error_rate}, max {options.max_rps} requests/s)")
+
+        # Sync client - one fountain at a time, on a sample of the fleet
+        sample = device_codes[:options.sync_sample]
+        failures = 0
+        wall_started, cpu_started = timer.perf_counter(), timer.process_time()
+        for device_code in sample:
+            try:
+                PetoneerFountain(device_code, pet._auth_token)
+            except Exception:
+                failures += 1
+        report(f"Sync client (first {len(sample)} fountains):", len(sample),
+            timer.perf_counter() - wall_started, timer.process_time() - cpu_started, transport.reset(), failures)
+
+        # Concurrent client - whole fleet
+        wall_started, cpu_started = timer.perf_counter(), timer.process_time()
+        result = pet.refresh_fountains(device_codes, max_workers=options.workers, retries=1, retry_delay_secs=0.1)
+        report(f"Concurrent client ({options.workers} workers):", len(device_codes),
+            timer.perf_counter() - wall_started, timer.process_time() - cpu_started, transport.reset(), len(result.failed))
+
+        # Sharded client - whole fleet, split across worker processes (request latencies
+        # and CPU time are measured inside the workers, so only throughput is reported)
+        if (options.shards > 0):
+            with PetoneerShardedPoller(pet._auth_token, options.shards, max(1, options.workers // options.shards),
+                PetoneerHttpTransport(api_url)) as poller:
+
+                poller.setDevices(device_codes)
+                poller.refresh()        # first refresh creates the fountains in each worker
+
+                wall_started = timer.perf_counter()
+                snapshots, errors = poller.refresh()
+                wall_secs = timer.perf_counter() - wall_started
+
+            print(f"Sharded client ({options.shards} processes, {options.workers} workers in total):")
+            print(f"  Fountains refreshed:     {len(snapshots)} ({len(errors)} failed) in {wall_secs:.2f}s")
+            print(f"  Throughput:              {len(snapshots) / wall_secs:.1f} fountains/s")
+    finally:
+        PetoneerHelpers.setTransport(None)
+        server.terminate()
+        server.join()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the Petoneer client against a simulated Revogi cloud")
+    parser.add_argument("--fountains", type=int, default=10000, help="number of simulated fountains")
+    parser.add_argument("--workers", type=int, default=32, help="concurrent client workers")
+    parser.add_argument("--latency-ms", type=float, default=20, help="median simulated response latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="proportion of simulated HTTP 500 responses")
+    parser.add_argument("--max-rps", type=float, default=None, help="simulated throttling limit (requests/s)")
+    parser.add_argument("--time-scale", type=float, default=1.0, help="simulated time acceleration")
+    parser.add_argument("--sync-sample", type=int, default=200, help="fountains refreshed by the sync client")
+    parser.add_argument("--shards", type=int, default=0, help="worker processes for the sharded client (0 to skip)")
+    run(parser.parse_args())
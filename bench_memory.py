@@ -0,0 +1,117 @@
+"""
+Memory and garbage collection benchmark for large fleets of PetoneerFountain objects.
+
+Builds, updates and then drops a fleet of fountains (from synthetic device info, so
+no API access is needed), reads every fountain's state back (so lazily built details
+objects are counted), and reports the peak memory used (via tracemalloc) and the
+time spent in cyclic garbage collection. Also verifies that dropping the fleet leaves
+no reference cycles behind for the collector to clean up.
+
+Usage:  python bench_memory.py [number_of_fountains]
+"""
+import gc
+import sys
+import time as timer
+import tracemalloc
+
+from petoneerFountain import *
+import petoneerConst
+
+NUM_FOUNTAINS                   = 100000
+
+class GcPauseTimer:
+    """
+    Records the duration of every garbage collector run (via gc.callbacks)
+    """
+
+    def __init__(self):
+        self._started = None
+        self.collections = 0
+        self.total_secs = 0.0
+        self.max_secs = 0.0
+
+    def __enter__(self):
+        gc.callbacks.append(self._callback)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        gc.callbacks.remove(self._callback)
+
+    def _callback(self, phase, info):
+        if (phase == 'start'):
+            self._started = timer.perf_counter()
+        elif (self._started != None):
+            elapsed = timer.perf_counter() - self._started
+            self.collections += 1
+            self.total_secs += elapsed
+            self.max_secs = max(self.max_secs, elapsed)
+
+def getDeviceInfo(index:int, now:int):
+    return {
+        "filtertime": now - (index % 30) * 86400,
+        "led": 1,
+        "ledmode": 1,
+        "level": index % 5,
+        "motortime": now - (index % 60) * 86400,
+        "section": [0, 0],
+        "switch": 1,
+        "tds": 20 + (index % 120),
+        "tdslevel": 0,
+        "time": now,
+        "watertime": now - (index % 5) * 86400
+    }
+
+def run(num_fountains:int):
+    now = int(timer.time())
+    schedule_info = {"en": 0, "time": [0, 0]}
+
+    gc.collect()
+    tracemalloc.start()
+
+    with GcPauseTimer() as gc_pauses:
+        started = timer.perf_counter()
+        fleet = [PetoneerFountain(f"PWW{index:013d}", "", getDeviceInfo(index, now), dict(schedule_info))
+            for index in range(num_fountains)]
+        build_secs = timer.perf_counter() - started
+        build_current, build_peak = tracemalloc.get_traced_memory()
+
+        # Touch every fountain's details (as a dashboard or export would), so any
+        # lazily built objects are part of the measurements
+        started = timer.perf_counter()
+        snapshots = [fountain.snapshot() for fountain in fleet]
+        access_secs = timer.perf_counter() - started
+        access_current, access_peak = tracemalloc.get_traced_memory()
+        del snapshots
+
+        started = timer.perf_counter()
+        for index, fountain in enumerate(fleet):
+            fountain.applyPushUpdate({"tds": 30 + (index % 90), "level": (index + 1) % 5, "time": now + 60})
+        update_secs = timer.perf_counter() - started
+
+        started = timer.perf_counter()
+        del fleet
+        drop_secs = timer.perf_counter() - started
+
+        started = timer.perf_counter()
+        unreachable = gc.collect()
+        final_collect_secs = timer.perf_counter() - started
+
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Fountains:                 {num_fountains}")
+    print(f"Build:                     {build_secs:.2f}s ({build_current / num_fountains:.0f} bytes/fountain)")
+    print(f"Access:                    {access_secs:.2f}s ({(access_current - build_current) / num_fountains:.0f} bytes/fountain, incl. snapshots)")
+    print(f"Update:                    {update_secs:.2f}s")
+    print(f"Drop:                      {drop_secs:.2f}s")
+    print(f"Peak memory:               {peak / 1024 / 1024:.1f} MiB")
+    print(f"Memory after drop:         {current / 1024 / 1024:.1f} MiB")
+    print(f"GC collections:            {gc_pauses.collections}")
+    print(f"GC pause total / max:      {gc_pauses.total_secs * 1000:.1f}ms / {gc_pauses.max_secs * 1000:.1f}ms")
+    print(f"Final collection:          {final_collect_secs * 1000:.1f}ms ({unreachable} unreachable objects)")
+
+    return unreachable
+
+if __name__ == "__main__":
+    petoneerConst.Debug = 0
+    run(int(sys.argv[1]) if (len(sys.argv) > 1) else NUM_FOUNTAINS)
@@ -1,6 +1,14 @@
 """
 Python module to get device details from Petoneer / Revogi equipment
 Tested with a Petoneer Fresco Pro water fountain
+
+Threading model: a Petoneer client can be shared between threads. Each cached
+PetoneerFountain is only ever created once - the thread creating it fetches its
+details without holding any lock, while other threads asking for the same serial
+number wait for it (the bookkeeping is guarded by a fixed set of striped locks),
+and the access token is replaced under its own lock. Each
+PetoneerFountain serializes its own writers and publishes its state with an
+atomic swap (see petoneerFountain.py), so readers never block.
 """
 
 import datetime
@@ -8,6 +16,7 @@ from datetime import time, date, timedelta
 import logging
 import urllib.parse
 import math
+import threading
 
 import requests
 import json
@@ -16,6 +25,16 @@ import hashlib
 from petoneerErrors import *
 from petoneerHelpers import *
 from petoneerConst import *
+from petoneerBulk import *
+from petoneerFountain import *
+from petoneerPush import *
+from petoneerShardedPoller import *
+from petoneerStateTable import *
+from petoneerDeviceRegistry import *
+from petoneerGateway import *
+from petoneerAnalytics import *
+from petoneerSchedule import *
+from petoneerOffline import *
 
 class Petoneer:
     """
@@ -25,6 +44,15 @@ class Petoneer:
         self._country_code = country
         self._timezone = timezone
         self._devices_json_collection = None
+        self._registry = PetoneerDeviceRegistry()
+        self._last_registry_delta = None
+        self._fountains = {}
+        self._fountain_locks = [threading.Lock() for stripe in range(NUM_FOUNTAIN_LOCK_STRIPES)]
+        self._fountains_creating = {}
+        self._token_lock = threading.Lock()
+        self._auth_token = None
+        self._push_listener = None
+        self._offline_tracker = PetoneerOfflineTracker()
         
         if (Debug):
             print("Petoneer Python API")
@@ -42,7 +70,7 @@ class Petoneer:
 
         return
 
-    def authenticate(self, username, password, country="AU", timezone="Australia/Melbourne"):
+    def authenticate(self, username, password, country="AU", timezone="Australia/Melbourne", deadline = None):
         self._country_code = country
         self._timezone = timezone
     
@@ -78,25 +106,27 @@ class Petoneer:
         # response back which will include our authentication token that
         # we need to use for subsequent requests.
         # 
-        resp = PetoneerHelpers.getAPIrequest(API_LOGIN_PATH, auth_payload)
+        resp = PetoneerHelpers.getAPIrequest(API_LOGIN_PATH, auth_payload, None, PetoneerDeadline.fromTimeout(deadline))
 
         if (resp.status_code == 200):
-            json_resp = resp.json()            
+            with PetoneerProfiler.phase('decode'):
+                json_resp = resp.json()
 
             if ('data' in json_resp):
                 # Verify we have an auth token in the response - if so, store it
                 if ('accessToken' in json_resp['data']):
-                    self._auth_token = json_resp['data']['accessToken']
-                    self._auth_token_obtained = datetime.now()
-                    self._auth_token_expires = (self._auth_token_obtained + 
-                        timedelta(seconds=json_resp['data']['expiresIn']))
+                    with self._token_lock:
+                        self._auth_token_obtained = datetime.now()
+                        self._auth_token_expires = (self._auth_token_obtained + 
+                            timedelta(seconds=json_resp['data']['expiresIn']))
+                        self._auth_token = json_resp['data']['accessToken']
 
                     if (Debug):
-                        print("Authentication successful - token ***" + self._auth_token[-4:])
+                        print("Authentication successful - token ***" + self._getAuthToken()[-4:])
 
                     # In case this method has been called externally, return the session 
                     # access token.
-                    return self._auth_token
+                    return self._getAuthToken()
                 else:
                     raise PetoneerAuthenticationError(resp.status_code, username, resp.text, 'Unable to authenticate with Petoneer API - Incorrect username or password?')
             else:
@@ -104,7 +134,12 @@ class Petoneer:
         else:
             raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Error from Server while authenticating user - Unknown Error')
 
-    def getRegisteredDevices(self):
+    def _getAuthToken(self):
+        # The token is replaced (together with its expiry) under the token lock
+        with self._token_lock:
+            return self._auth_token
+
+    def getRegisteredDevices(self, deadline = None):
         if (Debug):
             print("Getting All Devices")
         payload = {
@@ -112,36 +147,272 @@ class Petoneer:
           "protocol": "3"
         }
         
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_LIST_PATH, payload, self._auth_token)
+        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_LIST_PATH, payload, self._getAuthToken(), PetoneerDeadline.fromTimeout(deadline))
 
         if (resp.status_code == 200):
-            json_resp = resp.json()
+            with PetoneerProfiler.phase('decode'):
+                json_resp = resp.json()
 
             if (('data' in json_resp) and ('dev' in json_resp['data'])):
 
-                # Update the internally stored collection of device info (JSON)
+                # Update the internally stored collection of device info (JSON), and
+                # apply just the changes to the device registry
                 self._devices_json_collection = json_resp['data']['dev']
+                self._last_registry_delta = self._registry.sync(self._devices_json_collection)
+
+                # Drop cached fountains for devices no longer linked to the account
+                for device_code in self._last_registry_delta.removed:
+                    with self._getFountainLock(device_code):
+                        self._fountains.pop(device_code, None)
+
+                if (self._offline_tracker != None):
+                    self._offline_tracker.syncRegistry(self._registry, self._last_registry_delta)
+
+                if (Debug) and (self._last_registry_delta.has_changes):
+                    print(f"Device list changed: {self._last_registry_delta}")
 
                 # Just in case this method was called externally, and not by the
                 # init constructor, return the JSON result to caller as well
                 return self._devices_json_collection
 
-#
-#
-# TO-DO:    For each device detailed by Petoneer API as linked to this user account,
-#           create an instance of PetoneerFountain (for fountains at least!) automatically.
-#           Additionally, if an existing list of devices is being stored, maintain the list
-#           if any new devices are added/removed (otherwise just call the "update()" method
-#           for each instance of PetoneerFountain.
-#
-#
-
             else:
                 raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to obtain list of Petoneer Fountain devices - Server Error')
         else:
             raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to obtain list of Petoneer Fountain devices - Server Error')
 
 
+    @property
+    def registry(self):
+        # PetoneerDeviceRegistry of the devices linked to the account (lookups by sn / mac / name)
+        return self._registry
+
+    def syncRegisteredDevices(self, deadline = None):
+        """
+        Re-fetches the device list and returns the PetoneerDeviceRegistryDelta
+        (devices added, removed or modified since the last fetch)
+        """
+        self.getRegisteredDevices(deadline)
+        return self._last_registry_delta
+
+    @property
+    def offline_tracker(self):
+        return self._offline_tracker
+
+    def setOfflineTracker(self, offline_tracker):
+        """
+        Replaces the PetoneerOfflineTracker used by refresh_fountains and sharded
+        pollers (eg: with one that has on_online / on_offline callbacks). Passing
+        None polls every fountain, every time.
+        """
+        self._offline_tracker = offline_tracker
+        if (offline_tracker != None):
+            offline_tracker.syncRegistry(self._registry)
+
+    def getFountain(self, device_code):
+        """
+        Returns the (cached) PetoneerFountain instance for the given serial number,
+        creating it on first use
+        """
+        if (device_code == ""):
+            raise PetoneerInvalidArgument('getFountain', 'device_code', 'The device serial number must be provided')
+
+        fountain = self._fountains.get(device_code)
+
+        while (fountain == None):
+            # The stripe lock only guards the dicts - the fountain (which fetches its
+            # details) is created outside it, and other threads asking for the same
+            # serial number wait for that creation rather than fetching again
+            with self._getFountainLock(device_code):
+                fountain = self._fountains.get(device_code)
+                if (fountain != None):
+                    break
+
+                created = self._fountains_creating.get(device_code)
+                if (created == None):
+                    created = self._fountains_creating[device_code] = threading.Event()
+                    is_creator = True
+                else:
+                    is_creator = False
+
+            if (not is_creator):
+                # If the creating thread fails, try again (as the creator, or waiting on a new one)
+                created.wait()
+                fountain = self._fountains.get(device_code)
+                continue
+
+            try:
+                fountain = PetoneerFountain(device_code, self._getAuthToken())
+                with self._getFountainLock(device_code):
+                    self._fountains[device_code] = fountain
+                return fountain
+            finally:
+                with self._getFountainLock(device_code):
+                    self._fountains_creating.pop(device_code, None)
+                created.set()
+
+        fountain._access_token = self._getAuthToken()
+        return fountain
+
+    def _getFountainIfOnline(self, device_code):
+        # For fleet-wide operations - an offline fountain is recorded and skipped (None)
+        # rather than aborting the whole operation
+        try:
+            return self.getFountain(device_code)
+        except PetoneerFountainDeviceOffline:
+            if (self._offline_tracker != None):
+                self._offline_tracker.markOffline(device_code)
+            return None
+
+    def _getFountainLock(self, device_code):
+        return self._fountain_locks[hash(device_code) % len(self._fountain_locks)]
+
+    def startPushUpdates(self, device_codes = None, transport = None):
+        """
+        Opens a push channel (WebSocket by default) for the given fountains (or all
+        fountains registered with the account), so their state is updated as soon as
+        it changes rather than by polling. Falls back to polling if the channel drops.
+        """
+        if (device_codes == None):
+            if (self._devices_json_collection == None):
+                self.getRegisteredDevices()
+            device_codes = self._registry.serials
+
+        for device_code in device_codes:
+            self._getFountainIfOnline(device_code)
+
+        self.stopPushUpdates()
+        # The listener reads the current token on every (re)connect, so it survives token refreshes
+        self._push_listener = PetoneerPushListener(self._fountains, self._getAuthToken, transport)
+        self._push_listener.start()
+
+        return self._push_listener
+
+    def stopPushUpdates(self):
+        if (self._push_listener != None):
+            self._push_listener.stop()
+            self._push_listener = None
+
+    def refresh_fountains(self, device_codes = None, force = True, state_table = None, history = None, **bulk_options):
+        """
+        Updates many fountains concurrently (all fountains registered with the account,
+        unless a list of serial numbers is given) - returns a PetoneerBulkResult. The
+        requests run in the background priority lane unless another is given.
+
+        Fountains known to be offline are left out (and out of the result) until their
+        next probe is due - see petoneerOffline.py.
+
+        If a PetoneerStateTableWriter is given, the refreshed fountains are published
+        to it (see petoneerStateTable.py), and if a PetoneerFountainHistory is given
+        they are recorded in it (see petoneerAnalytics.py)
+        """
+        if (device_codes == None):
+            if (self._devices_json_collection == None):
+                self.getRegisteredDevices()
+            device_codes = self._registry.serials
+
+        offline_tracker = self._offline_tracker
+        if (offline_tracker != None):
+            device_codes = offline_tracker.filterDue(device_codes)
+
+        def refresh(device_code):
+            try:
+                fountain = self._fountains.get(device_code)
+                if (fountain != None):
+                    fountain._access_token = self._getAuthToken()
+                    fountain.update(force=force)
+                else:
+                    # Creating the fountain fetches its details
+                    self.getFountain(device_code)
+            except PetoneerFountainDeviceOffline:
+                if (offline_tracker != None):
+                    offline_tracker.markOffline(device_code)
+                raise
+
+            if (offline_tracker != None):
+                offline_tracker.markOnline(device_code)
+
+        bulk_options.setdefault('priority', PRIORITY_BACKGROUND)
+        result = PetoneerBulk.run('refresh_fountains', refresh, device_codes, **bulk_options)
+
+        if (state_table != None):
+            state_table.publishFountains(self._fountains[device.device_code] for device in result.succeeded)
+
+        if (history != None):
+            history.recordFountains(self._fountains[device.device_code] for device in result.succeeded)
+
+        return result
+
+    def createShardedPoller(self, num_workers = None, device_codes = None, **poller_options):
+        """
+        Starts a PetoneerShardedPoller (multi-process polling, see petoneerShardedPoller.py)
+        for the given fountains, or all fountains registered with the account
+        """
+        if (device_codes == None):
+            if (self._devices_json_collection == None):
+                self.getRegisteredDevices()
+            device_codes = self._registry.serials
+
+        poller_options.setdefault('offline_tracker', self._offline_tracker)
+        poller = PetoneerShardedPoller(self._getAuthToken(), num_workers, **poller_options)
+        poller.setDevices(device_codes)
+        return poller
+
+    def export_ndjson(self, target, device_codes = None):
+        """
+        Streams a snapshot of each fountain (all fountains created so far, unless a
+        list of serial numbers is given) to a file path, file object or socket
+        """
+        if (device_codes == None):
+            fountains = list(self._fountains.values())
+        else:
+            fountains = (self._getFountainIfOnline(device_code) for device_code in device_codes)
+            fountains = (fountain for fountain in fountains if (fountain != None))
+
+        return PetoneerSnapshotExporter.export_ndjson(fountains, target)
+
+    def createStateTable(self, name, capacity = None):
+        """
+        Creates a shared-memory state table (see petoneerStateTable.py) and publishes
+        every fountain created so far to it. Capacity defaults to the number of
+        fountains registered with the account.
+        """
+        if (capacity == None):
+            if (self._devices_json_collection == None):
+                self.getRegisteredDevices()
+            capacity = max(len(self._devices_json_collection), len(self._fountains), 1)
+
+        state_table = PetoneerStateTableWriter(name, capacity)
+        state_table.publishFountains(list(self._fountains.values()))
+        return state_table
+
+    def startGateway(self, device_codes = None, **gateway_options):
+        """
+        Starts a PetoneerGateway (see petoneerGateway.py) serving the cached state of
+        the given fountains (or all fountains registered with the account) over HTTP
+        """
+        gateway = PetoneerGateway(self, device_codes, **gateway_options)
+        gateway.start()
+        return gateway
+
+    def _sendCommand(self, device_code, methodPath, payload, error_message, deadline = None):
+        # Sends a device command, and writes its result through to the cached
+        # PetoneerFountain (if there is one) so it does not need refetching
+        response_data = PetoneerHelpers.sendDeviceCommand(methodPath, payload, self._getAuthToken(),
+            error_message, PetoneerDeadline.fromTimeout(deadline))
+
+        fountain = self._fountains.get(device_code)
+        if (fountain != None):
+            fountain.applyCommandResult(methodPath, payload, response_data)
+
+        return response_data
+
+    def set_state(self, device_code, pump = None, led = None, led_dimmed = None, deadline = None):
+        return self.getFountain(device_code).set_state(pump, led, led_dimmed, deadline)
+
+    def bulk_set_state(self, device_codes, pump = None, led = None, led_dimmed = None, **bulk_options):
+        return PetoneerBulk.run('bulk_set_state',
+            lambda device_code: self.set_state(device_code, pump, led, led_dimmed), device_codes, **bulk_options)
+
 #
 #
 # TO-DO: Move all of the below methods over to the PetoneerFountain class, or nest within logical
@@ -149,102 +420,47 @@ class Petoneer:
 #
 #
 
-    def turn_on(self, device_code):
+    def turn_on(self, device_code, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('turn_on', 'device_code', 'The device serial number must be provided')
 
-        payload = { 
-            "sn": device_code, 
-            "protocol": "3", 
-            "switch": 1 
-        }
-
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_SWITCH_PATH, payload, self._auth_token)
-
-        if (resp.status_code == 200): 
-            json_resp = resp.json()
+        payload = PetoneerHelpers.getSwitchPayload(device_code, True)
 
-            device_details = json_resp['data']
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to switch on Petoneer Fountain - Server Error')
+        return self._sendCommand(device_code, API_DEVICE_SWITCH_PATH, payload,
+            'Unable to switch on Petoneer Fountain - Server Error',
+            deadline)
 
-    def turn_off(self, device_code):
+    def turn_off(self, device_code, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('turn_off', 'device_code', 'The device serial number must be provided')
 
-        payload = {
-            "sn": device_code, 
-            "protocol": "3", 
-            "switch": 0 
-        }
+        payload = PetoneerHelpers.getSwitchPayload(device_code, False)
 
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_SWITCH_PATH, payload, self._auth_token)
+        return self._sendCommand(device_code, API_DEVICE_SWITCH_PATH, payload,
+            'Unable to switch off Petoneer Fountain - Server Error',
+            deadline)
 
-        if (resp.status_code == 200):
-            json_resp = resp.json()
-
-            device_details = json_resp['data']
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to switch off Petoneer Fountain - Server Error')
-
-    def turn_led_on(self, device_code, leds_dimmed = False):
+    def turn_led_on(self, device_code, leds_dimmed = False, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('turn_led_on', 'device_code', 'The device serial number must be provided')
 
-        if (leds_dimmed):
-            # create payload with LED dimming schedule that spans from 00:00 to 23:59hrs
-            payload = { 
-                "sn": device_code, 
-                "protocol": "3", 
-                "ledmode": 1, 
-                "section": [0, 1439], 
-                "led": 1 
-            }
-            # create a payload with no scheduled times for LED dimming
-        else:
-            payload = { 
-                "sn": device_code, 
-                "protocol": "3", 
-                "ledmode": 1, 
-                "section": [0, 0], 
-                "led": 1 
-            }
-        
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_LED_PATH, payload, self._auth_token)
+        payload = PetoneerHelpers.getLedPayload(device_code, True, leds_dimmed)
 
-        if (resp.status_code == 200):
-            json_resp = resp.json()
+        return self._sendCommand(device_code, API_DEVICE_LED_PATH, payload,
+            'Unable to switch on Petoneer Fountain LEDs - Server Error',
+            deadline)
 
-            device_details = json_resp['data']
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to switch on Petoneer Fountain LEDs - Server Error')
-
-    def turn_led_off(self, device_code):
+    def turn_led_off(self, device_code, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('turn_led_off', 'device_code', 'The device serial number must be provided') 
 
-        payload = {         
-            "sn": device_code, 
-            "ledmode": 0, 
-            "section": [0,1439], 
-            "protocol": "3", 
-            "led": 0 
-        }
-
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_LED_PATH, payload, self._auth_token)
+        payload = PetoneerHelpers.getLedPayload(device_code, False)
 
-        if (resp.status_code == 200):
-            json_resp = resp.json()
+        return self._sendCommand(device_code, API_DEVICE_LED_PATH, payload,
+            'Unable to switch off Petoneer Fountain LEDs - Server Error',
+            deadline)
 
-            device_details = json_resp['data']
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to switch off Petoneer Fountain LEDs - Server Error')
-
-    def reset_filter_change_timer(self, device_code):
+    def reset_filter_change_timer(self, device_code, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('reset_filter_change_timer', 'device_code', 'The device serial number must be provided') 
 
@@ -253,17 +469,11 @@ class Petoneer:
             "protocol": "3"
         }
 
-        resp = PetoneerHelpers.getAPIrequest(API_RESET_FILTER_CHANGE_TIMER, payload, self._auth_token)
-
-        if (resp.status_code == 200):
-            json_resp = resp.json()
+        return self._sendCommand(device_code, API_RESET_FILTER_CHANGE_TIMER, payload,
+            'Unable to reset the "filter change" countdown timer on Petoneer Fountain - Server Error',
+            deadline)
 
-            device_details = json_resp['data']
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to reset the "filter change" countdown timer on Petoneer Fountain - Server Error')
-
-    def reset_water_change_timer(self, device_code):
+    def reset_water_change_timer(self, device_code, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('reset_water_change_timer', 'device_code', 'The device serial number must be provided') 
 
@@ -272,17 +482,11 @@ class Petoneer:
             "protocol": "3"
         }
 
-        resp = PetoneerHelpers.getAPIrequest(API_RESET_WATER_CHANGE_TIMER, payload, self._auth_token)
-
-        if (resp.status_code == 200):
-            json_resp = resp.json()
+        return self._sendCommand(device_code, API_RESET_WATER_CHANGE_TIMER, payload,
+            'Unable to reset the "water changeover" countdown timer on Petoneer Fountain - Server Error',
+            deadline)
 
-            device_details = json_resp['data']
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to reset the "water changeover" countdown timer on Petoneer Fountain - Server Error')
-
-    def reset_clean_pump_timer(self, device_code):
+    def reset_clean_pump_timer(self, device_code, deadline = None):
         if (device_code == ""):
             raise PetoneerInvalidArgument('reset_clean_pump_timer', 'device_code', 'The device serial number must be provided') 
 
@@ -291,13 +495,109 @@ class Petoneer:
             "protocol": "3"
         }
 
-        resp = PetoneerHelpers.getAPIrequest(API_RESET_CLEAN_PUMP_TIMER, payload, self._auth_token)
+        return self._sendCommand(device_code, API_RESET_CLEAN_PUMP_TIMER, payload,
+            'Unable to reset the "pump clean" countdown timer on Petoneer Fountain - Server Error',
+            deadline)
 
-        if (resp.status_code == 200):
-            json_resp = resp.json()
+    def set_pump_schedule(self, device_code, start_time, end_time, enabled = True, deadline = None):
+        # Pump only runs between start_time and end_time (datetime.time, or minutes since midnight) while enabled
+        if (device_code == ""):
+            raise PetoneerInvalidArgument('set_pump_schedule', 'device_code', 'The device serial number must be provided')
 
-            device_details = json_resp['data']
-            
-            return device_details
-        else:
-            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to reset the "pump clean" countdown timer on Petoneer Fountain - Server Error')
+        payload = PetoneerHelpers.getTimerPayload(device_code, enabled,
+            PetoneerSchedule.toMinutes(start_time, 'set_pump_schedule', 'start_time'),
+            PetoneerSchedule.toMinutes(end_time, 'set_pump_schedule', 'end_time'))
+
+        return self._sendCommand(device_code, API_DEVICE_TIMER_PATH, payload,
+            'Unable to set the pump schedule on Petoneer Fountain - Server Error',
+            deadline)
+
+    def set_led_dimming_schedule(self, device_code, start_time, end_time, deadline = None):
+        # Switches the LEDs on, dimmed between start_time and end_time (datetime.time, or minutes since midnight)
+        if (device_code == ""):
+            raise PetoneerInvalidArgument('set_led_dimming_schedule', 'device_code', 'The device serial number must be provided')
+
+        payload = PetoneerHelpers.getLedDimmingPayload(device_code,
+            PetoneerSchedule.toMinutes(start_time, 'set_led_dimming_schedule', 'start_time'),
+            PetoneerSchedule.toMinutes(end_time, 'set_led_dimming_schedule', 'end_time'))
+
+        return self._sendCommand(device_code, API_DEVICE_LED_PATH, payload,
+            'Unable to set the LED dimming schedule on Petoneer Fountain - Server Error',
+            deadline)
+
+#
+# Bulk versions of the above commands - each takes a list of device serial numbers
+# and returns a PetoneerBulkResult (see petoneerBulk.py for the available options,
+# eg: max_workers, retries, max_error_rate).
+#
+
+    def bulk_turn_on(self, device_codes, **bulk_options):
+        return PetoneerBulk.run('bulk_turn_on', self.turn_on, device_codes, **bulk_options)
+
+    def bulk_turn_off(self, device_codes, **bulk_options):
+        return PetoneerBulk.run('bulk_turn_off', self.turn_off, device_codes, **bulk_options)
+
+    def bulk_turn_led_on(self, device_codes, leds_dimmed = False, **bulk_options):
+        return PetoneerBulk.run('bulk_turn_led_on',
+            lambda device_code: self.turn_led_on(device_code, leds_dimmed), device_codes, **bulk_options)
+
+    def bulk_turn_led_off(self, device_codes, **bulk_options):
+        return PetoneerBulk.run('bulk_turn_led_off', self.turn_led_off, device_codes, **bulk_options)
+
+    def bulk_reset_filter_change_timer(self, device_codes, **bulk_options):
+        return PetoneerBulk.run('bulk_reset_filter_change_timer', self.reset_filter_change_timer, device_codes, **bulk_options)
+
+    def bulk_reset_water_change_timer(self, device_codes, **bulk_options):
+        return PetoneerBulk.run('bulk_reset_water_change_timer', self.reset_water_change_timer, device_codes, **bulk_options)
+
+    def bulk_reset_clean_pump_timer(self, device_codes, **bulk_options):
+        return PetoneerBulk.run('bulk_reset_clean_pump_timer', self.reset_clean_pump_timer, device_codes, **bulk_options)
+
+    def _verifySchedule(self, device_code, verify_func):
+        try:
+            verify_func()
+        except PetoneerScheduleNotApplied:
+            # The command was written through to the cached fountain - refetch what the device really has
+            fountain = self._fountains.get(device_code)
+            if (fountain != None):
+                fountain.update(force=True)
+            raise
+
+    def bulk_set_pump_schedule(self, device_codes, start_time, end_time, enabled = True, stagger_minutes = 0, verify = True, **bulk_options):
+        """
+        Sets the pump schedule of many fountains - the window of each fountain is
+        moved on by up to stagger_minutes (spread evenly, in the order given), and
+        if verify is set, checked against the schedule the device reports (the
+        command's response, or the schedule read back from the API). The result of
+        each device is its (start minute, end minute) window.
+        """
+        windows = PetoneerSchedule.getStaggeredWindows(device_codes,
+            PetoneerSchedule.toMinutes(start_time, 'bulk_set_pump_schedule', 'start_time'),
+            PetoneerSchedule.toMinutes(end_time, 'bulk_set_pump_schedule', 'end_time'), stagger_minutes)
+
+        def set_schedule(device_code):
+            start_minute, end_minute = windows[device_code]
+            response_data = self.set_pump_schedule(device_code, start_minute, end_minute, enabled)
+            if (verify):
+                self._verifySchedule(device_code, lambda: PetoneerSchedule.verifyPumpSchedule(device_code, self._getAuthToken(), response_data, enabled, start_minute, end_minute))
+            return windows[device_code]
+
+        return PetoneerBulk.run('bulk_set_pump_schedule', set_schedule, list(windows.keys()), **bulk_options)
+
+    def bulk_set_led_dimming_schedule(self, device_codes, start_time, end_time, stagger_minutes = 0, verify = True, **bulk_options):
+        """
+        Sets the LED dimming window of many fountains (see bulk_set_pump_schedule
+        for stagger_minutes and verify)
+        """
+        windows = PetoneerSchedule.getStaggeredWindows(device_codes,
+            PetoneerSchedule.toMinutes(start_time, 'bulk_set_led_dimming_schedule', 'start_time'),
+            PetoneerSchedule.toMinutes(end_time, 'bulk_set_led_dimming_schedule', 'end_time'), stagger_minutes)
+
+        def set_schedule(device_code):
+            start_minute, end_minute = windows[device_code]
+            response_data = self.set_led_dimming_schedule(device_code, start_minute, end_minute)
+            if (verify):
+                self._verifySchedule(device_code, lambda: PetoneerSchedule.verifyLedDimmingSchedule(device_code, self._getAuthToken(), response_data, start_minute, end_minute))
+            return windows[device_code]
+
+        return PetoneerBulk.run('bulk_set_led_dimming_schedule', set_schedule, list(windows.keys()), **bulk_options)
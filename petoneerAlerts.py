@@ -0,0 +1,266 @@
+"""
+Declarative alert rules over fountain state (see petoneerSnapshot.py). Rules are
+compiled once into a per-field index, and each evaluation pass only re-checks the
+rules whose fields have changed since the fountain's previous snapshot. Alerts are
+de-duplicated (an event is only produced when an alert is raised or cleared), and
+rules can have a separate clear threshold for hysteresis - eg: raise when TDS goes
+above 100, but only clear once it has dropped back to 90 or below.
+"""
+from datetime import datetime
+import operator
+
+from petoneerErrors import *
+from petoneerSnapshot import *
+
+ALERT_RAISED                    = "raised"
+ALERT_CLEARED                   = "cleared"
+
+ALERT_OPERATORS = {
+    ">":    operator.gt,
+    ">=":   operator.ge,
+    "<":    operator.lt,
+    "<=":   operator.le,
+    "==":   operator.eq,
+    "!=":   operator.ne
+}
+
+class PetoneerAlertRule:
+    """
+    A single alert rule - either a comparison of one snapshot field against a
+    threshold (eg: PetoneerAlertRule("tds_undrinkable", "tds", ">", 100, clear_threshold=90)),
+    or a custom predicate over one or more fields (see PetoneerAlertRule.custom)
+    """
+
+    def __init__(self, name:str, field:str, op:str = "==", threshold = True, clear_threshold = None, severity:str = "warning"):
+        if (field not in SNAPSHOT_FIELDS):
+            raise PetoneerInvalidArgument('PetoneerAlertRule', 'field', f'Unknown fountain snapshot field "{field}"')
+
+        if (op not in ALERT_OPERATORS):
+            raise PetoneerInvalidArgument('PetoneerAlertRule', 'op', f'Unknown comparison operator "{op}"')
+
+        compare = ALERT_OPERATORS[op]
+        clear_threshold = threshold if (clear_threshold == None) else clear_threshold
+
+        self._name = name
+        self._fields = (field,)
+        self._severity = severity
+        self._description = f"{field} {op} {threshold}"
+        self._raise_predicate = lambda snapshot: compare(getattr(snapshot, field), threshold)
+        self._hold_predicate = lambda snapshot: compare(getattr(snapshot, field), clear_threshold)
+
+    @staticmethod
+    def custom(name:str, fields, predicate, severity:str = "warning", description:str = ""):
+        """
+        Rule raised while predicate(snapshot) is True - 'fields' must list every
+        snapshot field the predicate reads, so the rule is re-checked when they change
+        """
+        for field in fields:
+            if (field not in SNAPSHOT_FIELDS):
+                raise PetoneerInvalidArgument('PetoneerAlertRule.custom', 'fields', f'Unknown fountain snapshot field "{field}"')
+
+        rule = PetoneerAlertRule.__new__(PetoneerAlertRule)
+        rule._name = name
+        rule._fields = tuple(fields)
+        rule._severity = severity
+        rule._description = description if (description != "") else name
+        rule._raise_predicate = predicate
+        rule._hold_predicate = predicate
+        return rule
+
+    def __repr__(self):
+        return f'PetoneerAlertRule({self._name}: {self._description})'
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def severity(self):
+        return self._severity
+
+    @property
+    def description(self):
+        return self._description
+
+    def isActive(self, snapshot, was_active:bool):
+        # An active alert stays active until the (hysteresis) clear condition is met
+        if (was_active):
+            return self._hold_predicate(snapshot)
+        return self._raise_predicate(snapshot)
+
+# -------------------------------------------------
+
+class PetoneerAlertEvent:
+    """
+    An alert being raised or cleared for a fountain
+    """
+
+    def __init__(self, device_code:str, rule:PetoneerAlertRule, state:str, snapshot):
+        self._device_code = device_code
+        self._rule = rule
+        self._state = state
+        self._snapshot = snapshot
+        self._timestamp = datetime.now()
+
+    def __repr__(self):
+        return f'PetoneerAlertEvent({self._device_code}: {self._rule.name} {self._state})'
+
+    @property
+    def device_code(self):
+        return self._device_code
+
+    @property
+    def rule(self):
+        return self._rule
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def is_raised(self):
+        return (self._state == ALERT_RAISED)
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+# -------------------------------------------------
+
+class PetoneerAlertEngine:
+    """
+    Evaluates a set of rules against fountain snapshots, one pass at a time. Only
+    rules reading a field that changed since the fountain's previous snapshot are
+    re-checked, and only transitions (raised / cleared) are reported.
+    """
+
+    def __init__(self, rules:list = None):
+        self._rules = list(rules) if (rules != None) else PetoneerAlertEngine.getDefaultRules()
+
+        names = [rule.name for rule in self._rules]
+        if (len(names) != len(set(names))):
+            raise PetoneerInvalidArgument('PetoneerAlertEngine', 'rules', 'Alert rule names must be unique')
+
+        # Compile: snapshot field index -> rules reading that field
+        self._rules_by_field_index = {}
+        for rule in self._rules:
+            for field in rule.fields:
+                self._rules_by_field_index.setdefault(SNAPSHOT_FIELDS.index(field), []).append(rule)
+        self._watched_field_indexes = tuple(sorted(self._rules_by_field_index.keys()))
+
+        self._last_snapshots = {}
+        self._active_alerts = {}
+        self._rules_evaluated = 0
+
+    @staticmethod
+    def getDefaultRules():
+        return [
+            PetoneerAlertRule("water_undrinkable", "tds", ">", 100, clear_threshold=90, severity="critical"),
+            PetoneerAlertRule("water_change_required", "is_water_change_required"),
+            PetoneerAlertRule("filter_change_required", "is_filter_change_required"),
+            PetoneerAlertRule("pump_cleaning_required", "is_pump_cleaning_required"),
+            PetoneerAlertRule("water_level_empty", "level", "==", 0, severity="critical"),
+            PetoneerAlertRule.custom("pump_off_outside_schedule",
+                ("is_pump_switched_on", "is_pump_scheduled", "pump_schedule_start", "pump_schedule_end", "device_time"),
+                PetoneerAlertEngine._isPumpOffOutsideSchedule,
+                description="pump switched off while no schedule has it turned off")
+        ]
+
+    @staticmethod
+    def _isPumpOffOutsideSchedule(snapshot):
+        if (snapshot.is_pump_switched_on):
+            return False
+        if (not snapshot.is_pump_scheduled):
+            return True
+
+        device_time = datetime.fromtimestamp(snapshot.device_time)
+        device_minutes = (device_time.hour * 60) + device_time.minute
+
+        # Pump is expected to be running inside its schedule window (which may cross midnight, eg: 22:00 - 06:00)
+        start = snapshot.pump_schedule_start
+        end = snapshot.pump_schedule_end
+        if (start <= end):
+            return ((start <= device_minutes) and (device_minutes < end))
+        return ((device_minutes >= start) or (device_minutes < end))
+
+    @property
+    def rules(self):
+        return list(self._rules)
+
+    @property
+    def active_alerts(self):
+        """
+        Dict of (device serial number, rule name) -> PetoneerAlertEvent that raised it
+        """
+        return dict(self._active_alerts)
+
+    @property
+    def rules_evaluated(self):
+        return self._rules_evaluated
+
+    def evaluate(self, snapshots):
+        """
+        Evaluates the rules against an iterable of PetoneerFountainSnapshot, and
+        returns the list of PetoneerAlertEvent for alerts raised or cleared
+        """
+        events = []
+        rules_by_field_index = self._rules_by_field_index
+        watched_field_indexes = self._watched_field_indexes
+        active_alerts = self._active_alerts
+        last_snapshots = self._last_snapshots
+        evaluated = 0
+
+        for snapshot in snapshots:
+            device_code = snapshot.sn
+            previous = last_snapshots.get(device_code)
+            last_snapshots[device_code] = snapshot
+
+            if (previous == None):
+                rules = self._rules
+            else:
+                rules = None
+                for index in watched_field_indexes:
+                    if (snapshot[index] != previous[index]):
+                        if (rules == None):
+                            rules = set()
+                        rules.update(rules_by_field_index[index])
+
+                if (rules == None):
+                    continue
+
+            for rule in rules:
+                evaluated += 1
+                key = (device_code, rule.name)
+                was_active = (key in active_alerts)
+
+                if (rule.isActive(snapshot, was_active)):
+                    if (not was_active):
+                        event = PetoneerAlertEvent(device_code, rule, ALERT_RAISED, snapshot)
+                        active_alerts[key] = event
+                        events.append(event)
+                elif (was_active):
+                    del active_alerts[key]
+                    events.append(PetoneerAlertEvent(device_code, rule, ALERT_CLEARED, snapshot))
+
+        self._rules_evaluated += evaluated
+        return events
+
+    def evaluate_fountains(self, fountains):
+        return self.evaluate(fountain.snapshot() for fountain in fountains)
+
+    def forget(self, device_code:str):
+        """
+        Drops all state (and active alerts) held for a fountain - eg: once it has been
+        removed from the account
+        """
+        self._last_snapshots.pop(device_code, None)
+        for key in [key for key in self._active_alerts if (key[0] == device_code)]:
+            del self._active_alerts[key]
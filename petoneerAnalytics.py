@@ -0,0 +1,323 @@
+"""
+Fleet-wide analytics and forecasting over recorded fountain history. A
+PetoneerFountainHistory keeps the recent tds / level / watertime / filtertime /
+motortime samples of every fountain (recorded from snapshots, eg: after each
+refresh), and PetoneerFleetAnalytics computes, for thousands of fountains in one
+vectorized pass:
+
+    - the TDS drift rate of each fountain (ppm per day, since its last water change)
+    - the predicted time until its water level reaches "Empty"
+    - flags for sudden TDS jumps (anomalies)
+    - the projected service date of each maintenance counter (water, filter, pump)
+
+The analytics need NumPy, which is an optional dependency - it is only imported
+when an analysis is run (recording history works without it).
+
+    history = PetoneerFountainHistory()
+    pet.refresh_fountains(history=history)          # after every refresh
+    forecast = PetoneerFleetAnalytics.analyse(history)
+    for visit in forecast.getServiceSchedule(days_ahead=7):
+        print(visit)
+"""
+from collections import deque
+import json
+import threading
+
+from petoneerErrors import *
+from petoneerConst import *
+
+HISTORY_FIELDS                  = ("time", "tds", "level", "watertime", "filtertime", "motortime")
+HISTORY_MAX_SAMPLES             = 2016          # a week of samples at 5 minute intervals
+
+# A TDS change between two samples (without a water change in between) is flagged
+# when it is at least this many ppm, and this many times the fountain's typical change
+ANALYTICS_TDS_JUMP_MIN_PPM      = 50
+ANALYTICS_TDS_JUMP_MAD_FACTOR   = 6.0
+
+SERVICE_WATER_CHANGE            = "water_change"
+SERVICE_FILTER_CHANGE           = "filter_change"
+SERVICE_PUMP_CLEAN              = "pump_clean"
+
+def _requireNumpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Petoneer fleet analytics require NumPy - install it with "pip install numpy"')
+    return numpy
+
+class PetoneerFountainHistory:
+    """
+    Recent samples (see HISTORY_FIELDS) of every fountain, oldest first - at most
+    max_samples per fountain. Times are the device's own unix timestamps.
+    """
+
+    def __init__(self, max_samples:int = HISTORY_MAX_SAMPLES):
+        if (max_samples < 2):
+            raise PetoneerInvalidArgument('PetoneerFountainHistory', 'max_samples', 'At least two samples per fountain are required')
+
+        self._max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def __contains__(self, device_code):
+        return (device_code in self._samples)
+
+    @property
+    def serials(self):
+        return list(self._samples.keys())
+
+    def getSamples(self, device_code:str):
+        return list(self._samples.get(device_code, ()))
+
+    def record(self, snapshot):
+        """
+        Records a PetoneerFountainSnapshot (or a snapshot dict, eg: a line of an
+        NDJSON export). Returns False if the fountain's device time hasn't moved on
+        since its last sample (nothing new to record).
+        """
+        if (isinstance(snapshot, dict)):
+            device_code = snapshot["sn"]
+            sample = (snapshot["device_time"], snapshot["tds"], snapshot["level"],
+                snapshot["watertime"], snapshot["filtertime"], snapshot["motortime"])
+        else:
+            device_code = snapshot.sn
+            sample = (snapshot.device_time, snapshot.tds, snapshot.level,
+                snapshot.watertime, snapshot.filtertime, snapshot.motortime)
+
+        with self._lock:
+            samples = self._samples.get(device_code)
+            if (samples == None):
+                samples = self._samples[device_code] = deque(maxlen=self._max_samples)
+            elif (sample[0] <= samples[-1][0]):
+                return False
+
+            samples.append(sample)
+            return True
+
+    def recordAll(self, snapshots):
+        return sum(1 for snapshot in snapshots if (self.record(snapshot)))
+
+    def recordFountains(self, fountains):
+        return self.recordAll(fountain.snapshot() for fountain in fountains)
+
+    def loadNdjson(self, file_path:str):
+        """
+        Records every line of one or more NDJSON snapshot exports (see
+        PetoneerSnapshotExporter.export_ndjson) - returns the number of samples added
+        """
+        with open(file_path, 'r', encoding='utf-8') as ndjson_file:
+            return self.recordAll(json.loads(line) for line in ndjson_file if (line.strip() != ""))
+
+    def forget(self, device_code:str):
+        with self._lock:
+            return (self._samples.pop(device_code, None) != None)
+
+    def toArrays(self, device_codes:list = None):
+        """
+        Returns (list of serial numbers, dict of field -> 2D array), one row per
+        fountain and one column per sample (oldest first, right aligned so the latest
+        sample of every fountain is in the last column). Missing samples are NaN.
+        """
+        np = _requireNumpy()
+
+        with self._lock:
+            if (device_codes == None):
+                device_codes = list(self._samples.keys())
+            rows = [tuple(self._samples.get(device_code, ())) for device_code in device_codes]
+
+        width = max((len(row) for row in rows), default=0)
+        data = np.full((len(rows), max(width, 1), len(HISTORY_FIELDS)), np.nan)
+
+        for (index, row) in enumerate(rows):
+            if (len(row) > 0):
+                data[index, width - len(row):, :] = row
+
+        return device_codes, {field: data[:, :, column] for (column, field) in enumerate(HISTORY_FIELDS)}
+
+# -------------------------------------------------
+
+class PetoneerFleetForecast:
+    """
+    Result of PetoneerFleetAnalytics.analyse - one entry per fountain in each array
+    (in the order of 'serials'). Times are unix timestamps, NaN where unknown.
+    """
+
+    def __init__(self, serials:list, analysed_at:float, columns:dict):
+        self._serials = serials
+        self._analysed_at = analysed_at
+        self._columns = columns
+        self._index = {device_code: index for (index, device_code) in enumerate(serials)}
+
+    def __len__(self):
+        return len(self._serials)
+
+    def __getattr__(self, name):
+        # Columns (eg: forecast.tds_drift_per_day) are exposed as attributes
+        columns = self.__dict__.get('_columns')
+        if (columns != None) and (name in columns):
+            return columns[name]
+        raise AttributeError(name)
+
+    @property
+    def serials(self):
+        return self._serials
+
+    @property
+    def analysed_at(self):
+        return self._analysed_at
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def get(self, device_code:str):
+        """
+        Returns the forecast for one fountain as a dict (None if not analysed)
+        """
+        index = self._index.get(device_code)
+        if (index == None):
+            return None
+
+        result = {"sn": device_code}
+        for (name, column) in self._columns.items():
+            value = column[index].item()
+            result[name] = (None if (value != value) else value)
+        return result
+
+    def to_dicts(self):
+        return [self.get(device_code) for device_code in self._serials]
+
+    def getServiceSchedule(self, days_ahead:float = 7):
+        """
+        Returns the services due within days_ahead (or overdue), soonest first, as
+        a list of dicts: {"sn", "service", "due", "overdue"}
+        """
+        np = _requireNumpy()
+        horizon = self._analysed_at + (days_ahead * 86400)
+        visits = []
+
+        for (service, column) in ((SERVICE_WATER_CHANGE, self._columns["water_change_due"]),
+                                  (SERVICE_FILTER_CHANGE, self._columns["filter_change_due"]),
+                                  (SERVICE_PUMP_CLEAN, self._columns["pump_clean_due"])):
+            for index in np.flatnonzero(column <= horizon):
+                due = column[index].item()
+                visits.append({"sn": self._serials[index], "service": service, "due": due, "overdue": (due <= self._analysed_at)})
+
+        visits.sort(key=lambda visit: visit["due"])
+        return visits
+
+# -------------------------------------------------
+
+class PetoneerFleetAnalytics:
+    """
+    Class that provides static functions to analyse a PetoneerFountainHistory
+    """
+
+    @staticmethod
+    def analyse(history:PetoneerFountainHistory, device_codes:list = None, now:float = None,
+        tds_jump_min_ppm:float = ANALYTICS_TDS_JUMP_MIN_PPM, tds_jump_mad_factor:float = ANALYTICS_TDS_JUMP_MAD_FACTOR):
+        """
+        Analyses every fountain in the history (or the given serial numbers) in one
+        vectorized pass - returns a PetoneerFleetForecast with the columns:
+
+            samples                 number of samples used
+            tds, level              latest values
+            tds_drift_per_day       TDS trend (ppm per day) since the last water change
+            level_drift_per_day     water level trend (levels per day) since the last water change
+            empty_at                predicted time the water level reaches Empty
+                                    (NaN if the level is not falling)
+            secs_until_empty        empty_at - now (0 if already empty)
+            tds_jumps               number of sudden TDS jumps in the history
+            tds_jump_latest         1.0 if the latest sample is a sudden TDS jump
+            water_change_due        when the water needs changing (the 5 day counter,
+                                    or earlier if the fountain is forecast to run dry)
+            filter_change_due       when the filter needs changing (30 day counter)
+            pump_clean_due          when the pump needs cleaning (60 day counter)
+        """
+        np = _requireNumpy()
+
+        serials, arrays = history.toArrays(device_codes)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return PetoneerFleetAnalytics._analyse(np, serials, arrays, now, tds_jump_min_ppm, tds_jump_mad_factor)
+
+    @staticmethod
+    def _analyse(np, serials:list, arrays:dict, now:float, tds_jump_min_ppm:float, tds_jump_mad_factor:float):
+        times = arrays["time"]
+        tds = arrays["tds"]
+        level = arrays["level"]
+        watertime = arrays["watertime"]
+
+        valid = ~np.isnan(times)
+        latest_time = times[:, -1]
+        if (now == None):
+            now = float(np.nanmax(latest_time)) if (np.any(~np.isnan(latest_time))) else 0.0
+
+        # Trends only use samples taken since the latest water change (a water change
+        # resets both TDS and the water level)
+        since_water_change = valid & (times >= watertime[:, -1:])
+        tds_drift = PetoneerFleetAnalytics._slopes(np, times, tds, since_water_change) * 86400
+        level_drift = PetoneerFleetAnalytics._slopes(np, times, level, since_water_change) * 86400
+
+        latest_level = level[:, -1]
+        empty_at = np.where(level_drift < 0, latest_time + (latest_level / -level_drift) * 86400, np.nan)
+        empty_at = np.where(latest_level <= 0, latest_time, empty_at)
+        secs_until_empty = np.maximum(empty_at - now, 0)
+
+        # Sudden TDS jumps: consecutive changes far larger than the fountain's typical
+        # (median absolute) change, ignoring changes across a water change
+        tds_change = np.diff(tds, axis=1)
+        comparable = valid[:, 1:] & valid[:, :-1] & (np.diff(watertime, axis=1) == 0)
+        tds_change = np.where(comparable, tds_change, np.nan)
+        typical_change = PetoneerFleetAnalytics._nanMedian(np, np.abs(tds_change))
+        threshold = np.maximum(tds_jump_min_ppm, tds_jump_mad_factor * np.nan_to_num(typical_change))
+        jumps = np.abs(tds_change) > threshold[:, None]
+
+        water_change_due = np.fmin(watertime[:, -1] + SECONDS_FOUNTAIN_WATER_CHANGE, empty_at)
+
+        columns = {
+            "samples": valid.sum(axis=1).astype(float),
+            "tds": tds[:, -1],
+            "level": latest_level,
+            "tds_drift_per_day": tds_drift,
+            "level_drift_per_day": level_drift,
+            "empty_at": empty_at,
+            "secs_until_empty": secs_until_empty,
+            "tds_jumps": jumps.sum(axis=1).astype(float),
+            "tds_jump_latest": (jumps[:, -1].astype(float) if (jumps.shape[1] > 0) else np.zeros(len(serials))),
+            "water_change_due": water_change_due,
+            "filter_change_due": arrays["filtertime"][:, -1] + SECONDS_FOUNTAIN_FILTER_CHANGE,
+            "pump_clean_due": arrays["motortime"][:, -1] + SECONDS_FOUNTAIN_CLEAN_PUMP
+        }
+
+        return PetoneerFleetForecast(serials, now, columns)
+
+    @staticmethod
+    def _slopes(np, x, y, mask):
+        # Least-squares slope of y against x for every row, using only the masked
+        # samples (NaN for rows with fewer than two distinct x values)
+        count = mask.sum(axis=1)
+        x = np.where(mask, x, 0.0)
+        y = np.where(mask, y, 0.0)
+
+        x_mean = x.sum(axis=1) / count
+        y_mean = y.sum(axis=1) / count
+        x_centred = np.where(mask, x - x_mean[:, None], 0.0)
+        y_centred = np.where(mask, y - y_mean[:, None], 0.0)
+        variance = (x_centred * x_centred).sum(axis=1)
+        slopes = (x_centred * y_centred).sum(axis=1) / variance
+
+        return np.where((count >= 2) & (variance > 0), slopes, np.nan)
+
+    @staticmethod
+    def _nanMedian(np, values):
+        # Row medians ignoring NaN (NaN for rows with no values), without the
+        # "All-NaN slice" warnings of numpy.nanmedian
+        result = np.full(values.shape[0], np.nan)
+        has_values = np.any(~np.isnan(values), axis=1)
+        if (np.any(has_values)):
+            result[has_values] = np.nanmedian(values[has_values], axis=1)
+        return result
@@ -0,0 +1,243 @@
+"""
+Runs a single Petoneer device command across many fountains at once (eg: turning
+off every fountain on an account), with a bounded number of requests in flight,
+retries for transient server errors, and a per-device report of the outcome.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic, sleep
+
+from petoneerErrors import *
+from petoneerConst import *
+from petoneerProfiler import *
+from petoneerPriority import *
+
+BULK_STATUS_SUCCESS             = "success"
+BULK_STATUS_FAILED              = "failed"
+BULK_STATUS_SKIPPED             = "skipped"
+
+class PetoneerBulkDeviceResult:
+    """
+    Outcome of a bulk command for a single fountain (identified by serial number)
+    """
+
+    def __init__(self, device_code:str, status:str = BULK_STATUS_SKIPPED, result = None, error:Exception = None, attempts:int = 0, elapsed_secs:float = 0.0):
+        self._device_code = device_code
+        self._status = status
+        self._result = result
+        self._error = error
+        self._attempts = attempts
+        self._elapsed_secs = elapsed_secs
+
+    def __repr__(self):
+        return f'PetoneerBulkDeviceResult({self._device_code}, {self._status}, attempts={self._attempts}, elapsed={self._elapsed_secs:.3f}s)'
+
+    @property
+    def device_code(self):
+        return self._device_code
+
+    @property
+    def status(self):
+        return self._status
+
+    @property
+    def is_success(self):
+        return (self._status == BULK_STATUS_SUCCESS)
+
+    @property
+    def result(self):
+        return self._result
+
+    @property
+    def error(self):
+        return self._error
+
+    @property
+    def attempts(self):
+        return self._attempts
+
+    @property
+    def elapsed_secs(self):
+        return self._elapsed_secs
+
+    def to_dict(self):
+        return {
+            "sn": self._device_code,
+            "status": self._status,
+            "attempts": self._attempts,
+            "elapsed_secs": self._elapsed_secs,
+            "error": (str(self._error) if (self._error != None) else None)
+        }
+
+# -------------------------------------------------
+
+class PetoneerBulkResult:
+    """
+    Report for a bulk command run across a collection of fountains - holds one
+    PetoneerBulkDeviceResult per requested serial number (in the requested order)
+    """
+
+    def __init__(self, command_name:str, device_results:list, aborted:bool = False, elapsed_secs:float = 0.0):
+        self._command_name = command_name
+        self._device_results = device_results
+        self._aborted = aborted
+        self._elapsed_secs = elapsed_secs
+
+    def __repr__(self):
+        return (f'PetoneerBulkResult({self._command_name}: {len(self.succeeded)} succeeded, ' +
+            f'{len(self.failed)} failed, {len(self.skipped)} skipped, aborted={self._aborted})')
+
+    def __iter__(self):
+        return iter(self._device_results)
+
+    def __len__(self):
+        return len(self._device_results)
+
+    @property
+    def command_name(self):
+        return self._command_name
+
+    @property
+    def results(self):
+        return self._device_results
+
+    @property
+    def succeeded(self):
+        return [r for r in self._device_results if (r.status == BULK_STATUS_SUCCESS)]
+
+    @property
+    def failed(self):
+        return [r for r in self._device_results if (r.status == BULK_STATUS_FAILED)]
+
+    @property
+    def skipped(self):
+        return [r for r in self._device_results if (r.status == BULK_STATUS_SKIPPED)]
+
+    @property
+    def error_rate(self):
+        attempted = len(self.succeeded) + len(self.failed)
+        if (attempted == 0):
+            return 0.0
+        return len(self.failed) / attempted
+
+    @property
+    def aborted(self):
+        return self._aborted
+
+    @property
+    def elapsed_secs(self):
+        return self._elapsed_secs
+
+    def to_dict(self):
+        return {
+            "command": self._command_name,
+            "aborted": self._aborted,
+            "elapsed_secs": self._elapsed_secs,
+            "error_rate": self.error_rate,
+            "devices": [r.to_dict() for r in self._device_results]
+        }
+
+# -------------------------------------------------
+
+class PetoneerBulk:
+    """
+    Class that provides static helper functions to run a single-device command
+    (eg: Petoneer.turn_off) across a list of fountain serial numbers
+    """
+
+    # Errors that are worth retrying - anything else (eg: an invalid argument)
+    # will fail the same way on every attempt
+    RETRYABLE_ERRORS = (PetoneerServerError, PetoneerApiServerOffline, PetoneerInvalidServerResponse, PetoneerRequestTimeout)
+
+    @staticmethod
+    def run(command_name:str, command_func, device_codes:list, max_workers:int = 8, retries:int = 2,
+        retry_delay_secs:float = 1.0, max_error_rate:float = None, min_error_rate_samples:int = 10, priority:int = None):
+        """
+        Calls command_func(device_code) for every device code, keeping at most
+        max_workers calls in flight. Retryable failures are re-attempted up to
+        'retries' more times (with a linear back-off of retry_delay_secs).
+
+        If max_error_rate is set (0.0 - 1.0), no further devices are started once at
+        least min_error_rate_samples devices have finished and the proportion of
+        failures reaches that rate - any remaining devices are reported as skipped.
+        Fountains that turn out to be offline are also reported as skipped (with the
+        PetoneerFountainDeviceOffline error), and don't count as failures.
+
+        If priority is set (eg: PRIORITY_BACKGROUND), every API request made by the
+        command runs in that priority lane (see petoneerPriority.py).
+        """
+        if (max_workers < 1):
+            raise PetoneerInvalidArgument(command_name, 'max_workers', 'At least one worker is required')
+
+        if (retries < 0):
+            raise PetoneerInvalidArgument(command_name, 'retries', 'Number of retries cannot be negative')
+
+        if (max_error_rate != None) and ((max_error_rate < 0) or (max_error_rate > 1)):
+            raise PetoneerInvalidArgument(command_name, 'max_error_rate', 'Error rate threshold must be between 0.0 and 1.0')
+
+        device_codes = list(device_codes)
+        results = {}
+        aborted = False
+        started = monotonic()
+
+        with PetoneerProfiler.cycle(command_name), ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            next_index = 0
+            completed = 0
+            failed = 0
+
+            while (next_index < len(device_codes)) or (len(pending) > 0):
+                # Top up the in-flight window (unless the rollout has been stopped)
+                while ((not aborted) and (next_index < len(device_codes)) and (len(pending) < max_workers)):
+                    pending.add(executor.submit(PetoneerBulk._runWithRetries, command_func,
+                        device_codes[next_index], retries, retry_delay_secs, priority))
+                    next_index += 1
+
+                if (len(pending) == 0):
+                    break
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    device_result = future.result()
+                    results[device_result.device_code] = device_result
+                    completed += 1
+                    if (device_result.status == BULK_STATUS_FAILED):
+                        failed += 1
+
+                if ((max_error_rate != None) and (not aborted) and
+                    (completed >= min_error_rate_samples) and ((failed / completed) >= max_error_rate)):
+
+                    if (Debug):
+                        print(f"Bulk {command_name}: stopping after {failed} of {completed} devices failed")
+                    aborted = True
+
+        device_results = [results.get(code, PetoneerBulkDeviceResult(code)) for code in device_codes]
+
+        return PetoneerBulkResult(command_name, device_results, aborted, monotonic() - started)
+
+    @staticmethod
+    def _runWithRetries(command_func, device_code:str, retries:int, retry_delay_secs:float, priority:int = None):
+        if (priority != None):
+            with PetoneerPriority.lane(priority):
+                return PetoneerBulk._runWithRetries(command_func, device_code, retries, retry_delay_secs)
+
+        started = monotonic()
+        attempts = 0
+
+        while True:
+            attempts += 1
+            try:
+                result = command_func(device_code)
+                return PetoneerBulkDeviceResult(device_code, BULK_STATUS_SUCCESS, result, None, attempts, monotonic() - started)
+
+            except PetoneerFountainDeviceOffline as e:
+                # Not a failure of the rollout - the fountain is unplugged, so skip it
+                return PetoneerBulkDeviceResult(device_code, BULK_STATUS_SKIPPED, None, e, attempts, monotonic() - started)
+
+            except PetoneerBulk.RETRYABLE_ERRORS as e:
+                if (attempts > retries):
+                    return PetoneerBulkDeviceResult(device_code, BULK_STATUS_FAILED, None, e, attempts, monotonic() - started)
+                sleep(retry_delay_secs * attempts)
+
+            except Exception as e:
+                return PetoneerBulkDeviceResult(device_code, BULK_STATUS_FAILED, None, e, attempts, monotonic() - started)
@@ -1,4 +1,5 @@
 API_URL                             = "https://as.revogi.net/app"
+API_PUSH_URL                        = "wss://as.revogi.net/ws"
 
 API_LOGIN_PATH                      = "/user/101"
 API_DEVICE_LIST_PATH                = "/user/500"
@@ -18,4 +19,18 @@ SECONDS_FOUNTAIN_WATER_CHANGE       = 5 * 24 * 60 * 60    #  5 days
 SECONDS_FOUNTAIN_FILTER_CHANGE      = 30 * 24 * 60 * 60   # 30 days
 SECONDS_FOUNTAIN_CLEAN_PUMP         = 60 * 24 * 60 * 60   # 60 days
 
+SECONDS_DEVICE_DETAILS_CACHE        = 30
+SECONDS_API_REQUEST_TIMEOUT         = 30
+
+# While a push channel is active, device details are still fetched at least this
+# often - pushes only carry changed fields (never the schedule, for example)
+SECONDS_PUSH_MAX_STALENESS          = 15 * 60
+
+# Back-off between probes of an offline fountain (doubles after each failed probe)
+SECONDS_OFFLINE_PROBE_INITIAL       = 60
+SECONDS_OFFLINE_PROBE_MAX           = 60 * 60
+
+# Number of locks shared (by serial number hash) between the fountains of a Petoneer client
+NUM_FOUNTAIN_LOCK_STRIPES           = 16
+
 Debug                           = 1 
\ No newline at end of file
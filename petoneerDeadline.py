@@ -0,0 +1,193 @@
+"""
+Deadlines and hedged requests for calls to the Petoneer API.
+
+A PetoneerDeadline is created once per operation (eg: a fountain update, which makes
+two API calls) and passed down to every request it makes, so the operation as a whole
+never runs longer than allowed. A PetoneerHedgingPolicy (see PetoneerHelpers.setHedgingPolicy)
+lets idempotent reads send a second, identical request if the first has not answered
+within a latency threshold (by default the observed p95), and use whichever answers
+first - cutting the tail latency caused by the odd stuck connection.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import math
+import threading
+from time import monotonic
+
+from petoneerErrors import *
+from petoneerConst import *
+
+# Reads that are safe to send twice
+HEDGEABLE_API_PATHS             = (API_DEVICE_DETAILS_PATH, API_DEVICE_SCHEDULE_DETAILS_PATH)
+
+class PetoneerDeadline:
+    """
+    Point in time by which an operation must have completed
+    """
+
+    def __init__(self, timeout_secs:float):
+        self._timeout_secs = timeout_secs
+        self._expires = monotonic() + timeout_secs
+
+    def __repr__(self):
+        return f'PetoneerDeadline({self.remaining():.3f}s remaining of {self._timeout_secs}s)'
+
+    @staticmethod
+    def fromTimeout(deadline_or_timeout_secs):
+        """
+        Accepts either an existing PetoneerDeadline (returned as is), a number of
+        seconds (a new deadline is started), or None (no deadline)
+        """
+        if (deadline_or_timeout_secs == None) or (isinstance(deadline_or_timeout_secs, PetoneerDeadline)):
+            return deadline_or_timeout_secs
+        return PetoneerDeadline(deadline_or_timeout_secs)
+
+    @property
+    def timeout_secs(self):
+        return self._timeout_secs
+
+    @property
+    def expired(self):
+        return (monotonic() >= self._expires)
+
+    def remaining(self):
+        return max(0.0, self._expires - monotonic())
+
+    def getRequestTimeout(self, request_timeout_secs:float):
+        # Time allowed for the next request - its own timeout, capped by the time left
+        if (request_timeout_secs == None):
+            return self.remaining()
+        return min(request_timeout_secs, self.remaining())
+
+# -------------------------------------------------
+
+class PetoneerHedgingPolicy:
+    """
+    Decides when a hedged (second) request is sent. With a fixed hedge_after_secs the
+    second request always goes out after that delay - otherwise the delay is the given
+    percentile of the recent latencies of the same API path, once at least
+    min_samples latencies have been observed (until then, requests are not hedged).
+    """
+
+    def __init__(self, hedge_after_secs:float = None, percentile:float = 95, window_size:int = 200,
+        min_samples:int = 20, max_workers:int = 16):
+        if (percentile <= 0) or (percentile > 100):
+            raise PetoneerInvalidArgument('PetoneerHedgingPolicy', 'percentile', 'Percentile must be between 0 and 100')
+
+        self._hedge_after_secs = hedge_after_secs
+        self._percentile = percentile
+        self._window_size = window_size
+        self._min_samples = min_samples
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='PetoneerHedge')
+        self._requests = 0
+        self._hedged_requests = 0
+        self._hedge_wins = 0
+
+    @property
+    def requests(self):
+        return self._requests
+
+    @property
+    def hedged_requests(self):
+        return self._hedged_requests
+
+    @property
+    def hedge_wins(self):
+        # Number of hedged requests where the second request answered first
+        return self._hedge_wins
+
+    def recordLatency(self, methodPath:str, latency_secs:float):
+        with self._lock:
+            if (methodPath not in self._latencies):
+                self._latencies[methodPath] = deque(maxlen=self._window_size)
+            self._latencies[methodPath].append(latency_secs)
+
+    def getHedgeDelay(self, methodPath:str):
+        if (self._hedge_after_secs != None):
+            return self._hedge_after_secs
+
+        with self._lock:
+            latencies = sorted(self._latencies.get(methodPath, ()))
+
+        if (len(latencies) < self._min_samples):
+            return None
+
+        index = min(len(latencies) - 1, math.ceil(len(latencies) * self._percentile / 100) - 1)
+        return latencies[index]
+
+    def request(self, request_func, methodPath:str, timeout_secs:float, priority_limiter = None, priority:int = None):
+        """
+        Runs request_func() (which must be safe to call twice), sending a hedged second
+        attempt if the first has not completed within the hedge delay. Returns the
+        result of whichever attempt succeeds first.
+
+        If a PetoneerPriorityLimiter is given, the hedged attempt needs a request slot
+        of its own (in the given priority lane) - without a free slot it isn't sent.
+        """
+        hedge_delay = self.getHedgeDelay(methodPath)
+        started = monotonic()
+        self._requests += 1
+
+        if (hedge_delay == None) or ((timeout_secs != None) and (hedge_delay >= timeout_secs)):
+            # No time to hedge - just make the request on this thread
+            return self._timedRequest(request_func, methodPath)
+
+        first = self._executor.submit(self._timedRequest, request_func, methodPath)
+        attempts = [first]
+
+        done, pending = wait(attempts, timeout=hedge_delay)
+        if (len(done) == 0):
+            if (priority_limiter == None):
+                self._hedged_requests += 1
+                attempts.append(self._executor.submit(self._timedRequest, request_func, methodPath))
+            elif (priority_limiter.acquire(priority, 0)):
+                self._hedged_requests += 1
+                attempts.append(self._executor.submit(self._timedRequest, request_func, methodPath))
+                self._releaseWhenDone(attempts, priority_limiter)
+
+        error = None
+        pending = set(attempts)
+
+        while (len(pending) > 0):
+            remaining = None if (timeout_secs == None) else max(0.0, timeout_secs - (monotonic() - started))
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+
+            if (len(done) == 0):
+                break
+
+            for attempt in done:
+                if (attempt.exception() == None):
+                    if (attempt is not first):
+                        self._hedge_wins += 1
+                    return attempt.result()
+                error = attempt.exception()
+
+        if (error != None):
+            raise error
+
+        raise PetoneerRequestTimeout(methodPath, timeout_secs, 'No response to hedged request before the deadline')
+
+    def _releaseWhenDone(self, attempts:list, priority_limiter):
+        # The caller's slot is freed as soon as either attempt answers, so the extra
+        # slot taken for the hedge is held until both attempts have finished - the
+        # losing attempt never runs without a slot
+        remaining = [len(attempts)]
+        lock = threading.Lock()
+
+        def attemptDone(attempt):
+            with lock:
+                remaining[0] -= 1
+                finished = (remaining[0] == 0)
+            if (finished):
+                priority_limiter.release()
+
+        for attempt in attempts:
+            attempt.add_done_callback(attemptDone)
+
+    def _timedRequest(self, request_func, methodPath:str):
+        started = monotonic()
+        resp = request_func()
+        self.recordLatency(methodPath, monotonic() - started)
+        return resp
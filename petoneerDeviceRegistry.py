@@ -0,0 +1,215 @@
+"""
+Registry of the devices linked to a Petoneer account (from the /user/500 device list),
+indexed by serial number, MAC address and name. Each device record is hashed, so when
+the device list is fetched again only the records that were added, removed or modified
+are applied - and that delta is reported to the caller.
+"""
+import hashlib
+import json
+import threading
+
+class PetoneerDeviceRegistryDelta:
+    """
+    Changes applied to the registry by one sync - lists of serial numbers
+    """
+
+    def __init__(self, added:list = None, removed:list = None, modified:list = None, went_online:list = None, went_offline:list = None):
+        self._added = added if (added != None) else []
+        self._removed = removed if (removed != None) else []
+        self._modified = modified if (modified != None) else []
+        self._went_online = went_online if (went_online != None) else []
+        self._went_offline = went_offline if (went_offline != None) else []
+
+    def __repr__(self):
+        return (f'PetoneerDeviceRegistryDelta(added={len(self._added)}, removed={len(self._removed)}, ' +
+            f'modified={len(self._modified)}, online={len(self._went_online)}, offline={len(self._went_offline)})')
+
+    def __bool__(self):
+        return self.has_changes
+
+    @property
+    def added(self):
+        return self._added
+
+    @property
+    def removed(self):
+        return self._removed
+
+    @property
+    def modified(self):
+        return self._modified
+
+    @property
+    def went_online(self):
+        # Devices (already registered) whose 'line' flag changed to online
+        return self._went_online
+
+    @property
+    def went_offline(self):
+        return self._went_offline
+
+    @property
+    def has_changes(self):
+        return ((len(self._added) > 0) or (len(self._removed) > 0) or (len(self._modified) > 0))
+
+    def to_dict(self):
+        return {
+            "added": self._added,
+            "removed": self._removed,
+            "modified": self._modified,
+            "went_online": self._went_online,
+            "went_offline": self._went_offline
+        }
+
+# -------------------------------------------------
+
+class PetoneerDeviceRegistry:
+    """
+    Device records (as returned by the API) indexed by serial number ('sn'), MAC
+    address ('mac') and name ('name'). Names are not unique, so name lookups return
+    a list of records.
+    """
+
+    def __init__(self, device_list:list = None):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._hashes = {}
+        self._by_mac = {}
+        self._by_name = {}
+        self._version = 0
+
+        if (device_list != None):
+            self.sync(device_list)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, device_code):
+        return (device_code in self._records)
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    @property
+    def version(self):
+        # Incremented by every sync that changed the registry
+        return self._version
+
+    @property
+    def serials(self):
+        return list(self._records.keys())
+
+    @property
+    def records(self):
+        return list(self._records.values())
+
+    def getBySerial(self, device_code:str):
+        return self._records.get(device_code)
+
+    def getByMac(self, mac:str):
+        device_code = self._by_mac.get(PetoneerDeviceRegistry.normaliseMac(mac))
+        return (self._records.get(device_code) if (device_code != None) else None)
+
+    def getByName(self, name:str):
+        return [self._records[device_code] for device_code in self._by_name.get(name, ()) if (device_code in self._records)]
+
+    def isOnline(self, device_code:str):
+        """
+        Online flag ('line') reported for the device in the last device list - None
+        for an unknown device
+        """
+        record = self._records.get(device_code)
+        if (record == None):
+            return None
+        return (record.get('line', 1) == 1)
+
+    def getFirmwareVersion(self, device_code:str):
+        record = self._records.get(device_code)
+        return (record.get('ver') if (record != None) else None)
+
+    @property
+    def online_devices(self):
+        return [device_code for device_code, record in self._records.items() if (record.get('line', 1) == 1)]
+
+    @property
+    def offline_devices(self):
+        return [device_code for device_code, record in self._records.items() if (record.get('line', 1) != 1)]
+
+    def sync(self, device_list:list):
+        """
+        Applies a (complete) device list fetched from the API - only records that
+        were added, removed or whose contents changed are touched. Returns a
+        PetoneerDeviceRegistryDelta.
+        """
+        delta = PetoneerDeviceRegistryDelta()
+
+        with self._lock:
+            seen = set()
+
+            for record in device_list:
+                device_code = record.get('sn')
+                if (device_code == None) or (device_code in seen):
+                    continue
+                seen.add(device_code)
+
+                record_hash = PetoneerDeviceRegistry.hashRecord(record)
+                previous_hash = self._hashes.get(device_code)
+
+                if (previous_hash == record_hash):
+                    continue
+
+                previous = self._records.get(device_code)
+                if (previous == None):
+                    delta.added.append(device_code)
+                else:
+                    delta.modified.append(device_code)
+                    self._unindex(device_code, previous)
+
+                    was_online = (previous.get('line', 1) == 1)
+                    is_online = (record.get('line', 1) == 1)
+                    if (is_online) and (not was_online):
+                        delta.went_online.append(device_code)
+                    elif (was_online) and (not is_online):
+                        delta.went_offline.append(device_code)
+
+                self._records[device_code] = record
+                self._hashes[device_code] = record_hash
+                self._index(device_code, record)
+
+            for device_code in [code for code in self._records if (code not in seen)]:
+                self._unindex(device_code, self._records.pop(device_code))
+                del self._hashes[device_code]
+                delta.removed.append(device_code)
+
+            if (delta.has_changes):
+                self._version += 1
+
+        return delta
+
+    @staticmethod
+    def hashRecord(record:dict):
+        return hashlib.md5(json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')).digest()
+
+    @staticmethod
+    def normaliseMac(mac:str):
+        return mac.strip().upper().replace('-', ':') if (mac != None) else None
+
+    def _index(self, device_code:str, record:dict):
+        mac = PetoneerDeviceRegistry.normaliseMac(record.get('mac'))
+        if (mac):
+            self._by_mac[mac] = device_code
+
+        name = record.get('name')
+        if (name != None):
+            self._by_name.setdefault(name, {})[device_code] = True
+
+    def _unindex(self, device_code:str, record:dict):
+        mac = PetoneerDeviceRegistry.normaliseMac(record.get('mac'))
+        if (mac) and (self._by_mac.get(mac) == device_code):
+            del self._by_mac[mac]
+
+        name = record.get('name')
+        if (name != None) and (name in self._by_name):
+            self._by_name[name].pop(device_code, None)
+            if (len(self._by_name[name]) == 0):
+                del self._by_name[name]
@@ -113,3 +113,42 @@ class PetoneerApiServerOffline(Exception):
 
     def __str__(self):
         return f'HTTP {self.http_code} -> Unable to connect to Petoneer API Server "{self.api_server}": {self.message}'
+
+
+class PetoneerRequestTimeout(Exception):
+    """Exception raised when a request to the Petoneer API (or a whole operation) runs past its deadline.
+
+    Attributes:
+        api_url -- requested URL of API server
+        timeout_secs -- time allowed for the request / operation, in seconds (optional)
+        message -- explanation of the error (optional)
+    """
+
+    def __init__(self, api_url, timeout_secs = None, message="Request to Petoneer API server timed out"):
+        self.api_url = api_url
+        self.timeout_secs = timeout_secs
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f'Request to Petoneer API Server "{self.api_url}" timed out (after {self.timeout_secs}s): {self.message}'
+
+class PetoneerScheduleNotApplied(Exception):
+    """Exception raised when a schedule read back from a Petoneer Fountain doesn't match the schedule that was sent.
+
+    Attributes:
+        fountain_serial_number -- serial_number of Fountain device the schedule was sent to
+        expected -- schedule that was sent (optional)
+        actual -- schedule read back from the fountain (optional)
+        message -- explanation of the error (optional)
+    """
+
+    def __init__(self, fountain_serial_number, expected = None, actual = None, message="Schedule was not applied"):
+        self.fountain_serial_number = fountain_serial_number
+        self.expected = expected
+        self.actual = actual
+        self.message = message
+        super().__init__(self.message)
+
+    def __str__(self):
+        return f'Fountain (Serial #{self.fountain_serial_number}): {self.message} (expected {self.expected}, read back {self.actual})'
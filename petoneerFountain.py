@@ -1,12 +1,104 @@
 """
 Holds device status information for an individual Petoneer smart pet fountain
+
+Threading model: a PetoneerFountain may be shared between threads. Each device
+details payload is published as a single immutable PetoneerFountainState, by
+swapping one reference. Readers never take a lock - use snapshot() (or read
+fountain.state once) to get values that are guaranteed to come from the same
+payload. Writers (update, push updates and command results) are serialized by a
+per-fountain lock, which update() does not hold while fetching from the API -
+concurrent updates of the same fountain wait for the one fetch in progress, and
+changes applied during a fetch are kept when its result is swapped in.
+
+The pump / water / filter / LED details derived from a payload are only built
+when first read, and memoized with the state they came from - so a poller that
+only reads raw values (or a single metric) doesn't pay for the whole derivation.
 """
 from datetime import time, date, datetime
 import json
+import threading
 
 from petoneerErrors import *
 from petoneerFountainDetails import *
 from petoneerHelpers import *
+from petoneerSnapshot import *
+
+class PetoneerFountainState:
+    """
+    Immutable view of a fountain's state, built from one device details payload.
+    Each new payload gets a new state, with a higher version number. The details
+    objects are derived on first access and memoized - if two threads race to
+    derive the same details, both build identical objects and either may be kept.
+    """
+    __slots__ = ("_device_info_json", "_device_schedule_info_json", "_last_updated", "_version",
+        "_pump", "_water", "_filter", "_led_display", "__weakref__")
+
+    def __init__(self, device_info_json:dict, device_schedule_info_json:dict, last_updated:datetime, version:int):
+        self._device_info_json = device_info_json
+        self._device_schedule_info_json = device_schedule_info_json
+        self._last_updated = last_updated
+        self._version = version
+        self._pump = None
+        self._water = None
+        self._filter = None
+        self._led_display = None
+
+    @property
+    def device_info_json(self):
+        return self._device_info_json
+
+    @property
+    def device_schedule_info_json(self):
+        return self._device_schedule_info_json
+
+    @property
+    def last_updated(self):
+        return self._last_updated
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def has_details(self):
+        return (self._device_info_json != None) and (self._device_schedule_info_json != None)
+
+    @property
+    def pump(self):
+        pump = self._pump
+        if (pump == None):
+            pump = PetoneerFountainDetails_PumpDetails(self)
+            if (self.has_details):
+                with PetoneerProfiler.phase('parse'):
+                    pump.update(self._device_info_json, self._device_schedule_info_json)
+            self._pump = pump
+        return pump
+
+    @property
+    def water(self):
+        water = self._water
+        if (water == None):
+            with PetoneerProfiler.phase('parse'):
+                water = self._water = PetoneerFountainDetails_WaterDetails(self, self._device_info_json)
+        return water
+
+    @property
+    def filter(self):
+        filter_details = self._filter
+        if (filter_details == None):
+            with PetoneerProfiler.phase('parse'):
+                filter_details = self._filter = PetoneerFountainDetails_FilterDetails(self, self._device_info_json)
+        return filter_details
+
+    @property
+    def led_display(self):
+        led_display = self._led_display
+        if (led_display == None):
+            with PetoneerProfiler.phase('parse'):
+                led_display = self._led_display = PetoneerFountainDetails_LedDetails(self, self._device_info_json)
+        return led_display
+
+# -------------------------------------------------
 
 class PetoneerFountain:
 
@@ -14,23 +106,30 @@ class PetoneerFountain:
     Class to interface with the cloud-based API for the Revogi Smart Home equipment
     """
 
-    def __init__(self, fountain_serial_number:str, api_access_token:str):
+    def __init__(self, fountain_serial_number:str, api_access_token:str, device_info_json:dict = None, device_schedule_info_json:dict = None):
         self._id = fountain_serial_number
         self._access_token = api_access_token
-        self._device_info_json = None
-        self._device_info_last_updated = None
-        self._device_schedule_info_json = None
-        self._pump = PetoneerFountainDetails_PumpDetails(self)
-        self._water = PetoneerFountainDetails_WaterDetails(self)
-        self._filter = PetoneerFountainDetails_FilterDetails(self)
-        self._led_display = PetoneerFountainDetails_LedDetails(self)
+        self._lock = threading.RLock()
+        self._push_active = False
+        self._last_fetched = None
+        self._fetching = None
+        self._state = PetoneerFountainState(None, None, None, 0)
+
+        # If device info has been provided (eg: from a previously fetched response),
+        # use it rather than requesting it again from the API
+        if (device_info_json != None) and (device_schedule_info_json != None):
+            self._setState(device_info_json, device_schedule_info_json, datetime.now())
+            self._last_fetched = datetime.now()
 
         # Initialise property values based on provided JSON data
         self.update()
 
+    def snapshot(self):
+        # Flat, immutable copy of the current (cached) state - see petoneerSnapshot.py
+        return PetoneerFountainSnapshot.fromFountain(self)
+
     def to_json(self):
-        return json.dump(self)
-        #return json.dumps(self, indent = 4, default=lambda o: o.__dict__)
+        return self.snapshot().to_json()
 
     # def __str__(self):
         # return self.to_json(self)
@@ -40,23 +139,134 @@ class PetoneerFountain:
         #pass
         return
 
-    def update(self):
+    def update(self, deadline = None, force:bool = False):
         # Retrieve up-to-date info from server API if last update was more than 
-        # 15 seconds ago...
-        if (self._device_info_last_updated == None) or (
-            (datetime.now() - self._device_info_last_updated).total_seconds() > 30):
-            
-            self._getDeviceDetails()
-
-        # Update all values based on new device info JSON data
-        self._pump.update(self._device_info_json, self._device_schedule_info_json)
-        self._water.update(self._device_info_json)
-        self._filter.update(self._device_info_json)
-        self._led_display.update(self._device_info_json)
-        ##
-        ## TODO:  Parse JSON and update properties with new values
-
-    def _getDeviceDetails(self):
+        # 30 seconds ago (or, while a live push channel is keeping the info current,
+        # if the last full fetch is older than SECONDS_PUSH_MAX_STALENESS), or if
+        # forced. 'deadline' (a PetoneerDeadline, or number of seconds) limits the
+        # time allowed for both API calls together.
+        deadline = PetoneerDeadline.fromTimeout(deadline)
+
+        with PetoneerProfiler.cycle('PetoneerFountain.update'):
+            while (True):
+                # The lock is only held to decide whether to fetch, and to swap in the
+                # result - not across the API calls, so push updates and command
+                # results aren't held up behind a slow fetch
+                with self._lock:
+                    fetching = self._fetching
+                    if (fetching == None):
+                        if (not self._isStale(force)):
+                            return
+                        fetching = self._fetching = threading.Event()
+                        fetched_from = self._state
+                        break
+
+                # Another thread is already fetching the details - wait for it, then
+                # check again (if it failed, this thread fetches them itself)
+                if (not fetching.wait(None if (deadline == None) else deadline.remaining())):
+                    raise PetoneerRequestTimeout(PetoneerHelpers.getApiUrlFromPath(API_DEVICE_DETAILS_PATH), deadline.timeout_secs, 'Operation deadline expired while waiting for the device details')
+                force = False
+
+            try:
+                device_info_json, device_schedule_info_json = self._getDeviceDetails(deadline)
+
+                with self._lock:
+                    state = self._state
+                    if (state.version != fetched_from.version):
+                        # A push update or command result was applied during the fetch -
+                        # it may be newer than the fetched details, so keep its changes
+                        device_info_json = self._keepChanges(device_info_json, fetched_from.device_info_json, state.device_info_json)
+                        device_schedule_info_json = self._keepChanges(device_schedule_info_json, fetched_from.device_schedule_info_json, state.device_schedule_info_json)
+
+                    self._setState(device_info_json, device_schedule_info_json, datetime.now())
+                    self._last_fetched = datetime.now()
+            finally:
+                with self._lock:
+                    self._fetching = None
+                fetching.set()
+
+    def _isStale(self, force:bool):
+        state = self._state
+        now = datetime.now()
+
+        if (force) or (state.last_updated == None) or (self._last_fetched == None):
+            return True
+        elif (self._push_active):
+            return ((now - self._last_fetched).total_seconds() > SECONDS_PUSH_MAX_STALENESS)
+        else:
+            return ((now - state.last_updated).total_seconds() > SECONDS_DEVICE_DETAILS_CACHE)
+
+    @staticmethod
+    def _keepChanges(fetched_json:dict, before_json:dict, current_json:dict):
+        # The fetched JSON, with any fields changed between before_json and current_json applied on top
+        if (current_json == None):
+            return fetched_json
+
+        changes = {key: value for (key, value) in current_json.items() if (before_json == None) or (before_json.get(key) != value)}
+        if (len(changes) == 0):
+            return fetched_json
+
+        merged_json = dict(fetched_json)
+        merged_json.update(changes)
+        return merged_json
+
+    def _setState(self, device_info_json:dict, device_schedule_info_json:dict, last_updated:datetime):
+        # Publish the new device info JSON data with a single reference swap - the
+        # details are derived from it when (and if) they are first read
+        self._state = PetoneerFountainState(device_info_json, device_schedule_info_json, last_updated, self._state.version + 1)
+
+    def applyPushUpdate(self, device_info_json:dict):
+        """
+        Applies a (full or partial) device info update received over a push channel
+        (see petoneerPush.py) on top of the currently held device info
+        """
+        with self._lock:
+            state = self._state
+            if (state.device_info_json == None) or (state.device_schedule_info_json == None):
+                # Nothing to merge a partial update into yet - the next update() will
+                # fetch the full device details
+                return False
+
+            device_info = dict(state.device_info_json)
+            device_info.update(device_info_json)
+
+            self._setState(device_info, state.device_schedule_info_json, datetime.now())
+            return True
+
+    def applyCommandResult(self, methodPath:str, payload:dict, response_data = None):
+        """
+        Writes the outcome of a successful device command through to the cached
+        device (and schedule) info - the known effect of the command, then any
+        device info fields returned in the command's response - so the cache
+        reflects the change without refetching the device details
+        """
+        with self._lock:
+            state = self._state
+            if (state.device_info_json == None) or (state.device_schedule_info_json == None):
+                return False
+
+            device_info = dict(state.device_info_json)
+            device_info.update(PetoneerHelpers.getCommandEffects(methodPath, payload))
+
+            if (isinstance(response_data, dict)):
+                device_info.update({key: value for (key, value) in response_data.items() if (key in device_info)})
+
+            device_schedule_info = state.device_schedule_info_json
+            schedule_effects = PetoneerHelpers.getScheduleCommandEffects(methodPath, payload)
+            if (len(schedule_effects) > 0):
+                device_schedule_info = dict(device_schedule_info)
+                device_schedule_info.update(schedule_effects)
+
+            self._setState(device_info, device_schedule_info, state.last_updated)
+            return True
+
+    def setPushActive(self, push_active:bool):
+        # While a push channel is active, update() serves the pushed device info
+        # rather than polling the API every 30 seconds
+        self._push_active = push_active
+
+    def _getDeviceDetails(self, deadline:PetoneerDeadline = None):
+        # Returns a tuple of (device info JSON, device schedule info JSON)
         if (self._id == ""):
             raise PetoneerInvalidArgument('PetoneerFountain._req', 'PetoneerFountain.device_id', 'The device serial number must be provided')
 
@@ -71,53 +281,134 @@ class PetoneerFountain:
         #
         # Request main device details from Petoneer API
         #
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_DETAILS_PATH, payload, self._access_token)
+        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_DETAILS_PATH, payload, self._access_token, deadline)
 
         if(resp.status_code == 200):
-            json_resp = resp.json()
+            with PetoneerProfiler.phase('decode'):
+                json_resp = resp.json()
 
             if (json_resp['code'] == 200):
-                self._device_info_json = json_resp['data']
+                device_info_json = json_resp['data']
             else:
-                raise PetoneerInvalidServerResponse(resp.http_code, resp.url, resp.text, 'Unable to obtain Petoneer Fountain device details - Unexpected Server Response')
+                raise PetoneerInvalidServerResponse(resp.status_code, resp.url, resp.text, 'Unable to obtain Petoneer Fountain device details - Unexpected Server Response')
+
+            # An offline fountain only has stale details - don't bother asking for its schedule
+            if (device_info_json.get('line', 1) != 1):
+                raise PetoneerFountainDeviceOffline(self._id, API_URL)
         else:
             raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to obtain Petoneer Fountain device details - Server Error')
 
         #
         # Second API call to obtain any configured fountain operating schedule info
         #
-        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_SCHEDULE_DETAILS_PATH, payload, self._access_token)
+        resp = PetoneerHelpers.getAPIrequest(API_DEVICE_SCHEDULE_DETAILS_PATH, payload, self._access_token, deadline)
 
         if(resp.status_code == 200):
-            json_resp = resp.json()
+            with PetoneerProfiler.phase('decode'):
+                json_resp = resp.json()
 
             if (json_resp['code'] == 200):
-                self._device_schedule_info_json = json_resp['data']
+                device_schedule_info_json = json_resp['data']
             else:
-                raise PetoneerInvalidServerResponse(resp.http_code, resp.url, resp.text, 'Unable to obtain Petoneer Fountain device details - Unexpected Server Response')
+                raise PetoneerInvalidServerResponse(resp.status_code, resp.url, resp.text, 'Unable to obtain Petoneer Fountain device details - Unexpected Server Response')
         else:
             raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to obtain Petoneer Fountain device details - Server Error')
 
-        self._device_info_last_updated = datetime.now()
+        return device_info_json, device_schedule_info_json
+
+    def set_state(self, pump:bool = None, led:bool = None, led_dimmed:bool = None, deadline = None):
+        """
+        Brings the fountain to the requested state, only sending the commands needed
+        to change what differs from the (cached) current state. Any argument left as
+        None is not changed. led_dimmed only applies while the LEDs are (or are being
+        switched) on. Returns the list of API paths that were called. 'deadline' (a
+        PetoneerDeadline, or number of seconds) limits the whole operation.
+        """
+        deadline = PetoneerDeadline.fromTimeout(deadline)
+        self.update(deadline)
+
+        # Decide from a single (consistent) state
+        state = self._state
+        pump_details = state.pump
+        led_details = state.led_display
+
+        commands = []
+
+        if (pump != None) and (pump != pump_details.is_pump_switched_on):
+            commands.append((API_DEVICE_SWITCH_PATH, PetoneerHelpers.getSwitchPayload(self._id, pump),
+                'Unable to switch ' + ('on' if pump else 'off') + ' Petoneer Fountain - Server Error'))
+
+        led_on = led_details.is_led_on if (led == None) else led
+        if (led_on):
+            # Compare the raw LED settings that would be sent (the derived 'dimmed right
+            # now' flag depends on the time of day, so can't tell if a command is needed)
+            device_info = state.device_info_json
+            section = list(device_info.get('section', []))
+            if (led_dimmed != None):
+                dimmed = led_dimmed
+            else:
+                # Keep the current dimming (switching on from off defaults to full brightness, like turn_led_on)
+                dimmed = (led_details.is_led_on) and (section == [0, 1439])
+            led_payload = PetoneerHelpers.getLedPayload(self._id, True, dimmed)
+
+            if ((not led_details.is_led_on) or ((led_dimmed != None) and
+                ((device_info.get('ledmode') != led_payload['ledmode']) or (section != led_payload['section'])))):
+                commands.append((API_DEVICE_LED_PATH, led_payload,
+                    'Unable to switch on Petoneer Fountain LEDs - Server Error'))
+        elif (led_details.is_led_on):
+            commands.append((API_DEVICE_LED_PATH, PetoneerHelpers.getLedPayload(self._id, False),
+                'Unable to switch off Petoneer Fountain LEDs - Server Error'))
+
+        for (path, payload, error_message) in commands:
+            response_data = PetoneerHelpers.sendDeviceCommand(path, payload, self._access_token, error_message, deadline)
+            self.applyCommandResult(path, payload, response_data)
+
+        return [path for (path, payload, error_message) in commands]
 
     @property
     def device_id(self):
         return self._id
 
+    @property
+    def state(self):
+        # Current PetoneerFountainState - all values in it come from the same payload
+        return self._state
+
+    @property
+    def version(self):
+        # Incremented every time new device info is applied (fetched, pushed or written through)
+        return self._state.version
+
+    @property
+    def _device_info_json(self):
+        return self._state.device_info_json
+
+    @property
+    def _device_schedule_info_json(self):
+        return self._state.device_schedule_info_json
+
+    @property
+    def _device_info_last_updated(self):
+        return self._state.last_updated
+
+    @property
+    def is_push_active(self):
+        return self._push_active
+
     @property
     def pump(self):
-        return self._pump
+        return self._state.pump
 
     @property
     def water(self):
-        return self._water
+        return self._state.water
 
     @property
     def filter(self):
-        return self._filter
+        return self._state.filter
 
     @property
     def led_display(self):
-        return self._led_display
+        return self._state.led_display
 
 # -------------------------------------------------
@@ -3,10 +3,15 @@ Provides nested classes to provide specific info on different elements of the
 Petoneer Fountains (via the PetoneerFountain class). None of the below classes
 are intended to be instantiated directly by the user - the PetoneerFountain
 module will invoke and feed info to the below collection of classes.
+
+Each class only holds a weak reference back to its parent, so a fountain and its
+details never form a reference cycle and are freed as soon as the fountain is
+dropped (without waiting for the cyclic garbage collector).
 """
 from datetime import time, date, datetime
 import math
 import json
+import weakref
 
 from petoneerErrors import *
 from petoneerHelpers import *
@@ -18,7 +23,7 @@ class PetoneerFountainDetails_WaterDetails:
     """
 
     def __init__(self, parent, device_info_json=None):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._device_info_json = device_info_json
         self._water_level = PetoneerFountainDetails_WaterLevel(self)
         self._water_quality = PetoneerFountainDetails_WaterQuality(self)
@@ -73,10 +78,11 @@ class PetoneerFountainDetails_PumpDetails:
     """
 
     def __init__(self, parent, device_info_json=None, device_schedule_info_json=None):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._device_info_json = device_info_json
         self._device_schedule_info_json = device_schedule_info_json
         self._is_pump_on = True
+        self._is_pump_switched_on = True
         self._is_pump_scheduled = False
         self._pump_schedule = PetoneerFountainDetails_DeviceSchedule(self)
         self._is_pump_cleaning_required = False
@@ -106,6 +112,8 @@ class PetoneerFountainDetails_PumpDetails:
         else:
             self._is_pump_scheduled = False
 
+        self._is_pump_switched_on = (self._device_info_json['switch'] == 1)
+
         if (self._device_info_json['switch'] == 1):
             if (self._is_pump_scheduled):
                 if (PetoneerHelpers.isCurrentTimeWithinScheduleWindow(
@@ -130,6 +138,11 @@ class PetoneerFountainDetails_PumpDetails:
     def is_pump_on(self):
         return self._is_pump_on
 
+    @property
+    def is_pump_switched_on(self):
+        # Switch setting of the pump, regardless of any configured pump schedule
+        return self._is_pump_switched_on
+
     @property
     def is_pump_scheduled(self):
         return self._is_pump_scheduled
@@ -155,7 +168,7 @@ class PetoneerFountainDetails_FilterDetails:
     """
 
     def __init__(self, parent, device_info_json=None):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._device_info_json = device_info_json
         self._is_filter_change_required = False
         self._filter_change_remaining = PetoneerFountainDetails_ChangeRemaining(self)
@@ -193,7 +206,7 @@ class PetoneerFountainDetails_LedDetails:
     """
 
     def __init__(self, parent, device_info_json=None):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._device_info_json = device_info_json
         self._is_led_on = False
         self._is_led_dimmed = False
@@ -257,7 +270,7 @@ class PetoneerFountainDetails_ChangeRemaining:
     over water, changing filters, and deep cleaning the pump). 
     """
     def __init__(self, parent, device_current_time_unix_timestamp:int = None, device_feature_unix_timestamp:int = None, threshold_interval_secs:int = 0):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._device_current_time_timestamp = device_current_time_unix_timestamp
         self._device_feature_last_changed_timestamp = device_feature_unix_timestamp
         self._days_remaining_threshold_seconds = threshold_interval_secs
@@ -272,12 +285,13 @@ class PetoneerFountainDetails_ChangeRemaining:
             self._percent_remaining = 0    
     
     def update(self, device_current_time_unix_timestamp: int, device_feature_unix_timestamp: int, threshold_interval_secs:int):
-        if ((device_current_time_unix_timestamp > 0) and (device_feature_unix_timestamp > 0) and (threshold_interval_secs > 0)):
-            self._days_remaining = self._getNumOfDaysRemaining(device_current_time_unix_timestamp, device_feature_unix_timestamp, threshold_interval_secs)
-            self._percent_remaining = self._getPercentageRemaining(device_current_time_unix_timestamp, device_feature_unix_timestamp, threshold_interval_secs)
-        else:
-            self._days_remaining = 0
-            self._percent_remaining = 0
+        with PetoneerProfiler.phase('derive'):
+            if ((device_current_time_unix_timestamp > 0) and (device_feature_unix_timestamp > 0) and (threshold_interval_secs > 0)):
+                self._days_remaining = self._getNumOfDaysRemaining(device_current_time_unix_timestamp, device_feature_unix_timestamp, threshold_interval_secs)
+                self._percent_remaining = self._getPercentageRemaining(device_current_time_unix_timestamp, device_feature_unix_timestamp, threshold_interval_secs)
+            else:
+                self._days_remaining = 0
+                self._percent_remaining = 0
 
     @property
     def days_remaining(self):
@@ -316,7 +330,7 @@ class PetoneerFountainDetails_DeviceSchedule:
     """
 
     def __init__(self, parent, start_schedule_time_str:str = "", end_schedule_time_str:str = ""):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         if (start_schedule_time_str == ""):
             self._start_time = time(0,0,0)
         else:
@@ -327,8 +341,9 @@ class PetoneerFountainDetails_DeviceSchedule:
             self._end_time = PetoneerHelpers.scheduleStringToTimeObject(end_schedule_time_str)
     
     def update(self, start_schedule_time_str:str, end_schedule_time_str:str):
-        self._start_time = PetoneerHelpers.scheduleStringToTimeObject(start_schedule_time_str)
-        self._end_time = PetoneerHelpers.scheduleStringToTimeObject(end_schedule_time_str)
+        with PetoneerProfiler.phase('derive'):
+            self._start_time = PetoneerHelpers.scheduleStringToTimeObject(start_schedule_time_str)
+            self._end_time = PetoneerHelpers.scheduleStringToTimeObject(end_schedule_time_str)
 
     @property
     def start_time(self):
@@ -347,7 +362,7 @@ class PetoneerFountainDetails_WaterLevel:
     """
 
     def __init__(self, parent, water_level_value=0):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._water_level_value = water_level_value
         self._water_level_percent = self._getWaterLevelPercentage(water_level_value)
         self._water_level_label = self._getWaterLevelLabel(water_level_value)
@@ -369,7 +384,8 @@ class PetoneerFountainDetails_WaterLevel:
     def label(self):
         return self._water_level_label
 
-    def _getWaterLevelLabel(self, level_int):
+    @staticmethod
+    def _getWaterLevelLabel(level_int):
         level_labels={
             0: "Empty",
             1: "Low",
@@ -379,7 +395,8 @@ class PetoneerFountainDetails_WaterLevel:
         }
         return (level_labels.get(level_int, 'Invalid Water Level Value!'))
 
-    def _getWaterLevelPercentage(self, level_int):
+    @staticmethod
+    def _getWaterLevelPercentage(level_int):
         percent_labels={
             0: "0%",
             1: "25%",
@@ -398,7 +415,7 @@ class PetoneerFountainDetails_WaterQuality:
     the fountain)
     """
     def __init__(self, parent, tds_value=0):
-        self._parent = parent
+        self._parent = weakref.ref(parent)
         self._tds_value = tds_value
         self._water_quality_label = self._getWaterQualityLabel(tds_value)
     
@@ -414,7 +431,8 @@ class PetoneerFountainDetails_WaterQuality:
     def quality_label(self):
         return self._water_quality_label
 
-    def _getWaterQualityLabel(self, tds_level_int):
+    @staticmethod
+    def _getWaterQualityLabel(tds_level_int):
         if (tds_level_int < 1):
             return "Invalid TDS Level Provided!"
         elif (tds_level_int <= 50):
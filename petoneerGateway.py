@@ -0,0 +1,479 @@
+"""
+Embeddable HTTP gateway that polls the Revogi API once per fountain (through a single
+Petoneer client) and serves the cached fountain state to any number of internal
+consumers, so upstream load stays flat however many consumers there are.
+
+    GET  /fountains                     all fountains: {"seq": n, "fountains": [snapshot, ...]}
+    GET  /fountains/<sn>                one fountain's snapshot
+    GET  /changes?since=<seq>&timeout=<secs>
+                                        long-poll - returns as soon as any fountain changes
+                                        after 'since': {"seq": n, "fountains": [changed snapshots]}
+    GET  /events                        Server-Sent Events stream of changed snapshots
+                                        (resumes from the Last-Event-ID header)
+    POST /fountains/<sn>/commands       queue a command: {"command": "turn_off"}, or eg:
+                                        {"command": "set_state", "pump": true, "wait": true}
+    GET  /commands/<id>                 status / result of a queued command
+
+Commands from every consumer go through one shared queue, sent upstream at no more
+than max_commands_per_sec. Identical commands already waiting in the queue are
+coalesced.
+
+    gateway = pet.startGateway(port=8080, poll_interval_secs=30)
+    ...
+    gateway.stop()
+"""
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import itertools
+import json
+import queue
+import threading
+import urllib.parse
+from time import monotonic
+
+from petoneerErrors import *
+from petoneerConst import *
+
+GATEWAY_COMMAND_QUEUED          = "queued"
+GATEWAY_COMMAND_RUNNING         = "running"
+GATEWAY_COMMAND_SUCCESS         = "success"
+GATEWAY_COMMAND_FAILED          = "failed"
+
+# Command name -> optional (boolean) arguments accepted in the request body
+GATEWAY_COMMANDS = {
+    "turn_on": (),
+    "turn_off": (),
+    "turn_led_on": ("leds_dimmed",),
+    "turn_led_off": (),
+    "reset_water_change_timer": (),
+    "reset_filter_change_timer": (),
+    "reset_clean_pump_timer": (),
+    "set_state": ("pump", "led", "led_dimmed")
+}
+
+# Snapshot fields that change on every poll - not treated as a change of state
+GATEWAY_VOLATILE_FIELDS         = ("last_updated", "device_time")
+
+GATEWAY_CHANGE_LOG_SIZE         = 10000
+GATEWAY_COMMAND_HISTORY_SIZE    = 1000
+GATEWAY_MAX_LONG_POLL_SECS      = 60
+GATEWAY_SSE_KEEPALIVE_SECS      = 15
+
+class PetoneerGatewayCommand:
+    """
+    One command queued through the gateway
+    """
+
+    def __init__(self, command_id:int, device_code:str, command:str, arguments:dict):
+        self.id = command_id
+        self.device_code = device_code
+        self.command = command
+        self.arguments = arguments
+        self.status = GATEWAY_COMMAND_QUEUED
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    @property
+    def key(self):
+        # Identical commands (same device, command and arguments) share a key
+        return (self.device_code, self.command, tuple(sorted(self.arguments.items())))
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "sn": self.device_code,
+            "command": self.command,
+            "arguments": self.arguments,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error
+        }
+
+# -------------------------------------------------
+
+class PetoneerGateway:
+    """
+    Polls a set of fountains through one Petoneer client and serves their cached
+    state (and a shared, rate-limited command queue) over HTTP
+    """
+
+    def __init__(self, petoneer, device_codes:list = None, poll_interval_secs:float = SECONDS_DEVICE_DETAILS_CACHE,
+        host:str = "127.0.0.1", port:int = 0, max_commands_per_sec:float = 2.0, command_queue_size:int = 1000, **bulk_options):
+        if (poll_interval_secs <= 0):
+            raise PetoneerInvalidArgument('PetoneerGateway', 'poll_interval_secs', 'Poll interval must be greater than zero')
+
+        if (max_commands_per_sec <= 0):
+            raise PetoneerInvalidArgument('PetoneerGateway', 'max_commands_per_sec', 'Command rate must be greater than zero')
+
+        self._petoneer = petoneer
+        self._device_codes = (list(device_codes) if (device_codes != None) else None)
+        self._allowed_device_codes = (frozenset(self._device_codes) if (device_codes != None) else None)
+        self._poll_interval_secs = poll_interval_secs
+        self._max_commands_per_sec = max_commands_per_sec
+        self._bulk_options = bulk_options
+
+        # Cached state: serial number -> (seq, snapshot dict), plus a log of (seq, serial number)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._seq = 0
+        self._fountains = {}
+        self._change_log = deque(maxlen=GATEWAY_CHANGE_LOG_SIZE)
+        self._last_poll = None
+        self._last_poll_errors = {}
+
+        # Command queue
+        self._command_queue = queue.Queue(maxsize=command_queue_size)
+        self._command_ids = itertools.count(1)
+        self._commands = OrderedDict()
+        self._pending_commands = {}
+        self._stats = {"polls": 0, "commands": 0, "commands_coalesced": 0, "commands_rejected": 0}
+
+        self._stopping = threading.Event()
+        self._threads = []
+
+        gateway = self
+        class RequestHandler(PetoneerGatewayRequestHandler):
+            pass
+        RequestHandler.gateway = gateway
+
+        self._server = PetoneerGatewayServer((host, port), RequestHandler)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def seq(self):
+        return self._seq
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["fountains"] = len(self._fountains)
+        stats["commands_queued"] = self._command_queue.qsize()
+        return stats
+
+    def start(self):
+        for (target, name) in ((self._pollLoop, 'PetoneerGateway-poll'),
+                               (self._commandLoop, 'PetoneerGateway-commands'),
+                               (self._server.serve_forever, 'PetoneerGateway-http')):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        with self._changed:
+            self._changed.notify_all()
+
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def poll(self):
+        """
+        Refreshes every fountain from upstream once, and publishes any that changed
+        """
+        result = self._petoneer.refresh_fountains(self._device_codes, force=True, **self._bulk_options)
+
+        for device in result.succeeded:
+            self.publish(self._petoneer.getFountain(device.device_code).snapshot())
+
+        with self._lock:
+            self._stats["polls"] += 1
+            self._last_poll = monotonic()
+            self._last_poll_errors = {device.device_code: str(device.error) for device in result.failed}
+
+        return result
+
+    def publish(self, snapshot):
+        """
+        Stores a fountain snapshot - consumers waiting for changes are woken if the
+        fountain's state differs from what was cached
+        """
+        snapshot_dict = snapshot.to_dict()
+
+        with self._changed:
+            cached = self._fountains.get(snapshot.sn)
+            if (cached != None) and (PetoneerGateway._sameState(cached[1], snapshot_dict)):
+                # Keep the freshest timestamps, without waking anyone
+                self._fountains[snapshot.sn] = (cached[0], snapshot_dict)
+                return False
+
+            self._seq += 1
+            self._fountains[snapshot.sn] = (self._seq, snapshot_dict)
+            self._change_log.append((self._seq, snapshot.sn))
+            self._changed.notify_all()
+            return True
+
+    def getFountains(self):
+        with self._lock:
+            return self._seq, [entry[1] for entry in self._fountains.values()]
+
+    def getFountain(self, device_code:str):
+        entry = self._fountains.get(device_code)
+        return (entry[1] if (entry != None) else None)
+
+    def getChanges(self, since:int, timeout_secs:float = 0):
+        """
+        Returns (seq, list of snapshot dicts changed after 'since'), waiting up to
+        timeout_secs for a change if there are none yet
+        """
+        deadline = monotonic() + timeout_secs
+
+        with self._changed:
+            while (self._seq <= since) and (not self._stopping.is_set()):
+                remaining = deadline - monotonic()
+                if (remaining <= 0):
+                    break
+                self._changed.wait(remaining)
+
+            if (self._seq <= since):
+                return self._seq, []
+
+            if (len(self._change_log) == 0) or (self._change_log[0][0] > since + 1):
+                # Older than the change log - send everything
+                changed_codes = list(self._fountains.keys())
+            else:
+                changed_codes = list(dict.fromkeys(device_code for (seq, device_code) in self._change_log if (seq > since)))
+
+            return self._seq, [self._fountains[device_code][1] for device_code in changed_codes if (device_code in self._fountains)]
+
+    def submitCommand(self, device_code:str, command:str, arguments:dict = None):
+        """
+        Queues a command for a fountain - returns the PetoneerGatewayCommand (an
+        identical command already waiting in the queue is returned instead of
+        queuing another one). If the gateway was given a list of fountains, only
+        those fountains can be commanded.
+        """
+        if (self._allowed_device_codes != None) and (device_code not in self._allowed_device_codes):
+            raise PetoneerInvalidArgument('PetoneerGateway.submitCommand', 'device_code', f'Unknown fountain "{device_code}"')
+
+        if (not isinstance(command, str)) or (command not in GATEWAY_COMMANDS):
+            raise PetoneerInvalidArgument('PetoneerGateway.submitCommand', 'command', f'Unknown command "{command}"')
+
+        arguments = {name: value for (name, value) in (arguments or {}).items() if (name in GATEWAY_COMMANDS[command])}
+
+        for (name, value) in arguments.items():
+            # None leaves a set_state value unchanged
+            if (value != None) and (not isinstance(value, bool)):
+                raise PetoneerInvalidArgument('PetoneerGateway.submitCommand', name, f'Argument "{name}" must be true, false or null')
+        gateway_command = PetoneerGatewayCommand(next(self._command_ids), device_code, command, arguments)
+
+        with self._lock:
+            pending = self._pending_commands.get(gateway_command.key)
+            if (pending != None):
+                self._stats["commands_coalesced"] += 1
+                return pending
+
+            try:
+                self._command_queue.put_nowait(gateway_command)
+            except queue.Full:
+                self._stats["commands_rejected"] += 1
+                raise PetoneerInvalidArgument('PetoneerGateway.submitCommand', 'queue', 'Command queue is full')
+
+            self._pending_commands[gateway_command.key] = gateway_command
+            self._commands[gateway_command.id] = gateway_command
+            while (len(self._commands) > GATEWAY_COMMAND_HISTORY_SIZE):
+                self._commands.popitem(last=False)
+
+        return gateway_command
+
+    def getCommand(self, command_id:int):
+        return self._commands.get(command_id)
+
+    def _pollLoop(self):
+        while (not self._stopping.is_set()):
+            started = monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                if (Debug):
+                    print(f"Gateway poll failed: {e}")
+
+            self._stopping.wait(max(0.0, self._poll_interval_secs - (monotonic() - started)))
+
+    def _commandLoop(self):
+        interval = 1.0 / self._max_commands_per_sec
+        next_send = monotonic()
+
+        while (not self._stopping.is_set()):
+            try:
+                gateway_command = self._command_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            delay = next_send - monotonic()
+            if (delay > 0) and (self._stopping.wait(delay)):
+                break
+            next_send = max(monotonic(), next_send) + interval
+
+            with self._lock:
+                # Once running, an identical command should queue again
+                self._pending_commands.pop(gateway_command.key, None)
+                self._stats["commands"] += 1
+
+            self._runCommand(gateway_command)
+
+    def _runCommand(self, gateway_command:PetoneerGatewayCommand):
+        gateway_command.status = GATEWAY_COMMAND_RUNNING
+        try:
+            result = getattr(self._petoneer, gateway_command.command)(gateway_command.device_code, **gateway_command.arguments)
+            gateway_command.result = result
+            gateway_command.status = GATEWAY_COMMAND_SUCCESS
+
+        except Exception as e:
+            gateway_command.error = str(e)
+            gateway_command.status = GATEWAY_COMMAND_FAILED
+
+        if (gateway_command.status == GATEWAY_COMMAND_SUCCESS):
+            # Commands write through to the cached fountain - share the new state now
+            # (a fountain that isn't cached yet is picked up by the next poll). The
+            # command has been applied, so a failure here doesn't change its status.
+            fountain = self._petoneer._fountains.get(gateway_command.device_code)
+            if (fountain != None):
+                try:
+                    self.publish(fountain.snapshot())
+                except Exception as e:
+                    if (Debug):
+                        print(f"Gateway could not publish {gateway_command.device_code} after command: {e}")
+
+        gateway_command.done.set()
+
+    @staticmethod
+    def _sameState(previous:dict, current:dict):
+        for (field, value) in current.items():
+            if (field not in GATEWAY_VOLATILE_FIELDS) and (previous.get(field) != value):
+                return False
+        return True
+
+# -------------------------------------------------
+
+class PetoneerGatewayServer(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+# -------------------------------------------------
+
+class PetoneerGatewayRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler for PetoneerGateway (the 'gateway' class attribute is set
+    on a per-server subclass)
+    """
+    gateway = None
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [part for part in url.path.split("/") if (part != "")]
+        query = urllib.parse.parse_qs(url.query)
+
+        if (parts == ["fountains"]):
+            seq, fountains = self.gateway.getFountains()
+            return self._sendJson(200, {"seq": seq, "fountains": fountains})
+
+        if (len(parts) == 2) and (parts[0] == "fountains"):
+            fountain = self.gateway.getFountain(parts[1])
+            if (fountain == None):
+                return self._sendJson(404, {"error": "Unknown fountain"})
+            return self._sendJson(200, fountain)
+
+        if (parts == ["changes"]):
+            try:
+                since = int(query.get("since", ["0"])[0])
+                timeout_secs = min(float(query.get("timeout", ["30"])[0]), GATEWAY_MAX_LONG_POLL_SECS)
+            except ValueError:
+                return self._sendJson(400, {"error": "Invalid 'since' or 'timeout'"})
+
+            seq, fountains = self.gateway.getChanges(since, timeout_secs)
+            return self._sendJson(200, {"seq": seq, "fountains": fountains})
+
+        if (parts == ["events"]):
+            return self._streamEvents()
+
+        if (len(parts) == 2) and (parts[0] == "commands") and (parts[1].isdigit()):
+            gateway_command = self.gateway.getCommand(int(parts[1]))
+            if (gateway_command == None):
+                return self._sendJson(404, {"error": "Unknown command"})
+            return self._sendJson(200, gateway_command.to_dict())
+
+        if (parts == ["stats"]):
+            return self._sendJson(200, self.gateway.stats)
+
+        self._sendJson(404, {"error": "Not found"})
+
+    def do_POST(self):
+        parts = [part for part in urllib.parse.urlsplit(self.path).path.split("/") if (part != "")]
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._sendJson(400, {"error": "Invalid JSON body"})
+
+        if (not isinstance(body, dict)):
+            return self._sendJson(400, {"error": "Request body must be a JSON object"})
+
+        if (len(parts) != 3) or (parts[0] != "fountains") or (parts[2] != "commands"):
+            return self._sendJson(404, {"error": "Not found"})
+
+        try:
+            gateway_command = self.gateway.submitCommand(parts[1], body.get("command"), body)
+        except PetoneerInvalidArgument as e:
+            status = {'queue': 503, 'device_code': 404}.get(e.argument_name, 400)
+            return self._sendJson(status, {"error": e.message})
+
+        if (body.get("wait")):
+            gateway_command.done.wait(GATEWAY_MAX_LONG_POLL_SECS)
+            return self._sendJson(200, gateway_command.to_dict())
+
+        self._sendJson(202, gateway_command.to_dict())
+
+    def _streamEvents(self):
+        try:
+            since = int(self.headers.get("Last-Event-ID", self.gateway.seq))
+        except ValueError:
+            since = self.gateway.seq
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        try:
+            while (not self.gateway._stopping.is_set()):
+                seq, fountains = self.gateway.getChanges(since, GATEWAY_SSE_KEEPALIVE_SECS)
+                if (len(fountains) == 0):
+                    self.wfile.write(b": keepalive\n\n")
+                else:
+                    events = [f"id: {seq}\nevent: fountain\ndata: {json.dumps(fountain, separators=(',', ':'))}\n\n" for fountain in fountains]
+                    self.wfile.write("".join(events).encode("utf-8"))
+                self.wfile.flush()
+                since = seq
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _sendJson(self, status:int, body):
+        response = json.dumps(body, separators=(',', ':')).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
@@ -1,12 +1,16 @@
 from datetime import time, date, datetime
+from time import monotonic
 import logging
 import urllib.parse
 import math
 import json
-import requests
 
 from petoneerErrors import *
 from petoneerConst import *
+from petoneerTransport import *
+from petoneerDeadline import *
+from petoneerProfiler import *
+from petoneerPriority import *
 
 class PetoneerHelpers:
     """
@@ -16,9 +20,19 @@ class PetoneerHelpers:
 
     API_URL                             = "https://as.revogi.net/app"
 
+    # Transport used by getAPIrequest (see petoneerTransport.py)
+    _transport                          = PetoneerHttpTransport()
+
+    # Timeout applied to each API request, and hedging of idempotent reads (see petoneerDeadline.py)
+    _request_timeout_secs               = SECONDS_API_REQUEST_TIMEOUT
+    _hedging_policy                     = None
+
+    # Optional cap on requests in flight, shared out by priority lane (see petoneerPriority.py)
+    _priority_limiter                   = None
+
     @staticmethod
     def timeObjectToScheduleString(schedule_time: datetime):
-        schedule_value = (schedule_time.hour * 60) + schedule_time.min
+        schedule_value = (schedule_time.hour * 60) + schedule_time.minute
         return schedule_value
 
     @staticmethod
@@ -52,7 +66,7 @@ class PetoneerHelpers:
             (schedule_end_time > current_time))
 
     @staticmethod
-    def getAPIrequest(methodPath:str, payload:str, access_token=None):
+    def getAPIrequest(methodPath:str, payload:str, access_token=None, deadline:PetoneerDeadline = None):
         if (access_token != None) and (access_token != ""):
             headers = { 
                 "accessToken": access_token
@@ -60,14 +74,197 @@ class PetoneerHelpers:
         else:
             headers = {}
 
+        # Each request gets its own timeout, capped by the deadline of the overall operation
+        if (deadline != None):
+            if (deadline.expired):
+                raise PetoneerRequestTimeout(PetoneerHelpers.getApiUrlFromPath(methodPath), deadline.timeout_secs, 'Operation deadline expired before request was sent')
+            timeout_secs = deadline.getRequestTimeout(PetoneerHelpers._request_timeout_secs)
+        else:
+            timeout_secs = PetoneerHelpers._request_timeout_secs
+
+        transport = PetoneerHelpers._transport
+        hedging_policy = PetoneerHelpers._hedging_policy
+        priority_limiter = PetoneerHelpers._priority_limiter
+
         # Make the request
         try:
-            resp = requests.post(PetoneerHelpers.getApiUrlFromPath(methodPath), json=payload, headers=headers)
+            with PetoneerProfiler.phase('network'):
+                if (priority_limiter != None):
+                    started = monotonic()
+                    priority = PetoneerPriority.getLane(PRIORITY_ON_DEMAND if (methodPath in PRIORITY_READ_API_PATHS) else PRIORITY_INTERACTIVE)
+                    with priority_limiter.slot(priority, timeout_secs):
+                        # Time spent waiting for a slot counts against the request's timeout
+                        if (timeout_secs != None):
+                            timeout_secs = max(0.001, timeout_secs - (monotonic() - started))
+                        resp = PetoneerHelpers._sendRequest(transport, hedging_policy, methodPath, payload, headers, timeout_secs,
+                            priority_limiter, priority)
+                else:
+                    resp = PetoneerHelpers._sendRequest(transport, hedging_policy, methodPath, payload, headers, timeout_secs)
             return resp
 
+        except PetoneerRequestTimeout:
+            raise
+
         except Exception as e:
             raise PetoneerApiServerOffline(PetoneerHelpers.getApiUrlFromPath(methodPath), 501, 'Unable to connect to Petoneer API server - Connection Failed')
 
+    @staticmethod
+    def _sendRequest(transport, hedging_policy, methodPath:str, payload:dict, headers:dict, timeout_secs:float,
+        priority_limiter = None, priority:int = None):
+        if (hedging_policy != None) and (methodPath in HEDGEABLE_API_PATHS):
+            # A hedged second attempt takes a limiter slot of its own (if there is a limiter)
+            return hedging_policy.request(lambda: transport.request(methodPath, payload, headers, timeout_secs), methodPath, timeout_secs,
+                priority_limiter, priority)
+        return transport.request(methodPath, payload, headers, timeout_secs)
+
+    @staticmethod
+    def setTransport(transport):
+        """
+        Replaces the transport used for all API requests (eg: with a
+        PetoneerRecordingTransport or PetoneerReplayTransport). Passing None
+        restores the default HTTP transport.
+        """
+        PetoneerHelpers._transport = transport if (transport != None) else PetoneerHttpTransport()
+
+    @staticmethod
+    def getTransport():
+        return PetoneerHelpers._transport
+
+    @staticmethod
+    def setRequestTimeout(timeout_secs:float):
+        # Timeout for each individual API request (None to wait indefinitely)
+        PetoneerHelpers._request_timeout_secs = timeout_secs
+
+    @staticmethod
+    def setHedgingPolicy(hedging_policy:PetoneerHedgingPolicy):
+        """
+        Enables hedged requests for idempotent reads (device details and schedule) -
+        see PetoneerHedgingPolicy. Passing None disables hedging.
+        """
+        PetoneerHelpers._hedging_policy = hedging_policy
+
+    @staticmethod
+    def setPriorityLimiter(priority_limiter:PetoneerPriorityLimiter):
+        """
+        Caps the number of API requests in flight, giving free slots to interactive
+        commands first, then on-demand reads, then background polling - see
+        PetoneerPriorityLimiter. Passing None removes the cap.
+        """
+        PetoneerHelpers._priority_limiter = priority_limiter
+
+    @staticmethod
+    def sendDeviceCommand(methodPath:str, payload:dict, access_token:str, error_message:str = 'Unable to send command to Petoneer Fountain - Server Error', deadline:PetoneerDeadline = None):
+        with PetoneerProfiler.cycle(f'command {methodPath}'):
+            resp = PetoneerHelpers.getAPIrequest(methodPath, payload, access_token, deadline)
+
+            if (resp.status_code == 200):
+                with PetoneerProfiler.phase('decode'):
+                    json_resp = resp.json()
+
+                # The API reports rejected commands (eg: unknown device, expired token) in the body
+                if (not isinstance(json_resp, dict)) or (json_resp.get('code') != 200):
+                    raise PetoneerInvalidServerResponse(resp.status_code, resp.url, resp.text,
+                        'Petoneer Fountain command was rejected - Unexpected Server Response')
+
+                device_details = json_resp.get('data')
+                return device_details
+            else:
+                raise PetoneerServerError(resp.status_code, resp.url, resp.text, error_message)
+
+    @staticmethod
+    def getSwitchPayload(device_code:str, switch_on:bool):
+        return {
+            "sn": device_code,
+            "protocol": "3",
+            "switch": (1 if switch_on else 0)
+        }
+
+    @staticmethod
+    def getLedPayload(device_code:str, led_on:bool, leds_dimmed:bool = False):
+        if (not led_on):
+            return {
+                "sn": device_code,
+                "ledmode": 0,
+                "section": [0,1439],
+                "protocol": "3",
+                "led": 0
+            }
+        elif (leds_dimmed):
+            # create payload with LED dimming schedule that spans from 00:00 to 23:59hrs
+            return {
+                "sn": device_code,
+                "protocol": "3",
+                "ledmode": 1,
+                "section": [0, 1439],
+                "led": 1
+            }
+        else:
+            # create a payload with no scheduled times for LED dimming
+            return {
+                "sn": device_code,
+                "protocol": "3",
+                "ledmode": 1,
+                "section": [0, 0],
+                "led": 1
+            }
+
+    @staticmethod
+    def getLedDimmingPayload(device_code:str, start_minute:int, end_minute:int):
+        # LEDs on, dimmed between the two times (minutes since midnight)
+        return {
+            "sn": device_code,
+            "protocol": "3",
+            "ledmode": 1,
+            "section": [start_minute, end_minute],
+            "led": 1
+        }
+
+    @staticmethod
+    def getTimerPayload(device_code:str, enabled:bool, start_minute:int, end_minute:int):
+        # Pump schedule - the pump only runs between the two times (minutes since midnight) while enabled
+        return {
+            "sn": device_code,
+            "protocol": "3",
+            "en": (1 if enabled else 0),
+            "time": [start_minute, end_minute]
+        }
+
+    @staticmethod
+    def getCommandEffects(methodPath:str, payload:dict):
+        """
+        Returns the device info fields a successful command is known to change (so they
+        can be written straight into the cached device info), or an empty dict
+        """
+        if (methodPath == API_DEVICE_SWITCH_PATH):
+            return { "switch": payload["switch"] }
+
+        if (methodPath == API_DEVICE_LED_PATH):
+            return { "led": payload["led"], "ledmode": payload["ledmode"], "section": list(payload["section"]) }
+
+        reset_fields = {
+            API_RESET_WATER_CHANGE_TIMER: "watertime",
+            API_RESET_FILTER_CHANGE_TIMER: "filtertime",
+            API_RESET_CLEAN_PUMP_TIMER: "motortime"
+        }
+        if (methodPath in reset_fields):
+            # Countdown restarts now - move the device's clock on as well, so the
+            # other counters don't appear younger than they are
+            now = int(datetime.now().timestamp())
+            return { "time": now, reset_fields[methodPath]: now }
+
+        return {}
+
+    @staticmethod
+    def getScheduleCommandEffects(methodPath:str, payload:dict):
+        """
+        Returns the device schedule info fields a successful command is known to
+        change, or an empty dict
+        """
+        if (methodPath == API_DEVICE_TIMER_PATH):
+            return { "en": payload["en"], "time": list(payload["time"]) }
+
+        return {}
+
     @staticmethod
     def getApiUrlFromPath(apiPath):
         return API_URL + apiPath
@@ -0,0 +1,175 @@
+"""
+Tracks which fountains are offline (unplugged / not connected to the Internet), so
+polling doesn't spend requests and worker time on them every cycle. A fountain is
+marked offline when the device list (the 'line' flag of /user/500) or its device
+details report it, and is then only probed on an exponentially backed-off schedule
+(initial_backoff_secs, doubling up to max_backoff_secs) until it answers again.
+
+    tracker = PetoneerOfflineTracker(on_online=lambda sn: print(sn, "is back online"))
+    pet.setOfflineTracker(tracker)
+    pet.refresh_fountains()                 # offline fountains are only polled when a probe is due
+"""
+import random
+import threading
+from time import monotonic
+
+from petoneerErrors import *
+from petoneerConst import *
+
+class PetoneerOfflineTracker:
+    """
+    Offline fountains and their probe schedule. on_online(device_code) and
+    on_offline(device_code) are called (outside of the tracker's lock) when a
+    fountain comes back online, or is first found to be offline.
+    """
+
+    def __init__(self, initial_backoff_secs:float = SECONDS_OFFLINE_PROBE_INITIAL, max_backoff_secs:float = SECONDS_OFFLINE_PROBE_MAX,
+        jitter:float = 0.1, on_online = None, on_offline = None):
+        if (initial_backoff_secs <= 0):
+            raise PetoneerInvalidArgument('PetoneerOfflineTracker', 'initial_backoff_secs', 'Probe back-off must be greater than zero')
+
+        if (max_backoff_secs < initial_backoff_secs):
+            raise PetoneerInvalidArgument('PetoneerOfflineTracker', 'max_backoff_secs', 'Maximum probe back-off cannot be less than the initial back-off')
+
+        if (jitter < 0) or (jitter >= 1):
+            raise PetoneerInvalidArgument('PetoneerOfflineTracker', 'jitter', 'Jitter must be between 0.0 and 1.0')
+
+        self._initial_backoff_secs = initial_backoff_secs
+        self._max_backoff_secs = max_backoff_secs
+        self._jitter = jitter
+        self._on_online = on_online
+        self._on_offline = on_offline
+        self._lock = threading.Lock()
+
+        # Serial number -> [current back-off secs, next probe (monotonic secs), offline since (monotonic secs)]
+        self._offline = {}
+        self._stats = {"probes": 0, "skipped": 0, "went_offline": 0, "came_online": 0}
+
+    def __len__(self):
+        return len(self._offline)
+
+    def __contains__(self, device_code):
+        return (device_code in self._offline)
+
+    @property
+    def offline_devices(self):
+        return list(self._offline.keys())
+
+    @property
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["offline"] = len(self._offline)
+            return stats
+
+    def isOffline(self, device_code:str):
+        return (device_code in self._offline)
+
+    def getNextProbe(self, device_code:str):
+        # Seconds until the fountain is next probed (None if it isn't offline)
+        entry = self._offline.get(device_code)
+        if (entry == None):
+            return None
+        return max(0.0, entry[1] - monotonic())
+
+    def filterDue(self, device_codes:list):
+        """
+        Returns the serial numbers to poll now - every fountain not known to be
+        offline, plus the offline fountains whose probe is due (their next probe is
+        moved on, so concurrent polls don't probe them again)
+        """
+        now = monotonic()
+        due = []
+        skipped = 0
+
+        with self._lock:
+            for device_code in device_codes:
+                entry = self._offline.get(device_code)
+                if (entry == None):
+                    due.append(device_code)
+                elif (entry[1] <= now):
+                    entry[1] = now + self._getDelay(entry[0])
+                    self._stats["probes"] += 1
+                    due.append(device_code)
+                else:
+                    skipped += 1
+
+            self._stats["skipped"] += skipped
+
+        return due
+
+    def markOffline(self, device_code:str):
+        """
+        Records that a fountain is offline - its first probe is due after the initial
+        back-off, and each further failed probe doubles the back-off. Returns True if
+        the fountain wasn't already known to be offline.
+        """
+        now = monotonic()
+
+        with self._lock:
+            entry = self._offline.get(device_code)
+            if (entry == None):
+                self._offline[device_code] = [self._initial_backoff_secs, now + self._getDelay(self._initial_backoff_secs), now]
+                self._stats["went_offline"] += 1
+            else:
+                entry[0] = min(entry[0] * 2, self._max_backoff_secs)
+                entry[1] = now + self._getDelay(entry[0])
+
+        if (entry == None):
+            self._notify(self._on_offline, device_code)
+        return (entry == None)
+
+    def markOnline(self, device_code:str):
+        """
+        Records that a fountain answered - returns True if it was offline (and has
+        come back online)
+        """
+        with self._lock:
+            entry = self._offline.pop(device_code, None)
+            if (entry != None):
+                self._stats["came_online"] += 1
+
+        if (entry != None):
+            self._notify(self._on_online, device_code)
+        return (entry != None)
+
+    def forget(self, device_code:str):
+        with self._lock:
+            return (self._offline.pop(device_code, None) != None)
+
+    def syncRegistry(self, registry, delta = None):
+        """
+        Applies the 'line' flags of a PetoneerDeviceRegistry - either the changes
+        in a PetoneerDeviceRegistryDelta, or (without a delta) every device in it
+        """
+        if (delta == None):
+            for device_code in registry.offline_devices:
+                self.markOffline(device_code)
+            return
+
+        for device_code in delta.added:
+            if (registry.isOnline(device_code) == False):
+                self.markOffline(device_code)
+
+        for device_code in delta.went_offline:
+            self.markOffline(device_code)
+
+        for device_code in delta.went_online:
+            self.markOnline(device_code)
+
+        for device_code in delta.removed:
+            self.forget(device_code)
+
+    def _getDelay(self, backoff_secs:float):
+        # Spread the probes of fountains that went offline together (eg: a power cut)
+        return backoff_secs * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+    def _notify(self, callback, device_code:str):
+        if (callback == None):
+            return
+
+        try:
+            callback(device_code)
+        except Exception as e:
+            if (Debug):
+                print(f"Offline tracker callback failed for device {device_code}: {e}")
@@ -0,0 +1,187 @@
+"""
+Priority lanes for calls to the Petoneer API, so interactive commands are not stuck
+behind a large fleet refresh. Every request belongs to one of three lanes:
+
+    PRIORITY_INTERACTIVE    device commands (turn_on, turn_led_off, ...)
+    PRIORITY_ON_DEMAND      reads made for a caller who is waiting (eg: getFountain)
+    PRIORITY_BACKGROUND     polling sweeps (refresh_fountains, the gateway's poll, ...)
+
+A PetoneerPriorityLimiter (see PetoneerHelpers.setPriorityLimiter) caps the number of
+requests in flight. A free slot always goes to the highest lane with a request
+waiting, and background requests can never take the last few (reserved) slots, so
+interactive commands get a slot straight away even in the middle of a sweep.
+
+The lane of a request defaults to interactive for commands and on-demand for reads;
+code running inside PetoneerPriority.lane(...) (eg: every request made by a bulk
+refresh) uses that lane instead.
+"""
+import threading
+from time import monotonic
+
+from petoneerErrors import *
+from petoneerConst import *
+
+PRIORITY_INTERACTIVE            = 0
+PRIORITY_ON_DEMAND              = 1
+PRIORITY_BACKGROUND             = 2
+
+PRIORITY_LANE_NAMES             = ("interactive", "on_demand", "background")
+
+# Requests that only read state (the on-demand lane by default) - anything else is a command
+PRIORITY_READ_API_PATHS         = (API_LOGIN_PATH, API_DEVICE_LIST_PATH, API_DEVICE_DETAILS_PATH, API_DEVICE_SCHEDULE_DETAILS_PATH)
+
+class PetoneerPriorityLane:
+    """
+    Context manager setting the priority lane of every request made on the current
+    thread (restores the previous lane on exit)
+    """
+
+    def __init__(self, priority:int):
+        self._priority = priority
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(PetoneerPriority._thread_local, 'priority', None)
+        PetoneerPriority._thread_local.priority = self._priority
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        PetoneerPriority._thread_local.priority = self._previous
+        return False
+
+# -------------------------------------------------
+
+class PetoneerPriority:
+    """
+    Class that provides static functions to set and read the priority lane of the
+    current thread
+    """
+
+    _thread_local                       = threading.local()
+
+    @staticmethod
+    def lane(priority:int):
+        if (priority not in (PRIORITY_INTERACTIVE, PRIORITY_ON_DEMAND, PRIORITY_BACKGROUND)):
+            raise PetoneerInvalidArgument('PetoneerPriority.lane', 'priority', 'Unknown priority lane')
+        return PetoneerPriorityLane(priority)
+
+    @staticmethod
+    def getLane(default:int = PRIORITY_ON_DEMAND):
+        priority = getattr(PetoneerPriority._thread_local, 'priority', None)
+        return (priority if (priority != None) else default)
+
+# -------------------------------------------------
+
+class PetoneerPrioritySlot:
+    """
+    Context manager holding one request slot of a PetoneerPriorityLimiter
+    """
+
+    def __init__(self, limiter, priority:int, timeout_secs:float):
+        self._limiter = limiter
+        self._priority = priority
+        self._timeout_secs = timeout_secs
+
+    def __enter__(self):
+        if (not self._limiter.acquire(self._priority, self._timeout_secs)):
+            raise PetoneerRequestTimeout(API_URL, self._timeout_secs,
+                f'Timed out waiting for a free request slot ({PRIORITY_LANE_NAMES[self._priority]} lane)')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._limiter.release()
+        return False
+
+# -------------------------------------------------
+
+class PetoneerPriorityLimiter:
+    """
+    Limits the number of API requests in flight to max_concurrent, handing free slots
+    to the highest priority lane first. Background requests cannot use the last
+    reserved_slots slots (default: a quarter of max_concurrent, at least one - or
+    none with a single slot). Hedged second attempts (see PetoneerHedgingPolicy)
+    also need a free slot, and are not sent without one.
+    """
+
+    def __init__(self, max_concurrent:int = 16, reserved_slots:int = None):
+        if (max_concurrent < 1):
+            raise PetoneerInvalidArgument('PetoneerPriorityLimiter', 'max_concurrent', 'At least one request slot is required')
+
+        if (reserved_slots == None):
+            reserved_slots = min(max_concurrent - 1, max(1, max_concurrent // 4))
+
+        if (reserved_slots < 0) or (reserved_slots >= max_concurrent):
+            raise PetoneerInvalidArgument('PetoneerPriorityLimiter', 'reserved_slots', 'Reserved slots must leave at least one slot for background requests')
+
+        self._max_concurrent = max_concurrent
+        self._reserved_slots = reserved_slots
+        self._condition = threading.Condition()
+        self._in_use = 0
+        self._waiting = [0, 0, 0]
+        self._acquired = [0, 0, 0]
+        self._wait_secs = [0.0, 0.0, 0.0]
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    @property
+    def stats(self):
+        with self._condition:
+            return {name: {"requests": self._acquired[lane], "waiting": self._waiting[lane],
+                           "total_wait_secs": self._wait_secs[lane]}
+                    for (lane, name) in enumerate(PRIORITY_LANE_NAMES)}
+
+    def slot(self, priority:int, timeout_secs:float = None):
+        return PetoneerPrioritySlot(self, priority, timeout_secs)
+
+    def acquire(self, priority:int, timeout_secs:float = None):
+        """
+        Waits for a free slot (at most timeout_secs, if given) - returns False if
+        none became available in time
+        """
+        started = monotonic()
+
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while (not self._canAcquire(priority)):
+                    if (timeout_secs == None):
+                        self._condition.wait()
+                    else:
+                        remaining = timeout_secs - (monotonic() - started)
+                        if (remaining <= 0):
+                            return False
+                        self._condition.wait(remaining)
+
+                self._in_use += 1
+                self._acquired[priority] += 1
+                self._wait_secs[priority] += monotonic() - started
+                return True
+
+            finally:
+                self._waiting[priority] -= 1
+                if (self._waiting[priority] == 0):
+                    # Lower lanes may have been held back by this lane
+                    self._condition.notify_all()
+
+    def release(self):
+        with self._condition:
+            self._in_use -= 1
+            self._condition.notify_all()
+
+    def _canAcquire(self, priority:int):
+        free_slots = self._max_concurrent - self._in_use
+        if (free_slots <= 0):
+            return False
+
+        # Higher lanes always get the next free slot
+        for higher in range(priority):
+            if (self._waiting[higher] > 0):
+                return False
+
+        # Background traffic is throttled, leaving room for the other lanes
+        if (priority == PRIORITY_BACKGROUND) and (free_slots <= self._reserved_slots):
+            return False
+
+        return True
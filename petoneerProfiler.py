@@ -0,0 +1,262 @@
+"""
+On-demand profiling of refresh and command cycles. Profiling is switched on at runtime
+for a given number of cycles:
+
+    PetoneerProfiler.enable(cycles=5, output_path="petoneer_profile.txt")
+
+Each profiled cycle (a fleet refresh, bulk command or fountain update) is wrapped with
+cProfile and tracemalloc, and the time spent in each phase - network (waiting on the
+API), decode (JSON decoding), parse (applying device info to the details classes) and
+derive (date/time conversions for schedules and maintenance counters) - is written to
+the output file. Phase times are exclusive (a nested phase is not counted in its
+parent), and are collected from every thread taking part in the cycle. cProfile only
+sees the thread that started the cycle.
+
+While disabled, the hooks only cost a single attribute check.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+PROFILE_PHASES                  = ("network", "decode", "parse", "derive")
+PROFILE_TOP_FUNCTIONS           = 25
+PROFILE_TOP_ALLOCATIONS         = 10
+
+class PetoneerNullContext:
+    """
+    Context manager that does nothing - returned by the profiling hooks while
+    profiling is disabled
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+PETONEER_NULL_CONTEXT = PetoneerNullContext()
+
+# -------------------------------------------------
+
+class PetoneerProfilePhase:
+    """
+    Times one phase on the current thread, pausing the enclosing phase (if any) so
+    that phase times are exclusive
+    """
+
+    def __init__(self, session, name:str):
+        self._session = session
+        self._name = name
+
+    def __enter__(self):
+        stack = self._session.getThreadStack()
+        now = perf_counter()
+        if (len(stack) > 0):
+            parent = stack[-1]
+            self._session.addPhaseTime(parent[0], now - parent[1])
+        stack.append([self._name, now])
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stack = self._session.getThreadStack()
+        now = perf_counter()
+        name, started = stack.pop()
+        self._session.addPhaseTime(name, now - started, count=1)
+        if (len(stack) > 0):
+            stack[-1][1] = now
+        return False
+
+# -------------------------------------------------
+
+class PetoneerProfileCycle:
+    """
+    One profiled cycle - collects phase times (from any thread), and runs cProfile
+    (on the starting thread) and tracemalloc for the duration of the cycle
+    """
+
+    def __init__(self, name:str, use_cprofile:bool, use_tracemalloc:bool):
+        self._name = name
+        self._use_cprofile = use_cprofile
+        self._use_tracemalloc = use_tracemalloc
+        self._lock = threading.Lock()
+        self._thread_local = threading.local()
+        self._phase_times = {}
+        self._phase_counts = {}
+        self._profile = None
+        self._started_tracemalloc = False
+        self._started = None
+        self._wall_secs = 0.0
+        self._report = ""
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def phase_times(self):
+        with self._lock:
+            return dict(self._phase_times)
+
+    @property
+    def wall_secs(self):
+        return self._wall_secs
+
+    def getThreadStack(self):
+        stack = getattr(self._thread_local, 'stack', None)
+        if (stack == None):
+            stack = self._thread_local.stack = []
+        return stack
+
+    def addPhaseTime(self, name:str, elapsed_secs:float, count:int = 0):
+        with self._lock:
+            self._phase_times[name] = self._phase_times.get(name, 0.0) + elapsed_secs
+            self._phase_counts[name] = self._phase_counts.get(name, 0) + count
+
+    def start(self):
+        if (self._use_tracemalloc) and (not tracemalloc.is_tracing()):
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        if (self._use_cprofile):
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Another profiler is already active on this thread
+                self._profile = None
+
+        self._started = perf_counter()
+
+    def stop(self):
+        self._wall_secs = perf_counter() - self._started
+
+        if (self._profile != None):
+            self._profile.disable()
+
+        allocations = None
+        peak_memory = None
+        if (self._started_tracemalloc):
+            allocations = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        self._report = self._buildReport(allocations, peak_memory)
+
+    def getReport(self):
+        return self._report
+
+    def _buildReport(self, allocations, peak_memory):
+        lines = [f"=== {datetime.now().isoformat(timespec='seconds')} - {self._name}: {self._wall_secs * 1000:.1f}ms wall time ==="]
+
+        phase_times = self.phase_times
+        accounted = sum(phase_times.values())
+        for phase in PROFILE_PHASES + tuple(name for name in phase_times if (name not in PROFILE_PHASES)):
+            elapsed = phase_times.get(phase, 0.0)
+            lines.append(f"  {phase:<10} {elapsed * 1000:10.1f}ms  ({self._phase_counts.get(phase, 0)} calls)")
+        lines.append(f"  {'other':<10} {max(0.0, self._wall_secs - accounted) * 1000:10.1f}ms  (wall time not covered by phases - approximate when threads overlap)")
+
+        if (peak_memory != None):
+            lines.append(f"  Peak traced memory: {peak_memory / 1024:.1f} KiB")
+            for statistic in allocations:
+                lines.append(f"    {statistic}")
+
+        if (self._profile != None):
+            output = io.StringIO()
+            pstats.Stats(self._profile, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+            lines.append(output.getvalue())
+
+        return "\n".join(lines) + "\n"
+
+# -------------------------------------------------
+
+class PetoneerProfiler:
+    """
+    Class that provides static functions to switch profiling on for a number of
+    cycles, and the hooks used throughout this module to mark cycles and phases
+    """
+
+    _lock                               = threading.Lock()
+    _cycles_remaining                   = 0
+    _output_path                        = None
+    _use_cprofile                       = True
+    _use_tracemalloc                    = True
+    _current_cycle                      = None
+    _last_cycle                         = None
+
+    @staticmethod
+    def enable(cycles:int = 1, output_path:str = "petoneer_profile.txt", use_cprofile:bool = True, use_tracemalloc:bool = True):
+        with PetoneerProfiler._lock:
+            PetoneerProfiler._cycles_remaining = cycles
+            PetoneerProfiler._output_path = output_path
+            PetoneerProfiler._use_cprofile = use_cprofile
+            PetoneerProfiler._use_tracemalloc = use_tracemalloc
+
+    @staticmethod
+    def disable():
+        with PetoneerProfiler._lock:
+            PetoneerProfiler._cycles_remaining = 0
+
+    @staticmethod
+    def isEnabled():
+        return (PetoneerProfiler._cycles_remaining > 0) or (PetoneerProfiler._current_cycle != None)
+
+    @staticmethod
+    def getLastCycle():
+        return PetoneerProfiler._last_cycle
+
+    @staticmethod
+    def cycle(name:str):
+        """
+        Hook wrapping a whole refresh / command cycle. Cycles do not nest - while
+        a cycle is being profiled, any inner cycle simply adds to it.
+        """
+        if (PetoneerProfiler._cycles_remaining <= 0) or (PetoneerProfiler._current_cycle != None):
+            return PETONEER_NULL_CONTEXT
+        return PetoneerProfiler._CycleContext(name)
+
+    @staticmethod
+    def phase(name:str):
+        """
+        Hook wrapping one phase (network / decode / parse / derive) of a cycle
+        """
+        cycle = PetoneerProfiler._current_cycle
+        if (cycle == None):
+            return PETONEER_NULL_CONTEXT
+        return PetoneerProfilePhase(cycle, name)
+
+    class _CycleContext:
+        def __init__(self, name:str):
+            self._name = name
+            self._cycle = None
+
+        def __enter__(self):
+            with PetoneerProfiler._lock:
+                if (PetoneerProfiler._cycles_remaining <= 0) or (PetoneerProfiler._current_cycle != None):
+                    return self
+                PetoneerProfiler._cycles_remaining -= 1
+                self._cycle = PetoneerProfileCycle(self._name, PetoneerProfiler._use_cprofile, PetoneerProfiler._use_tracemalloc)
+                PetoneerProfiler._current_cycle = self._cycle
+
+            self._cycle.start()
+            return self
+
+        def __exit__(self, exc_type, exc_value, traceback):
+            if (self._cycle == None):
+                return False
+
+            self._cycle.stop()
+
+            with PetoneerProfiler._lock:
+                PetoneerProfiler._current_cycle = None
+                PetoneerProfiler._last_cycle = self._cycle
+                output_path = PetoneerProfiler._output_path
+
+            if (output_path != None):
+                with open(output_path, 'a', encoding='utf-8') as output_file:
+                    output_file.write(self._cycle.getReport())
+
+            return False
@@ -0,0 +1,364 @@
+"""
+Push-based device updates for Petoneer fountains. The device list returned by the
+API reports a 'WebSocket' socket_type for each fountain - rather than polling the
+device details every 30 seconds, a PetoneerPushListener holds a persistent socket
+open and applies each state update it receives to the matching PetoneerFountain.
+
+The transport is pluggable (any subclass of PetoneerPushTransport), and whenever the
+channel drops the fountains fall back to normal polling until it reconnects.
+"""
+import base64
+import hashlib
+import json
+import os
+import socket
+import ssl
+import struct
+import threading
+import urllib.parse
+
+from petoneerErrors import *
+from petoneerConst import *
+
+WEBSOCKET_GUID                  = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+WEBSOCKET_OPCODE_CONTINUATION   = 0x0
+WEBSOCKET_OPCODE_TEXT           = 0x1
+WEBSOCKET_OPCODE_BINARY         = 0x2
+WEBSOCKET_OPCODE_CLOSE          = 0x8
+WEBSOCKET_OPCODE_PING           = 0x9
+WEBSOCKET_OPCODE_PONG           = 0xA
+
+class PetoneerWebSocketFraming:
+    """
+    Class that provides static helper functions to read and write RFC 6455 WebSocket
+    frames on a connected socket (shared by the client transport and the local test
+    server in petoneerPushServer.py)
+    """
+
+    @staticmethod
+    def getAcceptKey(websocket_key:str):
+        digest = hashlib.sha1((websocket_key + WEBSOCKET_GUID).encode('ascii')).digest()
+        return base64.b64encode(digest).decode('ascii')
+
+    @staticmethod
+    def readExactly(sock:socket.socket, num_bytes:int):
+        data = b''
+        while (len(data) < num_bytes):
+            chunk = sock.recv(num_bytes - len(data))
+            if (chunk == b''):
+                raise ConnectionError('WebSocket connection closed by peer')
+            data += chunk
+        return data
+
+    @staticmethod
+    def readHttpHeaders(sock:socket.socket):
+        data = b''
+        while (b'\r\n\r\n' not in data):
+            chunk = sock.recv(1)
+            if (chunk == b''):
+                raise ConnectionError('Connection closed during WebSocket handshake')
+            data += chunk
+
+        lines = data.decode('iso-8859-1').split('\r\n')
+        headers = {}
+        for line in lines[1:]:
+            if (':' in line):
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        return lines[0], headers
+
+    @staticmethod
+    def writeFrame(sock:socket.socket, opcode:int, payload:bytes, mask:bool):
+        header = bytes([0x80 | opcode])
+        mask_bit = (0x80 if mask else 0)
+        length = len(payload)
+
+        if (length < 126):
+            header += bytes([mask_bit | length])
+        elif (length < 65536):
+            header += bytes([mask_bit | 126]) + struct.pack('!H', length)
+        else:
+            header += bytes([mask_bit | 127]) + struct.pack('!Q', length)
+
+        if (mask):
+            # Client-to-server frames must always be masked
+            masking_key = os.urandom(4)
+            header += masking_key
+            payload = bytes(b ^ masking_key[i % 4] for i, b in enumerate(payload))
+
+        sock.sendall(header + payload)
+
+    @staticmethod
+    def readFrame(sock:socket.socket):
+        first, second = PetoneerWebSocketFraming.readExactly(sock, 2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        masked = bool(second & 0x80)
+        length = second & 0x7F
+
+        if (length == 126):
+            length = struct.unpack('!H', PetoneerWebSocketFraming.readExactly(sock, 2))[0]
+        elif (length == 127):
+            length = struct.unpack('!Q', PetoneerWebSocketFraming.readExactly(sock, 8))[0]
+
+        masking_key = (PetoneerWebSocketFraming.readExactly(sock, 4) if masked else None)
+        payload = PetoneerWebSocketFraming.readExactly(sock, length)
+
+        if (masked):
+            payload = bytes(b ^ masking_key[i % 4] for i, b in enumerate(payload))
+
+        return fin, opcode, payload
+
+    @staticmethod
+    def readMessage(sock:socket.socket, mask_replies:bool):
+        """
+        Reads frames until a complete text/binary message has been received, answering
+        any pings along the way. Returns None when the peer closes the connection.
+        """
+        message = b''
+        while True:
+            fin, opcode, payload = PetoneerWebSocketFraming.readFrame(sock)
+
+            if (opcode == WEBSOCKET_OPCODE_PING):
+                PetoneerWebSocketFraming.writeFrame(sock, WEBSOCKET_OPCODE_PONG, payload, mask_replies)
+                continue
+            elif (opcode == WEBSOCKET_OPCODE_PONG):
+                continue
+            elif (opcode == WEBSOCKET_OPCODE_CLOSE):
+                try:
+                    PetoneerWebSocketFraming.writeFrame(sock, WEBSOCKET_OPCODE_CLOSE, payload[:2], mask_replies)
+                except OSError:
+                    pass
+                return None
+
+            message += payload
+            if (fin):
+                return message
+
+# -------------------------------------------------
+
+class PetoneerPushTransport:
+    """
+    Base class for push transports - a transport connects to an update channel,
+    subscribes to a set of fountains and returns each received update as a dict
+    (with at least the fountain serial number 'sn' and its changed fields in 'data')
+    """
+
+    def connect(self, access_token:str, device_codes:list):
+        raise NotImplementedError()
+
+    def receive(self):
+        """
+        Blocks until the next update arrives. Returns None if the channel has closed.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        raise NotImplementedError()
+
+# -------------------------------------------------
+
+class PetoneerWebSocketTransport(PetoneerPushTransport):
+    """
+    Push transport over a plain WebSocket connection (ws:// or wss://), using only
+    the Python standard library
+    """
+
+    def __init__(self, url:str = API_PUSH_URL, connect_timeout_secs:float = 10, idle_timeout_secs:float = 120):
+        self._url = url
+        self._connect_timeout_secs = connect_timeout_secs
+        self._idle_timeout_secs = idle_timeout_secs
+        self._sock = None
+
+    def connect(self, access_token:str, device_codes:list):
+        url = urllib.parse.urlparse(self._url)
+        secure = (url.scheme == 'wss')
+        port = url.port or (443 if secure else 80)
+        path = (url.path or '/') + (('?' + url.query) if url.query else '')
+
+        try:
+            sock = socket.create_connection((url.hostname, port), timeout=self._connect_timeout_secs)
+            if (secure):
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=url.hostname)
+
+            websocket_key = base64.b64encode(os.urandom(16)).decode('ascii')
+            request = (f"GET {path} HTTP/1.1\r\n"
+                f"Host: {url.hostname}:{port}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {websocket_key}\r\n"
+                "Sec-WebSocket-Version: 13\r\n"
+                f"accessToken: {access_token}\r\n\r\n")
+            sock.sendall(request.encode('ascii'))
+
+            status_line, headers = PetoneerWebSocketFraming.readHttpHeaders(sock)
+        except OSError as e:
+            raise PetoneerApiServerOffline(self._url, 501, f'Unable to connect to Petoneer push server - {e}')
+
+        if ((' 101 ' not in status_line + ' ') or
+            (headers.get('sec-websocket-accept') != PetoneerWebSocketFraming.getAcceptKey(websocket_key))):
+            sock.close()
+            raise PetoneerInvalidServerResponse(status_line, self._url, '', 'WebSocket handshake rejected by Petoneer push server')
+
+        sock.settimeout(self._idle_timeout_secs)
+        self._sock = sock
+
+        subscribe_payload = {
+            "protocol": "3",
+            "accessToken": access_token,
+            "dev": list(device_codes)
+        }
+        PetoneerWebSocketFraming.writeFrame(sock, WEBSOCKET_OPCODE_TEXT,
+            json.dumps(subscribe_payload).encode('utf-8'), True)
+
+    def receive(self):
+        if (self._sock == None):
+            return None
+
+        while True:
+            try:
+                message = PetoneerWebSocketFraming.readMessage(self._sock, True)
+            except (OSError, ConnectionError):
+                # Includes the idle timeout - a silent channel is treated as dropped
+                return None
+
+            if (message == None):
+                return None
+
+            try:
+                return json.loads(message.decode('utf-8'))
+            except ValueError as e:
+                # Malformed message (not UTF-8 / JSON) - skip it, the channel is still usable
+                if (Debug):
+                    print(f"Skipping undecodable push message: {e}")
+
+    def close(self):
+        # May be called from the listener thread and the stopping thread at once
+        sock, self._sock = self._sock, None
+
+        if (sock != None):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+# -------------------------------------------------
+
+class PetoneerPushListener:
+    """
+    Holds a push transport connected in a background thread, applying each update
+    received to the matching PetoneerFountain (from the provided dict of fountains,
+    keyed by serial number). While connected the fountains only poll for a full
+    refresh every SECONDS_PUSH_MAX_STALENESS - if the channel drops they fall back
+    to normal polling, and the listener reconnects with an exponential back-off.
+    access_token may be a callable returning the current token, read on every connect.
+    """
+
+    def __init__(self, fountains:dict, access_token:str, transport:PetoneerPushTransport = None,
+        reconnect_delay_secs:float = 1, max_reconnect_delay_secs:float = 60):
+        self._fountains = fountains
+        # Either a token, or a callable returning the current token (read on every connect)
+        self._access_token = access_token
+        self._transport = transport if (transport != None) else PetoneerWebSocketTransport()
+        self._reconnect_delay_secs = reconnect_delay_secs
+        self._max_reconnect_delay_secs = max_reconnect_delay_secs
+        self._is_connected = False
+        self._updates_received = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if (self._thread == None) or (not self._thread.is_alive()):
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='PetoneerPushListener', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._transport.close()
+        if (self._thread != None):
+            self._thread.join()
+        self._setConnected(False)
+
+    @property
+    def is_connected(self):
+        return self._is_connected
+
+    @property
+    def updates_received(self):
+        return self._updates_received
+
+    def applyUpdate(self, message:dict):
+        if ((not isinstance(message, dict)) or ('sn' not in message)):
+            return False
+
+        fountain = self._fountains.get(message['sn'])
+        if (fountain == None):
+            return False
+
+        device_info = message.get('data', {k: v for k, v in message.items() if (k != 'sn')})
+        if (not isinstance(device_info, dict)):
+            return False
+
+        if (fountain.applyPushUpdate(device_info)):
+            self._updates_received += 1
+            return True
+
+        return False
+
+    def _getAccessToken(self):
+        if (callable(self._access_token)):
+            return self._access_token()
+        return self._access_token
+
+    def _setConnected(self, is_connected:bool):
+        self._is_connected = is_connected
+        for fountain in list(self._fountains.values()):
+            fountain.setPushActive(is_connected)
+
+    def _run(self):
+        try:
+            self._listen()
+        finally:
+            # However the thread ends, the fountains must go back to polling
+            self._setConnected(False)
+
+    def _listen(self):
+        delay = self._reconnect_delay_secs
+
+        while (not self._stop_event.is_set()):
+            try:
+                self._transport.connect(self._getAccessToken(), list(self._fountains.keys()))
+            except Exception as e:
+                if (Debug):
+                    print(f"Push channel unavailable ({e}) - polling until reconnected")
+                self._stop_event.wait(delay)
+                delay = min(delay * 2, self._max_reconnect_delay_secs)
+                continue
+
+            delay = self._reconnect_delay_secs
+            self._setConnected(True)
+
+            while (not self._stop_event.is_set()):
+                message = self._transport.receive()
+                if (message == None):
+                    break
+
+                try:
+                    self.applyUpdate(message)
+                except Exception as e:
+                    # A bad update only affects itself - keep listening
+                    if (Debug):
+                        print(f"Skipping push message that could not be applied ({e})")
+
+            # Channel has dropped (or we are stopping) - fall back to polling
+            self._setConnected(False)
+            self._transport.close()
+
+            if (not self._stop_event.is_set()):
+                if (Debug):
+                    print("Push channel dropped - polling until reconnected")
+                self._stop_event.wait(delay)
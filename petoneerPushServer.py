@@ -0,0 +1,136 @@
+"""
+Local stand-in for the Petoneer WebSocket push server, for tests and offline
+development. Accepts WebSocket connections on localhost, records the subscription
+message sent by each client, and lets the caller push device updates to every
+connected client (or drop all connections, to exercise the polling fallback).
+"""
+import json
+import socket
+import threading
+
+from petoneerPush import *
+
+class PetoneerPushTestServer:
+    """
+    Minimal threaded WebSocket server - use as a context manager, and point a
+    PetoneerWebSocketTransport at the 'url' property
+    """
+
+    def __init__(self, host:str = '127.0.0.1', port:int = 0):
+        self._listen_sock = socket.create_server((host, port))
+        self._listen_sock.settimeout(0.2)
+        self._host, self._port = self._listen_sock.getsockname()[:2]
+        self._clients = []
+        self._subscriptions = []
+        self._lock = threading.Lock()
+        self._client_connected = threading.Condition(self._lock)
+        self._thread = None
+        self._running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def url(self):
+        return f"ws://{self._host}:{self._port}/ws"
+
+    @property
+    def subscriptions(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    @property
+    def num_clients(self):
+        with self._lock:
+            return len(self._clients)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._acceptLoop, name='PetoneerPushTestServer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if (self._thread != None):
+            self._thread.join()
+        self._listen_sock.close()
+        self.drop_connections()
+
+    def wait_for_clients(self, num_clients:int = 1, timeout_secs:float = 5):
+        with self._client_connected:
+            return self._client_connected.wait_for(lambda: len(self._clients) >= num_clients, timeout_secs)
+
+    def send_update(self, device_code:str, device_info:dict):
+        message = json.dumps({"sn": device_code, "data": device_info}).encode('utf-8')
+
+        with self._lock:
+            clients = list(self._clients)
+
+        for client in clients:
+            try:
+                PetoneerWebSocketFraming.writeFrame(client, WEBSOCKET_OPCODE_TEXT, message, False)
+            except OSError:
+                self._removeClient(client)
+
+    def drop_connections(self):
+        with self._lock:
+            clients = list(self._clients)
+            self._clients = []
+
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            client.close()
+
+    def _removeClient(self, client):
+        with self._lock:
+            if (client in self._clients):
+                self._clients.remove(client)
+
+    def _acceptLoop(self):
+        while (self._running):
+            try:
+                client, address = self._listen_sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+
+            client.settimeout(None)
+
+            threading.Thread(target=self._serveClient, args=(client,), daemon=True).start()
+
+    def _serveClient(self, client):
+        try:
+            request_line, headers = PetoneerWebSocketFraming.readHttpHeaders(client)
+            accept_key = PetoneerWebSocketFraming.getAcceptKey(headers.get('sec-websocket-key', ''))
+            client.sendall(("HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept_key}\r\n\r\n").encode('ascii'))
+
+            # First message from the client is its subscription request
+            subscription = PetoneerWebSocketFraming.readMessage(client, False)
+            if (subscription == None):
+                client.close()
+                return
+
+            with self._client_connected:
+                self._subscriptions.append(json.loads(subscription.decode('utf-8')))
+                self._clients.append(client)
+                self._client_connected.notify_all()
+
+            # Keep reading (answering pings) until the client goes away
+            while (PetoneerWebSocketFraming.readMessage(client, False) != None):
+                pass
+        except (OSError, ConnectionError, ValueError):
+            pass
+
+        self._removeClient(client)
+        client.close()
@@ -0,0 +1,114 @@
+"""
+Writing pump schedules (the /pww/21102 timer endpoint) and LED dimming windows to
+Petoneer Fountains, and rolling them out across many fountains at once.
+
+Schedule times are minutes since midnight (0 - 1439), or datetime.time objects.
+A rollout can stagger the windows of each fountain over a number of minutes, so
+thousands of pumps don't all switch on (or off) in the same minute:
+
+    pet.bulk_set_pump_schedule(device_codes, time(22, 0), time(6, 0), stagger_minutes=30)
+
+Each fountain's schedule can be verified against what the device reports - the
+command's response, or the schedule read back from the API.
+"""
+from datetime import time
+
+from petoneerErrors import *
+from petoneerConst import *
+from petoneerHelpers import *
+
+SCHEDULE_MINUTES_PER_DAY        = 1440
+
+class PetoneerSchedule:
+    """
+    Class that provides static helper functions to build, stagger and verify pump
+    and LED dimming schedules
+    """
+
+    @staticmethod
+    def toMinutes(schedule_time, function_name:str, argument_name:str):
+        # Minutes since midnight, from a datetime.time or a number of minutes
+        if (isinstance(schedule_time, time)):
+            return PetoneerHelpers.timeObjectToScheduleString(schedule_time)
+
+        if (isinstance(schedule_time, bool)) or (not isinstance(schedule_time, int)) or \
+            (schedule_time < 0) or (schedule_time >= SCHEDULE_MINUTES_PER_DAY):
+            raise PetoneerInvalidArgument(function_name, argument_name, 'Schedule times must be a datetime.time, or minutes since midnight (0 - 1439)')
+
+        return schedule_time
+
+    @staticmethod
+    def getStaggeredWindows(device_codes:list, start_minute:int, end_minute:int, stagger_minutes:int = 0):
+        """
+        Returns a dict of serial number -> (start minute, end minute), spreading the
+        windows of the fountains evenly over stagger_minutes minutes (in the order
+        given). Each window keeps its length, and wraps around midnight if needed.
+        """
+        if (stagger_minutes < 0) or (stagger_minutes >= SCHEDULE_MINUTES_PER_DAY):
+            raise PetoneerInvalidArgument('PetoneerSchedule.getStaggeredWindows', 'stagger_minutes', 'Stagger must be between 0 and 1439 minutes')
+
+        device_codes = list(device_codes)
+        windows = {}
+
+        for (index, device_code) in enumerate(device_codes):
+            offset = (index * stagger_minutes) // max(len(device_codes), 1)
+            windows[device_code] = ((start_minute + offset) % SCHEDULE_MINUTES_PER_DAY,
+                                    (end_minute + offset) % SCHEDULE_MINUTES_PER_DAY)
+
+        return windows
+
+    @staticmethod
+    def verifyPumpSchedule(device_code:str, access_token:str, response_data, enabled:bool, start_minute:int, end_minute:int, deadline = None):
+        """
+        Checks the pump schedule the device reports - from the command's response if
+        it includes the schedule, otherwise by reading the schedule back from the API
+        """
+        if (isinstance(response_data, dict)) and ('en' in response_data) and ('time' in response_data):
+            reported = response_data
+        else:
+            reported = PetoneerSchedule._readDeviceData(API_DEVICE_SCHEDULE_DETAILS_PATH, device_code, access_token, deadline)
+
+        expected = ((1 if enabled else 0), [start_minute, end_minute])
+        actual = (reported.get('en'), list(reported.get('time', [])))
+
+        if (actual != expected):
+            raise PetoneerScheduleNotApplied(device_code, expected, actual, 'Pump schedule was not applied')
+
+        return True
+
+    @staticmethod
+    def verifyLedDimmingSchedule(device_code:str, access_token:str, response_data, start_minute:int, end_minute:int, deadline = None):
+        """
+        Checks the LED dimming window the device reports - from the command's response
+        if it includes the LED settings, otherwise by reading the device details back
+        """
+        if (isinstance(response_data, dict)) and ('led' in response_data) and ('section' in response_data):
+            reported = response_data
+        else:
+            reported = PetoneerSchedule._readDeviceData(API_DEVICE_DETAILS_PATH, device_code, access_token, deadline)
+
+        expected = (1, [start_minute, end_minute])
+        actual = (reported.get('led'), list(reported.get('section', [])))
+
+        if (actual != expected):
+            raise PetoneerScheduleNotApplied(device_code, expected, actual, 'LED dimming schedule was not applied')
+
+        return True
+
+    @staticmethod
+    def _readDeviceData(methodPath:str, device_code:str, access_token:str, deadline = None):
+        payload = {
+            "sn": device_code,
+            "protocol": "3"
+        }
+
+        resp = PetoneerHelpers.getAPIrequest(methodPath, payload, access_token, PetoneerDeadline.fromTimeout(deadline))
+
+        if (resp.status_code != 200):
+            raise PetoneerServerError(resp.status_code, resp.url, resp.text, 'Unable to read back Petoneer Fountain schedule - Server Error')
+
+        json_resp = resp.json()
+        if (json_resp.get('code') != 200) or (not isinstance(json_resp.get('data'), dict)):
+            raise PetoneerInvalidServerResponse(resp.status_code, resp.url, resp.text, 'Unable to read back Petoneer Fountain schedule - Unexpected Server Response')
+
+        return json_resp['data']
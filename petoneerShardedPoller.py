@@ -0,0 +1,248 @@
+"""
+Multi-process polling for very large fleets. Parsing and deriving fountain state is
+CPU bound, so a single process is limited by the GIL even when its requests run
+concurrently - the PetoneerShardedPoller splits the fleet's serial numbers across a
+pool of worker processes, each owning the PetoneerFountain instances (and transport)
+for its share of the fleet and refreshing them with a pool of threads. Results are
+gathered in the parent as PetoneerFountainSnapshot records.
+
+Devices are assigned to workers with consistent hashing, so when the device list
+changes only the added / removed devices (and a minimal share of the rest) move
+between workers.
+"""
+import bisect
+import hashlib
+import multiprocessing
+import os
+
+from petoneerErrors import *
+from petoneerConst import *
+
+SHARD_VIRTUAL_NODES             = 64
+
+def _shardWorkerMain(conn, access_token:str, transport, threads_per_worker:int):
+    """
+    Entry point of a shard worker process - handles ('assign', device_codes),
+    ('token', access_token), ('refresh', (force, device codes to skip)) and
+    ('stop', None) messages
+    """
+    from petoneerErrors import PetoneerFountainDeviceOffline
+    from petoneerFountain import PetoneerFountain
+    from petoneerHelpers import PetoneerHelpers
+    from petoneerBulk import PetoneerBulk
+    from petoneerPriority import PRIORITY_BACKGROUND
+
+    if (transport != None):
+        PetoneerHelpers.setTransport(transport)
+
+    fountains = {}
+    device_codes = []
+
+    def refresh(device_code, force):
+        fountain = fountains.get(device_code)
+        if (fountain == None):
+            # Creating the fountain fetches its details
+            fountain = fountains[device_code] = PetoneerFountain(device_code, access_token)
+        else:
+            fountain._access_token = access_token
+            fountain.update(force=force)
+        return fountain.snapshot()
+
+    while True:
+        command, argument = conn.recv()
+
+        if (command == 'assign'):
+            device_codes = list(argument)
+            assigned = set(device_codes)
+            for device_code in [code for code in fountains if (code not in assigned)]:
+                del fountains[device_code]
+            conn.send(len(device_codes))
+
+        elif (command == 'token'):
+            access_token = argument
+            conn.send(True)
+
+        elif (command == 'refresh'):
+            force, skipped = argument
+            result = PetoneerBulk.run('sharded_refresh', lambda device_code: refresh(device_code, force),
+                [device_code for device_code in device_codes if (device_code not in skipped)],
+                max_workers=threads_per_worker, retries=1, retry_delay_secs=0.5, priority=PRIORITY_BACKGROUND)
+            conn.send(([device.result for device in result if (device.is_success)],
+                {device.device_code: str(device.error) for device in result.failed},
+                [device.device_code for device in result if (isinstance(device.error, PetoneerFountainDeviceOffline))]))
+
+        elif (command == 'stop'):
+            conn.send(True)
+            conn.close()
+            return
+
+# -------------------------------------------------
+
+class PetoneerShardRing:
+    """
+    Consistent hash ring mapping device serial numbers to shard (worker) indexes
+    """
+
+    def __init__(self, num_shards:int, virtual_nodes:int = SHARD_VIRTUAL_NODES):
+        self._ring = []
+        for shard in range(num_shards):
+            for node in range(virtual_nodes):
+                self._ring.append((PetoneerShardRing.hashKey(f"shard-{shard}-{node}"), shard))
+        self._ring.sort()
+        self._hashes = [entry[0] for entry in self._ring]
+
+    @staticmethod
+    def hashKey(key:str):
+        # Stable across processes and interpreter runs (unlike the built-in hash())
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def getShard(self, device_code:str):
+        index = bisect.bisect(self._hashes, PetoneerShardRing.hashKey(device_code)) % len(self._ring)
+        return self._ring[index][1]
+
+# -------------------------------------------------
+
+class PetoneerShardedPoller:
+    """
+    Pool of worker processes, each refreshing its own share of the fleet
+
+        poller = PetoneerShardedPoller(pet._auth_token, num_workers=8)
+        poller.setDevices(device_codes)
+        snapshots, errors = poller.refresh()
+        poller.stop()
+
+    transport (optional) must be picklable, eg: PetoneerHttpTransport(api_url)
+    state_table (optional) is a PetoneerStateTableWriter that every refresh publishes to
+    offline_tracker (optional) is a PetoneerOfflineTracker - fountains it holds as offline
+    are only refreshed when their next probe is due
+    """
+
+    def __init__(self, access_token:str, num_workers:int = None, threads_per_worker:int = 8, transport = None, start_method:str = 'spawn',
+        state_table = None, offline_tracker = None):
+        self._num_workers = num_workers if (num_workers != None) else (os.cpu_count() or 1)
+        if (self._num_workers < 1):
+            raise PetoneerInvalidArgument('PetoneerShardedPoller', 'num_workers', 'At least one worker process is required')
+
+        self._ring = PetoneerShardRing(self._num_workers)
+        self._assignments = [[] for shard in range(self._num_workers)]
+        self._workers = []
+        self._state_table = state_table
+        self._offline_tracker = offline_tracker
+
+        context = multiprocessing.get_context(start_method)
+        for shard in range(self._num_workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_shardWorkerMain, name=f'PetoneerShard-{shard}',
+                args=(child_conn, access_token, transport, threads_per_worker), daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((process, parent_conn))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def num_workers(self):
+        return self._num_workers
+
+    @property
+    def assignments(self):
+        # List (one entry per worker) of the serial numbers assigned to that worker
+        return [list(device_codes) for device_codes in self._assignments]
+
+    def setDevices(self, device_codes:list):
+        """
+        (Re)balances the given device list across the workers. Only workers whose
+        share of the fleet has changed are updated. Returns the number of devices
+        that moved to a different worker (or were added / removed).
+        """
+        device_codes = list(device_codes)
+        assignments = [[] for shard in range(self._num_workers)]
+        for device_code in device_codes:
+            assignments[self._ring.getShard(device_code)].append(device_code)
+
+        moved = 0
+        changed_shards = []
+        for shard in range(self._num_workers):
+            previous = set(self._assignments[shard])
+            current = set(assignments[shard])
+            if (previous != current):
+                moved += len(previous.symmetric_difference(current))
+                changed_shards.append(shard)
+
+        for shard in changed_shards:
+            self._workers[shard][1].send(('assign', assignments[shard]))
+        for shard in changed_shards:
+            self._workers[shard][1].recv()
+
+        if (self._state_table != None):
+            # Readers should not see fountains that are no longer being polled
+            current_devices = set(device_codes)
+            for device_code in [code for shard in self._assignments for code in shard]:
+                if (device_code not in current_devices):
+                    self._state_table.remove(device_code)
+
+        self._assignments = assignments
+        return moved
+
+    def setAccessToken(self, access_token:str):
+        self._broadcast('token', access_token)
+
+    def refresh(self, force:bool = True):
+        """
+        Refreshes every assigned fountain (in parallel across the workers). Returns a
+        tuple of (dict of serial number -> PetoneerFountainSnapshot, dict of serial
+        number -> error message for fountains that could not be refreshed)
+        """
+        snapshots = {}
+        errors = {}
+        offline = []
+
+        # Offline fountains are skipped by the workers until their probe is due
+        skipped = frozenset()
+        if (self._offline_tracker != None):
+            assigned = [device_code for assignment in self._assignments for device_code in assignment]
+            due = set(self._offline_tracker.filterDue(assigned))
+            skipped = frozenset(device_code for device_code in assigned if (device_code not in due))
+
+        for (snapshot_list, error_dict, offline_list) in self._broadcast('refresh', (force, skipped)):
+            for snapshot in snapshot_list:
+                snapshots[snapshot.sn] = snapshot
+            errors.update(error_dict)
+            offline.extend(offline_list)
+
+        if (self._offline_tracker != None):
+            for device_code in offline:
+                self._offline_tracker.markOffline(device_code)
+            for device_code in snapshots:
+                self._offline_tracker.markOnline(device_code)
+
+        if (self._state_table != None):
+            self._state_table.publishAll(snapshots.values())
+
+        return snapshots, errors
+
+    def stop(self):
+        if (len(self._workers) == 0):
+            return
+
+        try:
+            self._broadcast('stop', None)
+        except (OSError, EOFError):
+            pass
+
+        for process, conn in self._workers:
+            process.join(timeout=5)
+            if (process.is_alive()):
+                process.terminate()
+            conn.close()
+
+        self._workers = []
+
+    def _broadcast(self, command:str, argument):
+        for process, conn in self._workers:
+            conn.send((command, argument))
+        return [conn.recv() for process, conn in self._workers]
@@ -0,0 +1,333 @@
+"""
+Local stand-in for the Revogi cloud API (as.revogi.net), for load tests and capacity
+planning without touching the real service. Simulates any number of fountains whose
+water level, TDS and maintenance timestamps change over (optionally accelerated) time,
+with configurable response latency, error rate and request throttling.
+
+Implements /user/101 (login), /user/500 (device list), /pww/31101 (device details),
+/pww/31102 (schedule details) and the /pww/211xx device commands.
+
+    with PetoneerCloudSimulator(num_fountains=10000) as simulator:
+        PetoneerHelpers.setTransport(PetoneerHttpTransport(simulator.api_url))
+        ...
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import random
+import threading
+from time import monotonic, sleep, time as unix_time
+
+from petoneerConst import *
+
+SIMULATOR_SERIAL_PREFIX         = "PWWSIM"
+
+class PetoneerSimulatedLatency:
+    """
+    Latency distributions for simulated responses (each returns a callable
+    producing a latency in seconds)
+    """
+
+    @staticmethod
+    def none():
+        return lambda: 0.0
+
+    @staticmethod
+    def fixed(latency_secs:float):
+        return lambda: latency_secs
+
+    @staticmethod
+    def uniform(min_secs:float, max_secs:float, seed:int = None):
+        rng = random.Random(seed)
+        return lambda: rng.uniform(min_secs, max_secs)
+
+    @staticmethod
+    def lognormal(median_secs:float, sigma:float = 0.5, max_secs:float = 10.0, seed:int = None):
+        # Long-tailed, like real network latency
+        rng = random.Random(seed)
+        return lambda: min(max_secs, rng.lognormvariate(0, sigma) * median_secs)
+
+# -------------------------------------------------
+
+class PetoneerSimulatedFountain:
+    """
+    State of one simulated fountain. Water level and TDS are derived from the time
+    since the water was last changed, so they change continuously without any
+    background work.
+    """
+
+    def __init__(self, device_code:str, index:int, now:float, rng:random.Random):
+        self.sn = device_code
+        self.mac = "B0:F8:%02X:%02X:%02X:%02X" % ((index >> 24) & 0xFF, (index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF)
+        self.name = f"Simulated Fountain {index}"
+        self.online = 1
+        self.offline_since = None
+        self.switch = 1
+        self.led = 1
+        self.ledmode = 1
+        self.section = [0, 0]
+        self.schedule_enabled = 0
+        self.schedule = [0, 0]
+        # Spread the maintenance counters so the fleet is at every stage of its cycles
+        self.watertime = now - rng.uniform(0, SECONDS_FOUNTAIN_WATER_CHANGE)
+        self.filtertime = now - rng.uniform(0, SECONDS_FOUNTAIN_FILTER_CHANGE)
+        self.motortime = now - rng.uniform(0, SECONDS_FOUNTAIN_CLEAN_PUMP)
+        self.tds_base = rng.uniform(10, 40)
+        self.tds_drift_per_day = rng.uniform(2, 25)
+        self._rng = rng
+
+    def getDeviceInfo(self, now:float):
+        if (not self.online):
+            # The cloud only has the last details reported before the fountain went offline
+            device_info = self._getDeviceInfo(self.offline_since)
+            device_info["line"] = 0
+            return device_info
+        return self._getDeviceInfo(now)
+
+    def _getDeviceInfo(self, now:float):
+        days_since_water_change = max(0.0, now - self.watertime) / 86400
+        level = max(0, 4 - int(days_since_water_change * 4 / (SECONDS_FOUNTAIN_WATER_CHANGE / 86400)))
+        tds = int(self.tds_base + (self.tds_drift_per_day * days_since_water_change) + self._rng.uniform(-2, 2))
+
+        return {
+            "filtertime": int(self.filtertime),
+            "led": self.led,
+            "ledmode": self.ledmode,
+            "level": level,
+            "motortime": int(self.motortime),
+            "section": list(self.section),
+            "switch": self.switch,
+            "tds": max(1, tds),
+            "tdslevel": 0,
+            "time": int(now),
+            "watertime": int(self.watertime)
+        }
+
+    def getScheduleInfo(self):
+        return {
+            "en": self.schedule_enabled,
+            "time": list(self.schedule)
+        }
+
+    def getDeviceListEntry(self):
+        return {
+            "dataAdd": "",
+            "gateway_ip": "",
+            "ip": "127.0.0.1",
+            "line": self.online,
+            "mac": self.mac,
+            "name": self.name,
+            "pname": [],
+            "protect": [],
+            "register": 1,
+            "sak": "000000000000",
+            "sn": self.sn,
+            "socket_type": "WebSocket",
+            "userId": 1,
+            "ver": "2.60",
+            "wifiRouter": "SIMULATOR"
+        }
+
+# -------------------------------------------------
+
+class PetoneerCloudSimulator:
+    """
+    Threaded HTTP server simulating the Revogi cloud API for a fleet of fountains.
+
+    latency             -- callable returning the latency (secs) of each response
+                           (see PetoneerSimulatedLatency)
+    error_rate          -- proportion of requests answered with an HTTP 500
+    max_requests_per_sec -- requests above this rate are answered with an HTTP 429
+    time_scale          -- how much faster than real time the fountains age
+                           (eg: 86400 makes each real second a simulated day)
+    seed                -- makes the simulated fleet and errors repeatable (uses the
+                           simulator's own random state, not the global one)
+    """
+
+    def __init__(self, num_fountains:int = 1000, latency = None, error_rate:float = 0.0,
+        max_requests_per_sec:float = None, time_scale:float = 1.0, host:str = "127.0.0.1", port:int = 0, seed:int = None):
+        # Private random state - seeding it doesn't affect the caller's (global) random module
+        self._rng = random.Random(seed)
+
+        self._latency = latency if (latency != None) else PetoneerSimulatedLatency.none()
+        self._error_rate = error_rate
+        self._max_requests_per_sec = max_requests_per_sec
+        self._time_scale = time_scale
+        self._started = unix_time()
+        self._started_monotonic = monotonic()
+        self._lock = threading.Lock()
+        self._access_token = "simulated-%016x" % self._rng.getrandbits(64)
+
+        # Token bucket for throttling
+        self._throttle_tokens = max_requests_per_sec
+        self._throttle_updated = monotonic()
+
+        self._fountains = {}
+        for index in range(num_fountains):
+            device_code = f"{SIMULATOR_SERIAL_PREFIX}{index:010d}"
+            self._fountains[device_code] = PetoneerSimulatedFountain(device_code, index, self._started, self._rng)
+
+        self._stats = {"requests": 0, "errors": 0, "throttled": 0, "offline_requests": 0}
+
+        simulator = self
+        class RequestHandler(PetoneerSimulatorRequestHandler):
+            pass
+        RequestHandler.simulator = simulator
+
+        self._server = PetoneerSimulatorServer((host, port), RequestHandler)
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    @property
+    def api_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/app"
+
+    @property
+    def device_codes(self):
+        return list(self._fountains.keys())
+
+    @property
+    def fountains(self):
+        return self._fountains
+
+    @property
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='PetoneerCloudSimulator', daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if (self._thread != None):
+            self._thread.join()
+
+    def setOnline(self, device_code:str, online:bool):
+        # Simulates a fountain being unplugged (or plugged back in)
+        with self._lock:
+            fountain = self._fountains[device_code]
+            if (fountain.online) and (not online):
+                fountain.offline_since = self.now()
+            fountain.online = (1 if online else 0)
+
+    def now(self):
+        # Simulated (possibly accelerated) unix time
+        return self._started + ((monotonic() - self._started_monotonic) * self._time_scale)
+
+    def handleRequest(self, path:str, payload:dict, access_token:str):
+        """
+        Returns (http status, response body dict) for an API request
+        """
+        with self._lock:
+            self._stats["requests"] += 1
+
+            if (self._max_requests_per_sec != None):
+                now = monotonic()
+                self._throttle_tokens = min(self._max_requests_per_sec,
+                    self._throttle_tokens + ((now - self._throttle_updated) * self._max_requests_per_sec))
+                self._throttle_updated = now
+
+                if (self._throttle_tokens < 1):
+                    self._stats["throttled"] += 1
+                    return 429, {"code": 429, "msg": "Too many requests"}
+                self._throttle_tokens -= 1
+
+            if (self._rng.random() < self._error_rate):
+                self._stats["errors"] += 1
+                return 500, {"code": 500, "msg": "Simulated server error"}
+
+        sleep(self._latency())
+
+        if (path == API_LOGIN_PATH):
+            return 200, {"code": 200, "data": {"accessToken": self._access_token, "expiresIn": 86400}}
+
+        if (access_token != self._access_token):
+            return 200, {"code": 401, "msg": "Invalid access token"}
+
+        if (path == API_DEVICE_LIST_PATH):
+            return 200, {"code": 200, "data": {"dev": [fountain.getDeviceListEntry() for fountain in self._fountains.values()]}}
+
+        fountain = self._fountains.get(payload.get("sn"))
+        if (fountain == None):
+            return 200, {"code": 404, "msg": "Unknown device"}
+
+        with self._lock:
+            now = self.now()
+
+            if (not fountain.online):
+                self._stats["offline_requests"] += 1
+
+            if (path == API_DEVICE_DETAILS_PATH):
+                return 200, {"code": 200, "data": fountain.getDeviceInfo(now)}
+            elif (path == API_DEVICE_SCHEDULE_DETAILS_PATH):
+                return 200, {"code": 200, "data": fountain.getScheduleInfo()}
+            elif (path == API_DEVICE_SWITCH_PATH):
+                fountain.switch = int(payload.get("switch", fountain.switch))
+            elif (path == API_DEVICE_TIMER_PATH):
+                fountain.schedule_enabled = int(payload.get("en", fountain.schedule_enabled))
+                fountain.schedule = list(payload.get("time", fountain.schedule))
+            elif (path == API_DEVICE_LED_PATH):
+                fountain.led = int(payload.get("led", fountain.led))
+                fountain.ledmode = int(payload.get("ledmode", fountain.ledmode))
+                fountain.section = list(payload.get("section", fountain.section))
+            elif (path == API_RESET_WATER_CHANGE_TIMER):
+                fountain.watertime = now
+            elif (path == API_RESET_FILTER_CHANGE_TIMER):
+                fountain.filtertime = now
+            elif (path == API_RESET_CLEAN_PUMP_TIMER):
+                fountain.motortime = now
+            else:
+                return 404, {"code": 404, "msg": "Unknown API method"}
+
+            return 200, {"code": 200, "data": fountain.getDeviceInfo(now)}
+
+# -------------------------------------------------
+
+class PetoneerSimulatorServer(ThreadingHTTPServer):
+    # Large listen backlog, so bursts of concurrent connections are not held back
+    # by SYN retries (which would show up as ~1s latency outliers)
+    request_queue_size = 1024
+    daemon_threads = True
+
+# -------------------------------------------------
+
+class PetoneerSimulatorRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP request handler for PetoneerCloudSimulator (the 'simulator' class attribute
+    is set on a per-server subclass)
+    """
+    simulator = None
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            payload = {}
+
+        path = self.path[len("/app"):] if (self.path.startswith("/app")) else self.path
+        status, body = self.simulator.handleRequest(path, payload, self.headers.get("accessToken"))
+
+        response = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet
+        pass
@@ -0,0 +1,202 @@
+"""
+Flat, immutable snapshots of the state of a Petoneer fountain (raw device values plus
+everything derived from them by the PetoneerFountainDetails classes), with fast JSON
+and compact binary serialization, and a streaming NDJSON exporter for whole fleets.
+"""
+from collections import namedtuple
+import io
+import json
+import struct
+
+from petoneerErrors import *
+from petoneerFountainDetails import *
+from petoneerHelpers import *
+
+SNAPSHOT_FIELDS = (
+    # Raw device values
+    "sn",
+    "last_updated",
+    "device_time",
+    "switch",
+    "led",
+    "ledmode",
+    "tds",
+    "level",
+    "watertime",
+    "filtertime",
+    "motortime",
+    # Derived state
+    "is_pump_on",
+    "is_pump_switched_on",
+    "is_pump_scheduled",
+    "pump_schedule_start",
+    "pump_schedule_end",
+    "is_pump_cleaning_required",
+    "pump_cleaning_days_remaining",
+    "pump_cleaning_percent_remaining",
+    "is_led_on",
+    "is_led_dimmed",
+    "is_led_dimming_scheduled",
+    "led_dimming_start",
+    "led_dimming_end",
+    "is_water_change_required",
+    "water_change_days_remaining",
+    "water_change_percent_remaining",
+    "is_filter_change_required",
+    "filter_change_days_remaining",
+    "filter_change_percent_remaining",
+    "water_level_label",
+    "water_level_percent",
+    "water_quality_label"
+)
+
+# Binary layout - every field except the three labels (which are re-derived from
+# 'level' and 'tds' when decoding). Schedule times are stored as minutes after midnight.
+SNAPSHOT_BINARY_FORMAT          = struct.Struct("!B32sdqbbbhbqqq???HH?ii???HH?ii?ii")
+SNAPSHOT_BINARY_VERSION         = 1
+SNAPSHOT_BINARY_NUM_FIELDS      = len(SNAPSHOT_FIELDS) - 3
+
+# Number of NDJSON lines buffered before each write to the export target
+EXPORT_BATCH_LINES              = 256
+
+class PetoneerFountainSnapshot(namedtuple("PetoneerFountainSnapshot", SNAPSHOT_FIELDS)):
+    """
+    Immutable record of a PetoneerFountain's state at a point in time (see
+    PetoneerFountain.snapshot()). Timestamps are unix timestamps, and schedule
+    times are minutes after midnight (as used by the Petoneer API).
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def fromFountain(fountain):
+        # Read the fountain's state once, so every value comes from the same payload
+        state = fountain.state
+        device_info = state.device_info_json
+        if (device_info == None):
+            raise PetoneerInvalidArgument('snapshot', 'fountain', 'No device details have been retrieved for this fountain yet')
+
+        pump = state.pump
+        led = state.led_display
+        water = state.water
+        filter_details = state.filter
+        last_updated = state.last_updated
+
+        return PetoneerFountainSnapshot(
+            fountain.device_id,
+            (last_updated.timestamp() if (last_updated != None) else 0.0),
+            device_info.get('time', 0),
+            device_info.get('switch', 0),
+            device_info.get('led', 0),
+            device_info.get('ledmode', 0),
+            device_info.get('tds', 0),
+            device_info.get('level', 0),
+            device_info.get('watertime', 0),
+            device_info.get('filtertime', 0),
+            device_info.get('motortime', 0),
+            pump.is_pump_on,
+            pump.is_pump_switched_on,
+            pump.is_pump_scheduled,
+            PetoneerHelpers.timeObjectToScheduleString(pump.pump_schedule.start_time),
+            PetoneerHelpers.timeObjectToScheduleString(pump.pump_schedule.end_time),
+            pump.is_pump_cleaning_required,
+            pump.pump_cleaning_remaining.days_remaining,
+            pump.pump_cleaning_remaining.percent_remaining,
+            led.is_led_on,
+            led.is_led_dimmed,
+            led.is_led_dimming_scheduled,
+            PetoneerHelpers.timeObjectToScheduleString(led.led_dimming_schedule.start_time),
+            PetoneerHelpers.timeObjectToScheduleString(led.led_dimming_schedule.end_time),
+            water.is_water_change_required,
+            water.water_change_remaining.days_remaining,
+            water.water_change_remaining.percent_remaining,
+            filter_details.is_filter_change_required,
+            filter_details.filter_change_remaining.days_remaining,
+            filter_details.filter_change_remaining.percent_remaining,
+            water.water_level.label,
+            water.water_level.percent,
+            water.water_quality.quality_label
+        )
+
+    def to_dict(self):
+        return dict(zip(SNAPSHOT_FIELDS, self))
+
+    def to_json(self):
+        return json.dumps(dict(zip(SNAPSHOT_FIELDS, self)), separators=(',', ':'))
+
+    def to_bytes(self):
+        values = list(self[:SNAPSHOT_BINARY_NUM_FIELDS])
+        values[0] = self.sn.encode('utf-8')
+        return SNAPSHOT_BINARY_FORMAT.pack(SNAPSHOT_BINARY_VERSION, *values)
+
+    @staticmethod
+    def from_bytes(data:bytes):
+        values = SNAPSHOT_BINARY_FORMAT.unpack(data[:SNAPSHOT_BINARY_FORMAT.size])
+        if (values[0] != SNAPSHOT_BINARY_VERSION):
+            raise PetoneerInvalidArgument('PetoneerFountainSnapshot.from_bytes', 'data', f'Unsupported snapshot format version {values[0]}')
+
+        values = list(values[1:])
+        values[0] = values[0].rstrip(b'\0').decode('utf-8')
+        level = values[SNAPSHOT_FIELDS.index("level")]
+        tds = values[SNAPSHOT_FIELDS.index("tds")]
+
+        return PetoneerFountainSnapshot(*values,
+            PetoneerFountainDetails_WaterLevel._getWaterLevelLabel(level),
+            PetoneerFountainDetails_WaterLevel._getWaterLevelPercentage(level),
+            PetoneerFountainDetails_WaterQuality._getWaterQualityLabel(tds))
+
+# -------------------------------------------------
+
+class PetoneerSnapshotExporter:
+    """
+    Class that provides static helper functions to stream the snapshots of many
+    fountains to a file or socket, one at a time (never building the whole export
+    in memory)
+    """
+
+    @staticmethod
+    def export_ndjson(fountains, target):
+        """
+        Writes one JSON line per fountain to target - a file path, a text or binary
+        file object, or a connected socket. Returns the number of fountains exported.
+        """
+        if (isinstance(target, str)):
+            with open(target, 'w', encoding='utf-8') as export_file:
+                return PetoneerSnapshotExporter.export_ndjson(fountains, export_file)
+
+        if (hasattr(target, 'sendall')):
+            write = lambda text: target.sendall(text.encode('utf-8'))
+        elif (isinstance(target, io.TextIOBase)):
+            write = target.write
+        else:
+            write = lambda text: target.write(text.encode('utf-8'))
+
+        batch = []
+        exported = 0
+
+        for fountain in fountains:
+            batch.append(fountain.snapshot().to_json())
+            exported += 1
+
+            if (len(batch) >= EXPORT_BATCH_LINES):
+                write('\n'.join(batch) + '\n')
+                batch = []
+
+        if (len(batch) > 0):
+            write('\n'.join(batch) + '\n')
+
+        return exported
+
+    @staticmethod
+    def export_binary(fountains, target):
+        """
+        Writes the binary snapshot of each fountain (fixed size records, see
+        SNAPSHOT_BINARY_FORMAT) to a binary file object or connected socket
+        """
+        write = target.sendall if (hasattr(target, 'sendall')) else target.write
+        exported = 0
+
+        for fountain in fountains:
+            write(fountain.snapshot().to_bytes())
+            exported += 1
+
+        return exported
@@ -0,0 +1,260 @@
+"""
+Shared-memory table holding the latest state of every fountain, so that dashboards,
+exporters and other local processes can read fountain status without running their
+own Petoneer client (and without any API calls).
+
+The poller owns a PetoneerStateTableWriter and publishes fountain snapshots into it;
+any number of local processes open the same table by name with a
+PetoneerStateTableReader. The table has a fixed layout (a header followed by
+fixed-size records), and each record carries its own sequence counter (a seqlock) -
+the writer makes it odd while updating the record, so readers can detect (and retry)
+a read that overlapped a write, without ever taking a lock. Readers decode records
+straight from the shared buffer, with no intermediate copies.
+"""
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+import struct
+import threading
+from time import time as unix_time
+
+from petoneerErrors import *
+
+STATE_TABLE_MAGIC               = b"PTST"
+STATE_TABLE_VERSION             = 1
+
+# magic, version, record size, capacity, generation (bumped when slots are added / removed)
+STATE_TABLE_HEADER              = struct.Struct("<4sHHIQ")
+
+# seq, serial, tds, level, switch, led, water/filter/pump-clean percent remaining,
+# last updated (unix time), device time (unix time)
+STATE_TABLE_RECORD              = struct.Struct("<Q32shbbbxiiidq")
+STATE_TABLE_SEQ                 = struct.Struct("<Q")
+STATE_TABLE_MAX_SERIAL_BYTES    = 32
+
+STATE_TABLE_READ_RETRIES        = 1000
+
+# Names of the tables created by writers in this process
+_writer_table_names = set()
+
+PetoneerStateRecord = namedtuple("PetoneerStateRecord", (
+    "sn",
+    "tds",
+    "level",
+    "switch",
+    "led",
+    "water_change_percent_remaining",
+    "filter_change_percent_remaining",
+    "pump_cleaning_percent_remaining",
+    "last_updated",
+    "device_time",
+    "seq"
+))
+
+class PetoneerStateTableWriter:
+    """
+    Creates (and owns) a shared-memory state table with room for 'capacity' fountains.
+    Only one writer should exist per table.
+    """
+
+    def __init__(self, name:str, capacity:int):
+        if (capacity < 1):
+            raise PetoneerInvalidArgument('PetoneerStateTableWriter', 'capacity', 'Table must have room for at least one fountain')
+
+        size = STATE_TABLE_HEADER.size + (capacity * STATE_TABLE_RECORD.size)
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._buffer = self._shm.buf
+        self._capacity = capacity
+        self._generation = 0
+        self._slots = {}
+        self._free_slots = list(range(capacity - 1, -1, -1))
+        self._lock = threading.Lock()
+
+        self._buffer[:size] = bytes(size)
+        self._writeHeader()
+        _writer_table_names.add(self._shm.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(unlink=True)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def __len__(self):
+        return len(self._slots)
+
+    def publish(self, snapshot):
+        """
+        Writes a PetoneerFountainSnapshot into the fountain's record (allocating a
+        record the first time the fountain is published)
+        """
+        if (len(snapshot.sn.encode('utf-8')) > STATE_TABLE_MAX_SERIAL_BYTES):
+            # Would otherwise be silently truncated (and could collide with another serial)
+            raise PetoneerInvalidArgument('PetoneerStateTableWriter.publish', 'snapshot', f'Serial number "{snapshot.sn}" is longer than {STATE_TABLE_MAX_SERIAL_BYTES} bytes')
+
+        with self._lock:
+            slot = self._slots.get(snapshot.sn)
+            if (slot == None):
+                if (len(self._free_slots) == 0):
+                    raise PetoneerInvalidArgument('PetoneerStateTableWriter.publish', 'snapshot', f'State table is full ({self._capacity} fountains)')
+                slot = self._free_slots.pop()
+                self._slots[snapshot.sn] = slot
+                is_new = True
+            else:
+                is_new = False
+
+            self._writeRecord(slot, snapshot.sn, snapshot.tds, snapshot.level, snapshot.switch, snapshot.led,
+                snapshot.water_change_percent_remaining, snapshot.filter_change_percent_remaining,
+                snapshot.pump_cleaning_percent_remaining,
+                (snapshot.last_updated if (snapshot.last_updated > 0) else unix_time()), snapshot.device_time)
+
+            if (is_new):
+                # Only bump the generation once the record is in place, so an index
+                # built for a generation holds every fountain added up to it
+                self._generation += 1
+                self._writeHeader()
+
+    def publishAll(self, snapshots):
+        count = 0
+        for snapshot in snapshots:
+            self.publish(snapshot)
+            count += 1
+        return count
+
+    def publishFountains(self, fountains):
+        return self.publishAll(fountain.snapshot() for fountain in fountains)
+
+    def remove(self, device_code:str):
+        with self._lock:
+            slot = self._slots.pop(device_code, None)
+            if (slot == None):
+                return False
+
+            self._writeRecord(slot, "", 0, 0, 0, 0, 0, 0, 0, 0.0, 0)
+            self._free_slots.append(slot)
+            self._generation += 1
+            self._writeHeader()
+            return True
+
+    def close(self, unlink:bool = True):
+        self._buffer = None
+        self._shm.close()
+        if (unlink):
+            self._shm.unlink()
+        _writer_table_names.discard(self._shm.name)
+
+    def _writeHeader(self):
+        STATE_TABLE_HEADER.pack_into(self._buffer, 0, STATE_TABLE_MAGIC, STATE_TABLE_VERSION,
+            STATE_TABLE_RECORD.size, self._capacity, self._generation)
+
+    def _writeRecord(self, slot:int, device_code:str, *values):
+        offset = STATE_TABLE_HEADER.size + (slot * STATE_TABLE_RECORD.size)
+        seq = STATE_TABLE_SEQ.unpack_from(self._buffer, offset)[0]
+
+        # Odd sequence number marks the record as being written
+        STATE_TABLE_SEQ.pack_into(self._buffer, offset, seq + 1)
+        STATE_TABLE_RECORD.pack_into(self._buffer, offset, seq + 1, device_code.encode('utf-8'), *values)
+        STATE_TABLE_SEQ.pack_into(self._buffer, offset, seq + 2)
+
+# -------------------------------------------------
+
+class PetoneerStateTableReader:
+    """
+    Opens an existing state table (by name) for reading, from any local process
+    """
+
+    def __init__(self, name:str):
+        self._shm = shared_memory.SharedMemory(name=name, create=False)
+
+        # The table belongs to the writer - stop this process's resource tracker from
+        # unlinking it when the reader exits (unless the writer is in this process too)
+        if (self._shm.name not in _writer_table_names):
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        self._buffer = self._shm.buf
+        magic, version, record_size, capacity, generation = STATE_TABLE_HEADER.unpack_from(self._buffer, 0)
+
+        if (magic != STATE_TABLE_MAGIC) or (version != STATE_TABLE_VERSION) or (record_size != STATE_TABLE_RECORD.size):
+            self.close()
+            raise PetoneerInvalidArgument('PetoneerStateTableReader', 'name', f'"{name}" is not a compatible Petoneer state table')
+
+        self._capacity = capacity
+        self._index = {}
+        self._index_generation = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def generation(self):
+        return STATE_TABLE_HEADER.unpack_from(self._buffer, 0)[4]
+
+    def get(self, device_code:str):
+        """
+        Returns the latest PetoneerStateRecord for a fountain (or None if the fountain
+        is not in the table). The table is only rescanned when its generation changes
+        (fountains added or removed), so repeated lookups of unknown fountains are cheap.
+        """
+        self._refreshIndex()
+        slot = self._index.get(device_code)
+        if (slot == None):
+            return None
+
+        record = self._readRecord(slot)
+        if (record != None) and (record.sn != device_code):
+            # The slot was reused while the index was being built - rescan once
+            self._refreshIndex(force=True)
+            slot = self._index.get(device_code)
+            record = (self._readRecord(slot) if (slot != None) else None)
+
+        return (record if (record != None) and (record.sn == device_code) else None)
+
+    def __iter__(self):
+        for slot in range(self._capacity):
+            record = self._readRecord(slot)
+            if (record != None) and (record.sn != ""):
+                yield record
+
+    def close(self):
+        self._buffer = None
+        self._shm.close()
+
+    def _refreshIndex(self, force:bool = False):
+        generation = self.generation
+        if (not force) and (generation == self._index_generation):
+            return
+
+        index = {}
+        for slot in range(self._capacity):
+            record = self._readRecord(slot)
+            if (record != None) and (record.sn != ""):
+                index[record.sn] = slot
+
+        self._index = index
+        self._index_generation = generation
+
+    def _readRecord(self, slot:int):
+        offset = STATE_TABLE_HEADER.size + (slot * STATE_TABLE_RECORD.size)
+        buffer = self._buffer
+
+        for attempt in range(STATE_TABLE_READ_RETRIES):
+            values = STATE_TABLE_RECORD.unpack_from(buffer, offset)
+            if ((values[0] & 1) == 0) and (STATE_TABLE_SEQ.unpack_from(buffer, offset)[0] == values[0]):
+                return PetoneerStateRecord(values[1].rstrip(b'\0').decode('utf-8'), *values[2:], values[0])
+
+        # Record kept changing under us
+        return None
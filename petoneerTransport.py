@@ -0,0 +1,228 @@
+"""
+Transports used by PetoneerHelpers.getAPIrequest to send requests to the Petoneer
+API. By default requests go straight to the Revogi cloud over HTTPS, but the
+transport can be swapped (see PetoneerHelpers.setTransport) to record all traffic
+to a file, or to replay a previous recording - so refreshes and commands can be
+benchmarked and regression-tested offline against real traffic shapes.
+
+Recordings are NDJSON (one JSON object per request), gzip compressed if the file
+name ends with '.gz'.
+"""
+import gzip
+import json
+import threading
+from time import monotonic, sleep, time as unix_time
+
+import requests
+
+from petoneerErrors import *
+from petoneerConst import *
+
+REPLAY_LATENCY_ORIGINAL         = "original"
+REPLAY_LATENCY_SCALED           = "scaled"
+REPLAY_LATENCY_NONE             = "none"
+
+# Payload fields that are never written to a recording
+RECORDING_REDACTED_FIELDS       = ("password", "accessToken")
+
+# Written in place of access tokens (in login responses, and anywhere else they
+# appear) - replay serves it back as the token, which replay itself never checks
+RECORDING_ACCESS_TOKEN          = "recorded-access-token"
+
+class PetoneerHttpTransport:
+    """
+    Default transport - sends each request to the Petoneer API server over HTTP(S)
+    """
+
+    def __init__(self, api_url:str = API_URL):
+        self._api_url = api_url
+
+    @property
+    def api_url(self):
+        return self._api_url
+
+    def request(self, methodPath:str, payload:dict, headers:dict, timeout_secs:float = None):
+        try:
+            return requests.post(self._api_url + methodPath, json=payload, headers=headers, timeout=timeout_secs)
+        except requests.exceptions.Timeout:
+            raise PetoneerRequestTimeout(self._api_url + methodPath, timeout_secs)
+
+# -------------------------------------------------
+
+class PetoneerRecordedResponse:
+    """
+    Response served from a recording - provides the same attributes as the
+    requests.Response objects used throughout this module
+    """
+
+    def __init__(self, status_code:int, url:str, text:str):
+        self.status_code = status_code
+        self.url = url
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+# -------------------------------------------------
+
+class PetoneerRecordingTransport:
+    """
+    Passes each request through to another transport (HTTP by default), and appends
+    the request and response (path, payload, status, body, latency) to a recording file.
+    Passwords and access tokens are redacted, so recordings can be kept and shared.
+    """
+
+    def __init__(self, file_path:str, transport = None):
+        self._transport = transport if (transport != None) else PetoneerHttpTransport()
+        self._lock = threading.Lock()
+        if (file_path.endswith('.gz')):
+            self._file = gzip.open(file_path, 'at', encoding='utf-8')
+        else:
+            self._file = open(file_path, 'a', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def request(self, methodPath:str, payload:dict, headers:dict, timeout_secs:float = None):
+        started = monotonic()
+        record = {
+            "ts": unix_time(),
+            "path": methodPath,
+            "payload": PetoneerRecordingTransport.redactPayload(payload)
+        }
+
+        try:
+            resp = self._transport.request(methodPath, payload, headers, timeout_secs)
+        except Exception as e:
+            record["latency"] = monotonic() - started
+            record["error"] = PetoneerRecordingTransport.redactText(str(e), headers)
+            self._write(record)
+            raise
+
+        record["latency"] = monotonic() - started
+        record["status"] = resp.status_code
+        record["url"] = PetoneerRecordingTransport.redactText(resp.url, headers)
+        record["body"] = PetoneerRecordingTransport.redactBody(methodPath, resp.text, headers)
+        self._write(record)
+
+        return resp
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def _write(self, record:dict):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    @staticmethod
+    def redactPayload(payload:dict):
+        if (not isinstance(payload, dict)):
+            return payload
+        return {k: ('***' if (k in RECORDING_REDACTED_FIELDS) else v) for k, v in payload.items()}
+
+    @staticmethod
+    def redactText(text:str, headers:dict):
+        # Removes the access token sent with the request from any recorded text
+        access_token = (headers or {}).get('accessToken')
+        if (not isinstance(text, str)) or (not access_token):
+            return text
+        return text.replace(access_token, RECORDING_ACCESS_TOKEN)
+
+    @staticmethod
+    def redactBody(methodPath:str, text:str, headers:dict):
+        text = PetoneerRecordingTransport.redactText(text, headers)
+        if (methodPath != API_LOGIN_PATH):
+            return text
+
+        # Login responses carry a new access token
+        try:
+            body = json.loads(text)
+        except (TypeError, ValueError):
+            return text
+
+        if (isinstance(body, dict) and isinstance(body.get('data'), dict) and ('accessToken' in body['data'])):
+            body['data']['accessToken'] = RECORDING_ACCESS_TOKEN
+            return json.dumps(body, separators=(',', ':'))
+        return text
+
+# -------------------------------------------------
+
+class PetoneerReplayTransport:
+    """
+    Serves responses from a recording instead of contacting the API. Requests are
+    matched on path and payload (falling back to path alone), and recorded responses
+    for the same request are served in their original order, wrapping around once
+    exhausted.
+
+    latency_mode is one of REPLAY_LATENCY_ORIGINAL (wait as long as the original
+    request took), REPLAY_LATENCY_SCALED (original latency * latency_scale) or
+    REPLAY_LATENCY_NONE (respond immediately).
+    """
+
+    def __init__(self, file_path:str, latency_mode:str = REPLAY_LATENCY_ORIGINAL, latency_scale:float = 1.0):
+        if (latency_mode not in (REPLAY_LATENCY_ORIGINAL, REPLAY_LATENCY_SCALED, REPLAY_LATENCY_NONE)):
+            raise PetoneerInvalidArgument('PetoneerReplayTransport', 'latency_mode', f'Unknown latency mode "{latency_mode}"')
+
+        self._latency_mode = latency_mode
+        self._latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._by_request = {}
+        self._by_path = {}
+        self._positions = {}
+        self._num_records = 0
+
+        opener = gzip.open if (file_path.endswith('.gz')) else open
+        with opener(file_path, 'rt', encoding='utf-8') as recording:
+            for line in recording:
+                if (line.strip() == ''):
+                    continue
+                record = json.loads(line)
+                self._by_request.setdefault(self._getRequestKey(record['path'], record.get('payload')), []).append(record)
+                self._by_path.setdefault(record['path'], []).append(record)
+                self._num_records += 1
+
+    def __len__(self):
+        return self._num_records
+
+    def request(self, methodPath:str, payload:dict, headers:dict, timeout_secs:float = None):
+        request_key = self._getRequestKey(methodPath, PetoneerRecordingTransport.redactPayload(payload))
+
+        with self._lock:
+            if (request_key in self._by_request):
+                record = self._nextRecord(request_key, self._by_request[request_key])
+            elif (methodPath in self._by_path):
+                record = self._nextRecord(methodPath, self._by_path[methodPath])
+            else:
+                raise ConnectionError(f'No recorded response for {methodPath}')
+
+        if (self._latency_mode == REPLAY_LATENCY_ORIGINAL):
+            latency = record.get('latency', 0)
+        elif (self._latency_mode == REPLAY_LATENCY_SCALED):
+            latency = record.get('latency', 0) * self._latency_scale
+        else:
+            latency = 0
+
+        if (timeout_secs != None) and (latency > timeout_secs):
+            sleep(timeout_secs)
+            raise PetoneerRequestTimeout(API_URL + methodPath, timeout_secs)
+
+        sleep(latency)
+
+        if ('error' in record):
+            raise ConnectionError(record['error'])
+
+        return PetoneerRecordedResponse(record['status'], record.get('url', API_URL + methodPath), record['body'])
+
+    def _nextRecord(self, key, records:list):
+        position = self._positions.get(key, 0)
+        self._positions[key] = position + 1
+        return records[position % len(records)]
+
+    def _getRequestKey(self, methodPath:str, payload):
+        return (methodPath, json.dumps(payload, sort_keys=True))